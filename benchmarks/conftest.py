@@ -0,0 +1,8 @@
+import pytest
+
+from benchmarks.fakes import InMemoryConnection
+
+
+@pytest.fixture
+def conn():
+    return InMemoryConnection()
@@ -0,0 +1,25 @@
+class InMemoryConnection:
+    """Connection stand-in that keeps schema_versions in memory and drops every
+    other statement, so benchmarks measure only client-side work."""
+
+    def __init__(self, applied=None):
+        self.applied = list(applied or [])
+        self.commands = 0
+
+    def command(self, statement, query_id=None, settings=None):
+        self.commands += 1
+
+    def query(self, _statement):
+        return [
+            {"version": m.version, "script": m.script, "md5": m.md5}
+            for m in self.applied
+        ]
+
+    def insert(self, _table, rows):
+        self.commands += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
@@ -0,0 +1,74 @@
+"""Synthetic inputs for the benchmarks.
+
+Sizes default to the scale we see in production and can be reduced through
+environment variables for a quick local run, e.g. BENCH_SCRIPT_MB=5.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import List
+
+from clickhouse_migrations.migration import Migration
+
+MIGRATION_FILES = int(os.environ.get("BENCH_FILES", "10000"))
+SCRIPT_MB = int(os.environ.get("BENCH_SCRIPT_MB", "100"))
+HISTORY_SIZE = int(os.environ.get("BENCH_HISTORY", "50000"))
+# Versions on each side of the merge of local and applied migrations.
+MERGE_VERSIONS = int(os.environ.get("BENCH_MERGE_VERSIONS", "100000"))
+# Simulated client-server latency (cross-region) and migrations per run for
+# the end-to-end runs against the stand-in server.
+LATENCY_MS = int(os.environ.get("BENCH_LATENCY_MS", "50"))
+STUB_MIGRATIONS = int(os.environ.get("BENCH_STUB_MIGRATIONS", "20"))
+
+# One chunk of a "seed" script: quoted strings and identifiers containing
+# semicolons, escaped quotes, line and block comments.
+_SCRIPT_CHUNK = """-- seed data; part {n}
+INSERT INTO `events;raw` ("id", "payload") VALUES
+    ({n}, 'it''s; a \\'quoted\\' value'), ({n}, "double; quoted");
+/* block comment; with 'quotes' and -- dashes */
+ALTER TABLE events UPDATE payload = 'x;y' WHERE id = {n};
+"""
+
+
+def make_script(size_bytes: int) -> str:
+    chunks: List[str] = []
+    total = 0
+    n = 0
+    while total < size_bytes:
+        chunk = _SCRIPT_CHUNK.format(n=n)
+        chunks.append(chunk)
+        total += len(chunk)
+        n += 1
+    return "".join(chunks)
+
+
+def make_migration_dir(path: Path, count: int, down: bool = False) -> Path:
+    """count migrations, and with down a down script for each."""
+    path.mkdir(parents=True, exist_ok=True)
+    for version in range(1, count + 1):
+        (path / f"{version:05d}_migration_{version}.sql").write_text(
+            f"CREATE TABLE t{version} (id UInt64, name String) "
+            "ENGINE = MergeTree ORDER BY id;\n"
+            f"INSERT INTO t{version} VALUES (1, 'a;b');\n",
+            encoding="utf8",
+        )
+        if down:
+            (path / f"{version:05d}_migration_{version}.down.sql").write_text(
+                f"DROP TABLE t{version};\n", encoding="utf8"
+            )
+    return path
+
+
+def make_migrations(count: int) -> List[Migration]:
+    migrations = []
+    for version in range(1, count + 1):
+        script = f"CREATE TABLE t{version} (id UInt64) ENGINE = Log;"
+        migrations.append(
+            Migration(
+                version=version,
+                md5=hashlib.md5(script.encode("utf8")).hexdigest(),
+                script=script,
+            )
+        )
+    return migrations
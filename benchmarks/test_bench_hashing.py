@@ -0,0 +1,76 @@
+import shutil
+import subprocess
+
+import pytest
+
+from benchmarks.generators import (
+    MIGRATION_FILES,
+    SCRIPT_MB,
+    make_migration_dir,
+    make_script,
+)
+from clickhouse_migrations.hashing import BLAKE2B, GIT, MD5, XXH3, hasher
+from clickhouse_migrations.migration import MigrationStorage
+
+
+@pytest.fixture(scope="session")
+def large_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp("large_migration") / "001_seed.sql"
+    path.write_text(make_script(SCRIPT_MB * 1024 * 1024), encoding="utf8")
+    return path
+
+
+def _hasher(algorithm):
+    if algorithm == XXH3:
+        pytest.importorskip("xxhash")
+    return hasher(algorithm)
+
+
+@pytest.mark.benchmark(group="hashing")
+@pytest.mark.parametrize("algorithm", [MD5, BLAKE2B, XXH3])
+def test_digest_large_file(benchmark, large_file, algorithm):
+    digest = _hasher(algorithm)
+    content = large_file.read_bytes()
+    # Throughput is this size over the mean time.
+    benchmark.extra_info["megabytes"] = len(content) / 1024 / 1024
+
+    assert benchmark.pedantic(digest, args=(content,), rounds=5)
+
+
+@pytest.mark.benchmark(group="hashing")
+@pytest.mark.parametrize("algorithm", [MD5, BLAKE2B, XXH3])
+def test_load_large_file(benchmark, large_file, algorithm):
+    _hasher(algorithm)
+
+    def load():
+        return MigrationStorage(large_file.parent, algorithm).migrations()
+
+    (migration,) = benchmark.pedantic(load, rounds=5)
+
+    assert migration.version == 1
+
+
+@pytest.fixture(scope="session")
+def checkout(tmp_path_factory):
+    if shutil.which("git") is None:
+        pytest.skip("git is not installed")
+    path = make_migration_dir(tmp_path_factory.mktemp("checkout"), MIGRATION_FILES)
+    for args in (["init", "-q"], ["add", "."], ["commit", "-q", "-m", "migrations"]):
+        subprocess.run(
+            ["git", "-c", "user.name=bench", "-c", "user.email=bench@example.com"]
+            + args,
+            cwd=path,
+            check=True,
+        )
+    return path
+
+
+@pytest.mark.benchmark(group="checkout")
+@pytest.mark.parametrize("algorithm", [MD5, GIT])
+def test_load_checkout(benchmark, checkout, algorithm):
+    # What status, and migrate with nothing pending, pay to know the digests.
+    migrations = benchmark.pedantic(
+        lambda: MigrationStorage(checkout, algorithm).migrations(), rounds=5
+    )
+
+    assert len(migrations) == MIGRATION_FILES
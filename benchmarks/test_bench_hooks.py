@@ -0,0 +1,37 @@
+"""Overhead of the hook interface on the statement fast path.
+
+Compare the groups in the pytest-benchmark report: "no hooks" must be on par
+with a run that never had hooks, while "noop hook" shows the price of just
+registering a listener (timing calls and event dispatch).
+"""
+
+import pytest
+
+from clickhouse_migrations.hooks import MigrationHook
+from clickhouse_migrations.migration import Migration
+from clickhouse_migrations.migrator import Migrator
+
+MIGRATIONS = [
+    Migration(
+        version=v,
+        md5=f"{v:032x}",
+        script="".join(
+            f"CREATE TABLE t{v}_{i} (x UInt8) ENGINE = Log;" for i in range(5)
+        ),
+    )
+    for v in range(1, 1001)
+]
+
+
+@pytest.mark.benchmark(group="hooks")
+def test_apply_without_hooks(benchmark, conn):
+    migrator = Migrator(conn)
+
+    benchmark(migrator.apply_migration, MIGRATIONS, True, fake=False)
+
+
+@pytest.mark.benchmark(group="hooks")
+def test_apply_with_noop_hook(benchmark, conn):
+    migrator = Migrator(conn, hooks=[MigrationHook()])
+
+    benchmark(migrator.apply_migration, MIGRATIONS, True, fake=False)
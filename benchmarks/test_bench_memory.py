@@ -0,0 +1,98 @@
+"""Memory held by the applied migrations of one database, as kept per tenant
+by fleet status and by watch, for MERGE_VERSIONS migrations.
+
+Each benchmark times building one representation and records the bytes it
+holds (traced with tracemalloc) as extra_info["bytes"].
+"""
+
+import tracemalloc
+
+import pytest
+
+from benchmarks.generators import MERGE_VERSIONS, make_migrations
+from clickhouse_migrations.migration import (
+    CompactMigration,
+    Migration,
+    MigrationDigests,
+)
+
+APPLIED_AT = "2024-01-01 00:00:00"
+
+
+@pytest.fixture(scope="module")
+def rows():
+    return _query_rows(make_migrations(MERGE_VERSIONS))
+
+
+def _query_rows(migrations):
+    # As a query returns them: strings of their own, not shared.
+    return [
+        {
+            "version": m.version,
+            "md5": m.md5[:16] + m.md5[16:],
+            "applied_at": APPLIED_AT[:10] + APPLIED_AT[10:],
+        }
+        for m in migrations
+    ]
+
+
+def _held_bytes(build, rows):
+    """Bytes still held by what build makes of a copy of rows once the copy
+    is dropped, as when a query result is only used to fill it."""
+    migrations = [Migration(row["version"], row["md5"], None) for row in rows]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        held = build(_query_rows(migrations))
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del held
+    return size
+
+
+def _applied_meta(rows):
+    return {row["version"]: (row["md5"], row["applied_at"]) for row in rows}
+
+
+def _migrations(rows):
+    return [Migration(row["version"], row["md5"], None) for row in rows]
+
+
+def _compact_migrations(rows):
+    return [CompactMigration(row["version"], row["md5"]) for row in rows]
+
+
+def _migration_digests(rows):
+    digests = MigrationDigests()
+    for row in rows:
+        digests.append(row["version"], row["md5"])
+    return digests
+
+
+@pytest.mark.benchmark(group="memory")
+@pytest.mark.parametrize(
+    "build",
+    [_applied_meta, _migrations, _compact_migrations, _migration_digests],
+    ids=["applied_meta", "migrations", "compact_migrations", "migration_digests"],
+)
+def test_applied_memory(benchmark, rows, build):
+    benchmark.extra_info["bytes"] = _held_bytes(build, rows)
+    benchmark.extra_info["bytes_per_migration"] = benchmark.extra_info["bytes"] / len(
+        rows
+    )
+
+    held = benchmark(build, rows)
+
+    assert len(held) == len(rows)
+
+
+def test_migration_digests_are_smallest(rows):
+    sizes = {
+        build.__name__: _held_bytes(build, rows)
+        for build in (_applied_meta, _migrations, _compact_migrations)
+    }
+
+    # Versions and digests alone, about 20 bytes a migration; more with few
+    # migrations, where the spare room of the growing buffers counts.
+    assert _held_bytes(_migration_digests, rows) * 2 < min(sizes.values())
@@ -0,0 +1,92 @@
+import pytest
+
+from benchmarks.fakes import InMemoryConnection
+from benchmarks.generators import HISTORY_SIZE, MERGE_VERSIONS, make_migrations
+from clickhouse_migrations.command_line import format_status
+from clickhouse_migrations.migrator import Migrator
+
+# Ten migrations are pending on top of the applied history.
+PENDING = 10
+
+
+@pytest.fixture(scope="module")
+def incoming():
+    return make_migrations(HISTORY_SIZE + PENDING)
+
+
+@pytest.fixture(scope="module")
+def applied(incoming):
+    return incoming[:HISTORY_SIZE]
+
+
+@pytest.fixture(scope="module")
+def applied_meta(applied):
+    return {m.version: (m.md5, "2024-01-01 00:00:00") for m in applied}
+
+
+@pytest.mark.benchmark(group="planning")
+def test_migrations_to_apply(benchmark, incoming, applied):
+    migrator = Migrator(InMemoryConnection(applied))
+
+    pending = benchmark(migrator.migrations_to_apply, incoming)
+
+    assert len(pending) == PENDING
+
+
+@pytest.mark.benchmark(group="planning")
+def test_build_status(benchmark, incoming, applied_meta):
+    # pylint: disable=protected-access
+    rows = benchmark(Migrator._build_status, incoming, applied_meta)
+
+    assert len(rows) == HISTORY_SIZE + PENDING
+
+
+@pytest.mark.benchmark(group="planning")
+def test_format_status(benchmark, incoming, applied_meta):
+    rows = Migrator._build_status(  # pylint: disable=protected-access
+        incoming, applied_meta
+    )
+
+    text = benchmark(format_status, rows)
+
+    assert text.count("\n") == len(rows)
+
+
+@pytest.fixture(scope="module")
+def long_incoming():
+    return make_migrations(MERGE_VERSIONS + PENDING)
+
+
+@pytest.mark.benchmark(group="merge")
+def test_merge_pending(benchmark, long_incoming):
+    applied = long_incoming[:MERGE_VERSIONS]
+
+    pending = benchmark(Migrator(None).migrations_to_apply, long_incoming, applied)
+
+    assert len(pending) == PENDING
+
+
+@pytest.mark.benchmark(group="merge")
+def test_merge_pending_streamed(benchmark, long_incoming):
+    applied = long_incoming[:MERGE_VERSIONS]
+
+    def plan():
+        return Migrator(None).migrations_to_apply(iter(long_incoming), iter(applied))
+
+    pending = benchmark(plan)
+
+    assert len(pending) == PENDING
+
+
+@pytest.mark.benchmark(group="merge")
+def test_merge_status(benchmark, long_incoming):
+    applied = {m.version: (m.md5, "2024-01-01 00:00:00") for m in long_incoming}
+    del applied[MERGE_VERSIONS + 1]
+
+    rows = benchmark(
+        Migrator._build_status,  # pylint: disable=protected-access
+        long_incoming,
+        applied,
+    )
+
+    assert len(rows) == MERGE_VERSIONS + PENDING
@@ -0,0 +1,125 @@
+import uuid
+
+import pytest
+
+from benchmarks.generators import (
+    HISTORY_SIZE,
+    LATENCY_MS,
+    STUB_MIGRATIONS,
+    make_migration_dir,
+    make_migrations,
+)
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.migrator import Migrator
+from tests.stub_server import ClickhouseStub
+
+pytest.importorskip("chdb")
+
+
+@pytest.fixture(scope="module")
+def stub():
+    with ClickhouseStub(latency=LATENCY_MS / 1000) as server:
+        yield server
+
+
+@pytest.fixture(scope="module")
+def migration_dir(tmp_path_factory):
+    return make_migration_dir(tmp_path_factory.mktemp("migrations"), STUB_MIGRATIONS)
+
+
+def _cluster(stub):
+    return ClickhouseCluster(
+        db_host=stub.host,
+        db_port=stub.port,
+        driver="clickhouse-connect",
+        compress=False,
+    )
+
+
+@pytest.mark.benchmark(group="round-trips")
+def test_migrate_fresh_database(benchmark, stub, migration_dir):
+    cluster = _cluster(stub)
+
+    def setup():
+        stub.reset()
+        return (f"bench_{uuid.uuid4().hex}", migration_dir), {}
+
+    applied = benchmark.pedantic(cluster.migrate, setup=setup, rounds=3)
+
+    assert len(applied) == STUB_MIGRATIONS
+    benchmark.extra_info["round_trips"] = stub.round_trips
+
+
+@pytest.mark.benchmark(group="round-trips")
+def test_status(benchmark, stub, migration_dir):
+    cluster = _cluster(stub)
+    db_name = f"bench_{uuid.uuid4().hex}"
+    cluster.migrate(db_name, migration_dir)
+    stub.reset()
+
+    rows = benchmark.pedantic(cluster.status, args=(db_name, migration_dir), rounds=3)
+
+    assert len(rows) == STUB_MIGRATIONS
+    benchmark.extra_info["round_trips"] = stub.round_trips // 3
+
+
+@pytest.mark.benchmark(group="round-trips")
+def test_ensure_migrated_at_head(benchmark, stub, migration_dir):
+    cluster = _cluster(stub)
+    db_name = f"bench_{uuid.uuid4().hex}"
+    cluster.migrate(db_name, migration_dir)
+    stub.reset()
+
+    applied = benchmark.pedantic(
+        cluster.ensure_migrated, args=(db_name, migration_dir), rounds=3
+    )
+
+    assert applied == []
+    benchmark.extra_info["round_trips"] = stub.round_trips // 3
+
+
+@pytest.fixture(scope="module")
+def long_history(stub):
+    """A database whose schema_versions holds HISTORY_SIZE migrations, and
+    those migrations plus one pending."""
+    cluster = _cluster(stub)
+    db_name = f"bench_{uuid.uuid4().hex}"
+    cluster.create_db(db_name)
+    cluster.init_schema(db_name)
+    incoming = make_migrations(HISTORY_SIZE + 1)
+    with cluster.connection(db_name) as conn:
+        conn.insert(
+            "schema_versions",
+            [
+                {"version": m.version, "md5": m.md5, "script": m.script}
+                for m in incoming[:-1]
+            ],
+        )
+    return cluster, db_name, incoming
+
+
+@pytest.mark.benchmark(group="applied")
+def test_plan_from_full_history(benchmark, long_history):
+    cluster, db_name, incoming = long_history
+
+    with cluster.connection(db_name) as conn:
+        pending = benchmark.pedantic(
+            Migrator(conn).migrations_to_apply, args=(incoming,), rounds=3
+        )
+
+    assert len(pending) == 1
+
+
+@pytest.mark.benchmark(group="applied")
+def test_plan_from_applied_diff(benchmark, long_history):
+    cluster, db_name, incoming = long_history
+
+    def plan(migrator):
+        return migrator.migrations_to_apply(
+            incoming, migrator.query_applied_diff(incoming)
+        )
+
+    with cluster.connection(db_name) as conn:
+        pending = benchmark.pedantic(plan, args=(Migrator(conn),), rounds=3)
+
+    assert len(pending) == 1
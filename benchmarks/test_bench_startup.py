@@ -0,0 +1,75 @@
+"""Startup time of the command line, for --help and version.
+
+The import of the CLI module is measured with python -X importtime in a
+fresh interpreter and kept under a budget; importing clickhouse-driver alone
+takes longer. extra_info["import_us"] is the median cumulative import time
+of clickhouse_migrations.command_line, in microseconds.
+"""
+
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import clickhouse_migrations
+
+SRC_DIR = Path(clickhouse_migrations.__file__).parent.parent
+
+# Cumulative import time budget of the CLI module, in microseconds.
+STARTUP_BUDGET_US = 150_000
+
+IMPORT_ROUNDS = 5
+
+
+def _import_time_us(module: str) -> int:
+    """Cumulative time python -X importtime reports for importing module in
+    a fresh interpreter, in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == module:
+            return int(cumulative)
+    raise AssertionError(f"{module} was not imported")
+
+
+# What the clickhouse-migrations script runs; with -c, sys.argv[1:] are args.
+CLI = (
+    "import sys; from clickhouse_migrations.command_line import main; sys.exit(main())"
+)
+
+
+def _run_cli(*args):
+    subprocess.run(
+        [sys.executable, "-c", CLI, *args],
+        cwd=SRC_DIR,
+        capture_output=True,
+        check=True,
+    )
+
+
+def test_cli_import_time_budget():
+    import_us = statistics.median(
+        _import_time_us("clickhouse_migrations.command_line")
+        for _ in range(IMPORT_ROUNDS)
+    )
+
+    assert import_us < STARTUP_BUDGET_US
+
+
+@pytest.mark.benchmark(group="startup")
+@pytest.mark.parametrize("args", [["--help"], ["version"]], ids=["help", "version"])
+def test_cli_startup(benchmark, args):
+    benchmark.extra_info["import_us"] = statistics.median(
+        _import_time_us("clickhouse_migrations.command_line")
+        for _ in range(IMPORT_ROUNDS)
+    )
+
+    benchmark.pedantic(_run_cli, args=args, rounds=10)
@@ -0,0 +1,53 @@
+import pytest
+
+from benchmarks.fakes import InMemoryConnection
+from benchmarks.generators import MIGRATION_FILES, make_migration_dir, make_migrations
+from clickhouse_migrations.bundle import MigrationBundle, write_bundle
+from clickhouse_migrations.migration import MigrationStorage
+from clickhouse_migrations.migrator import Migrator
+
+
+@pytest.fixture(scope="session")
+def migration_dir(tmp_path_factory):
+    return make_migration_dir(tmp_path_factory.mktemp("migrations"), MIGRATION_FILES)
+
+
+@pytest.mark.benchmark(group="storage")
+def test_load_migration_dir(benchmark, migration_dir):
+    # A new storage each round: the directory is only scanned once per storage.
+    migrations = benchmark(lambda: MigrationStorage(migration_dir).migrations())
+
+    assert len(migrations) == MIGRATION_FILES
+
+
+@pytest.mark.benchmark(group="storage")
+def test_load_migration_bundle(benchmark, migration_dir, tmp_path):
+    path = write_bundle(migration_dir, tmp_path / "migrations.bundle")
+
+    def load():
+        with MigrationBundle(path) as bundle:
+            return bundle.migrations()
+
+    migrations = benchmark(load)
+
+    assert len(migrations) == MIGRATION_FILES
+
+
+@pytest.fixture(scope="session")
+def down_dir(tmp_path_factory):
+    return make_migration_dir(
+        tmp_path_factory.mktemp("down_migrations"), MIGRATION_FILES, down=True
+    )
+
+
+@pytest.mark.benchmark(group="storage")
+def test_rollback_one_step(benchmark, down_dir):
+    conn = InMemoryConnection(make_migrations(MIGRATION_FILES))
+
+    def rollback():
+        down_scripts = MigrationStorage(down_dir).down_scripts()
+        return Migrator(conn).rollback_migration(down_scripts, steps=1)
+
+    rolled_back = benchmark(rollback)
+
+    assert rolled_back == [MIGRATION_FILES]
@@ -0,0 +1,48 @@
+import pytest
+
+from benchmarks.fakes import InMemoryConnection
+from benchmarks.generators import SCRIPT_MB, make_script
+from clickhouse_migrations.migration import Migration
+from clickhouse_migrations.migrator import Migrator
+
+
+@pytest.fixture(scope="session")
+def large_script():
+    return make_script(SCRIPT_MB * 1024 * 1024)
+
+
+@pytest.mark.benchmark(group="tokenize")
+def test_script_to_statements_large_script(benchmark, large_script):
+    # A single pass over the script takes seconds, so a few rounds are enough.
+    statements = benchmark.pedantic(
+        Migrator.script_to_statements, args=(large_script, True), rounds=3
+    )
+
+    assert statements
+
+
+# A release of seed scripts, together the size of the large script.
+SEED_SCRIPTS = 8
+
+
+@pytest.fixture(scope="session")
+def seed_migrations():
+    script = make_script(SCRIPT_MB * 1024 * 1024 // SEED_SCRIPTS)
+    return [
+        Migration(version=v, md5=f"md5{v}", script=script)
+        for v in range(1, SEED_SCRIPTS + 1)
+    ]
+
+
+@pytest.mark.benchmark(group="tokenize-release")
+@pytest.mark.parametrize("workers", [0, 4])
+def test_apply_seed_scripts(benchmark, seed_migrations, workers):
+    # Statements go nowhere: this is the tokenizing of the run, with workers
+    # processes splitting the scripts ahead when above 1.
+    def apply():
+        migrator = Migrator(InMemoryConnection(), tokenize_workers=workers)
+        return migrator.apply_migration(seed_migrations, True)
+
+    applied = benchmark.pedantic(apply, rounds=3)
+
+    assert len(applied) == SEED_SCRIPTS
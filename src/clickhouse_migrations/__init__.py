@@ -2,9 +2,21 @@
 Simple file-based migrations for clickhouse
 """
 
-from importlib.metadata import PackageNotFoundError, version
+# Bound by __getattr__ on first access.
+__version__: str
 
-try:
-    __version__ = version("clickhouse-migrations")
-except PackageNotFoundError:  # pragma: no cover
-    __version__ = "0.0.0"
+
+def __getattr__(name):
+    # Resolved on first access: importlib.metadata is slow to import and most
+    # invocations never print the version.
+    if name == "__version__":
+        # pylint: disable=import-outside-toplevel
+        from importlib.metadata import PackageNotFoundError, version
+
+        try:
+            value = version("clickhouse-migrations")
+        except PackageNotFoundError:  # pragma: no cover
+            value = "0.0.0"
+        globals()["__version__"] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
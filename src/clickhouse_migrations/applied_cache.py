@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.util import atomic_write_text
+
+# Applied migrations as returned by Migrator.query_applied_meta: md5 and time
+# of application by version.
+AppliedMeta = Dict[int, Tuple[str, object]]
+
+# Summary of schema_versions that any recorded, rolled back or rehashed
+# migration changes: one row, whatever the size of the history. created_at
+# only has seconds, so the digests of the rows are summed up too.
+_PROBE = (
+    "SELECT count() AS n, max(version) AS last_version, "
+    "toString(max(created_at)) AS last_applied_at, "
+    "groupBitXor(sipHash64(version, md5)) AS digests FROM schema_versions"
+)
+
+
+class AppliedCache:  # pylint: disable=too-few-public-methods
+    """Local cache of the applied migrations of databases, one JSON file per
+    database in directory.
+
+    Before each use, a probe of schema_versions (its row count, highest
+    version, latest created_at and a checksum of the digests) is compared
+    with the one taken when the entry was written, and the applied
+    migrations are only fetched again when it differs. Times of application
+    are kept as text.
+    """
+
+    def __init__(self, directory: Union[Path, str]):
+        self.directory = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        # Hashed: keys hold server addresses, possibly with credentials.
+        digest = hashlib.sha256(key.encode("utf8")).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def applied(
+        self, conn: Connection, key: str, fetch: Callable[[], AppliedMeta]
+    ) -> AppliedMeta:
+        """The applied migrations of the database of conn, identified by key;
+        fetch() queries them on a cache miss."""
+        probe = conn.query(_PROBE)[0]
+        entry = self._read(key)
+        if entry is None or entry["probe"] != probe:
+            logging.info("Applied migrations changed, fetching them")
+            entry = {
+                "probe": probe,
+                "applied": [
+                    [version, md5, str(applied_at)]
+                    for version, (md5, applied_at) in sorted(fetch().items())
+                ],
+            }
+            self._write(key, entry)
+
+        return {
+            version: (md5, applied_at) for version, md5, applied_at in entry["applied"]
+        }
+
+    def drop(self, key: str) -> None:
+        """Forget the entry of key, e.g. after rewriting its rows in place."""
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            logging.warning("Cannot drop the applied migrations cache: %s", exc)
+
+    def _read(self, key: str) -> Optional[Dict]:
+        try:
+            return json.loads(self._path(key).read_text(encoding="utf8"))
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key: str, entry: Dict) -> None:
+        # A cache that cannot be written only costs the next run a fetch.
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            atomic_write_text(self._path(key), json.dumps(entry))
+        except OSError as exc:
+            logging.warning("Cannot write the applied migrations cache: %s", exc)
@@ -0,0 +1,275 @@
+import json
+import mmap
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hashing import MD5
+from clickhouse_migrations.hooks import PHASE_HASH, PHASE_LOAD, MigrationHook
+from clickhouse_migrations.migration import (
+    Baseline,
+    BundledMigration,
+    DownScripts,
+    Migration,
+    MigrationStorage,
+    _is_selected,
+    _parse_version,
+)
+from clickhouse_migrations.migrator import Migrator
+from clickhouse_migrations.util import atomic_write_bytes
+
+# A bundle is this magic, the length of its header as an unsigned 64-bit
+# little-endian integer, the header (JSON) and the scripts, back to back. The
+# header holds the byte range of every script within the scripts, and for
+# migrations their md5 and the byte ranges of their statements.
+BUNDLE_MAGIC = b"CHMIGBN1"
+_HEADER_LENGTH = struct.Struct("<Q")
+
+# Fields of the header entries of migrations, down scripts and the baseline.
+_MIGRATION_FIELDS = ("version", "name", "md5", "offset", "length")
+_DOWN_FIELDS = ("version", "offset", "length")
+_BASELINE_FIELDS = ("version", "md5", "sources_md5", "offset", "length")
+
+
+def _check_entry(entry: Dict, fields: Tuple[str, ...], size: int) -> None:
+    """Raise ValueError unless entry has fields and its script, and the
+    statements within it, lie in the size bytes of scripts."""
+    missing = [field for field in fields if field not in entry]
+    if missing:
+        raise ValueError(f"entry without {', '.join(missing)}")
+    offset, length = entry["offset"], entry["length"]
+    if not (isinstance(offset, int) and isinstance(length, int)):
+        raise ValueError(f"byte range {offset!r}+{length!r} is not integers")
+    if offset < 0 or length < 0 or offset + length > size:
+        raise ValueError(
+            f"byte range {offset}+{length} is outside the {size} bytes of scripts"
+        )
+    for start, end in entry.get("statements", ()):
+        if not 0 <= start <= end <= length:
+            raise ValueError(
+                f"statement range {start}-{end} is outside its script of "
+                f"{length} bytes"
+            )
+
+
+class _BundleEntry:
+    """Script of a bundle, read from its mapping only when asked for."""
+
+    __slots__ = ("_data", "_offset", "_length", "_statements")
+
+    def __init__(self, data: mmap.mmap, offset: int, entry: Dict):
+        self._data = data
+        self._offset = offset + entry["offset"]
+        self._length = entry["length"]
+        self._statements = entry.get("statements", ())
+
+    def script(self) -> str:
+        return self._data[self._offset : self._offset + self._length].decode("utf8")
+
+    def statements(self) -> List[str]:
+        return [
+            self._data[self._offset + start : self._offset + end].decode("utf8") + ";"
+            for start, end in self._statements
+        ]
+
+
+class MigrationBundle:
+    """Migrations packed into one file by write_bundle, with the interface of
+    MigrationStorage.
+
+    The bundle is mapped in memory, until closed, and only its header is
+    parsed: scripts are read when a migration is applied (see
+    BundledMigration), never to list the migrations or compare their md5s.
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        try:
+            with open(self.path, "rb") as file:
+                self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as exc:
+            raise MigrationException(
+                f"Cannot open migration bundle {self.path}: {exc}"
+            ) from exc
+
+        start = len(BUNDLE_MAGIC) + _HEADER_LENGTH.size
+        if self._data[: len(BUNDLE_MAGIC)] != BUNDLE_MAGIC or len(self._data) < start:
+            self._data.close()
+            raise MigrationException(f"Not a migration bundle: {self.path}")
+        try:
+            self._header = self._read_header(start)
+        except (struct.error, ValueError, TypeError, KeyError, AttributeError) as exc:
+            self._data.close()
+            raise MigrationException(
+                f"Not a valid migration bundle: {self.path}: {exc}"
+            ) from exc
+
+    def _read_header(self, start: int) -> Dict:
+        """Parse the header found at start and check that every byte range it
+        holds lies within the bundle, so that a truncated or corrupt bundle is
+        rejected when opened rather than when a script is read."""
+        (length,) = _HEADER_LENGTH.unpack_from(self._data, len(BUNDLE_MAGIC))
+        self._scripts_offset = start + length
+        if self._scripts_offset > len(self._data):
+            raise ValueError(
+                f"header of {length} bytes is longer than the rest of the file"
+            )
+        header = json.loads(self._data[start : self._scripts_offset])
+
+        size = len(self._data) - self._scripts_offset
+        for entry in header["migrations"]:
+            _check_entry(entry, _MIGRATION_FIELDS, size)
+        for entry in header["down"]:
+            _check_entry(entry, _DOWN_FIELDS, size)
+        if header["baseline"] is not None:
+            _check_entry(header["baseline"], _BASELINE_FIELDS, size)
+        return header
+
+    def close(self) -> None:
+        """Unmap the bundle: its migrations cannot read their scripts after."""
+        self._data.close()
+
+    def __enter__(self) -> "MigrationBundle":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _entry(self, entry: Dict) -> _BundleEntry:
+        return _BundleEntry(self._data, self._scripts_offset, entry)
+
+    def migrations(
+        self,
+        explicit_migrations: Optional[List[str]] = None,
+        hooks: Sequence[MigrationHook] = (),
+    ) -> List[Migration]:
+        if hooks:
+            load_started = time.perf_counter()
+
+        migrations: List[Migration] = [
+            BundledMigration(entry["version"], entry["md5"], self._entry(entry))
+            for entry in self._header["migrations"]
+            if _is_selected(Path(entry["name"]), entry["version"], explicit_migrations)
+        ]
+
+        if hooks:
+            # The md5s were computed when bundling: nothing is hashed here.
+            duration = time.perf_counter() - load_started
+            for hook in hooks:
+                hook.on_phase(PHASE_LOAD, load_started, duration)
+                hook.on_phase(PHASE_HASH, load_started, 0.0)
+                hook.on_load(migrations, duration)
+
+        return migrations
+
+    def down_scripts(self) -> DownScripts:
+        return DownScripts(
+            {
+                entry["version"]: self._entry(entry).script
+                for entry in self._header["down"]
+            }
+        )
+
+    def baseline(self) -> Optional[Baseline]:
+        entry = self._header["baseline"]
+        if entry is None:
+            return None
+
+        return Baseline(
+            version=entry["version"],
+            md5=entry["md5"],
+            script=self._entry(entry).script(),
+            sources_md5=entry["sources_md5"],
+        )
+
+
+def open_migrations(
+    migration_path: Union[Path, str], hash_algorithm: str = MD5
+) -> Union[MigrationStorage, MigrationBundle]:
+    """The migrations of a bundle if migration_path is a file, else of the
+    migrations directory, digested with hash_algorithm. A bundle keeps the
+    digests it was written with. Both are context managers, closing the
+    bundle once its migrations are no longer used."""
+    if Path(migration_path).is_file():
+        return MigrationBundle(migration_path)
+    return MigrationStorage(migration_path, hash_algorithm)
+
+
+def _statement_ranges(script: str) -> List[Tuple[int, int]]:
+    spans = Migrator.statement_spans(script)
+    if script.isascii():
+        return spans
+    # Character offsets to offsets in the UTF-8 encoded script, in one pass:
+    # each gap and statement is encoded once.
+    ranges: List[Tuple[int, int]] = []
+    position = offset = 0
+    for start, end in spans:
+        offset += len(script[position:start].encode("utf8"))
+        begin = offset
+        offset += len(script[start:end].encode("utf8"))
+        ranges.append((begin, offset))
+        position = end
+    return ranges
+
+
+def write_bundle(
+    migration_path: Union[Path, str],
+    output: Optional[Union[Path, str]] = None,
+    hash_algorithm: str = MD5,
+) -> Path:
+    """Pack the migrations, down scripts and newest baseline of a directory
+    into one bundle, by default <migrations dir>.bundle next to it. The
+    migrations are digested with hash_algorithm."""
+    storage = MigrationStorage(migration_path, hash_algorithm)
+    names = {_parse_version(path.name): path.name for path in storage.filenames()}
+    down_scripts = storage.down_scripts()
+    baseline = storage.baseline()
+
+    scripts = bytearray()
+
+    def add(script: str, **fields) -> Dict:
+        data = script.encode("utf8")
+        entry = {**fields, "offset": len(scripts), "length": len(data)}
+        scripts.extend(data)
+        return entry
+
+    header = {
+        "migrations": [
+            add(
+                m.script,
+                version=m.version,
+                name=names[m.version],
+                md5=m.md5,
+                statements=_statement_ranges(m.script),
+            )
+            for m in storage.migrations()
+        ],
+        "down": [
+            add(script, version=version)
+            for version, script in sorted(down_scripts.items())
+        ],
+        "baseline": (
+            None
+            if baseline is None
+            else add(
+                baseline.script,
+                version=baseline.version,
+                md5=baseline.md5,
+                sources_md5=baseline.sources_md5,
+            )
+        ),
+    }
+
+    header_data = json.dumps(header, separators=(",", ":")).encode("utf8")
+    if output is None:
+        directory = storage.storage_dir.resolve()
+        output = directory.with_name(directory.name + ".bundle")
+    output = Path(output)
+    # Replaced at once: a bundle being mapped is never seen half written.
+    atomic_write_bytes(
+        output,
+        BUNDLE_MAGIC + _HEADER_LENGTH.pack(len(header_data)) + header_data + scripts,
+    )
+    return output
@@ -1,27 +1,74 @@
+import logging
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Callable, List, Optional, Union
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
-from clickhouse_driver import Client
-
+from clickhouse_migrations.applied_cache import AppliedCache
+from clickhouse_migrations.bundle import open_migrations
 from clickhouse_migrations.connection import (
+    CHDB,
     CLICKHOUSE_CONNECT,
     CLICKHOUSE_DRIVER,
     DEFAULT_PORT,
+    ChdbConnection,
+    ChdbSession,
     ClickhouseConnectConnection,
     ClickhouseDriverConnection,
     Connection,
+    import_chdb,
     import_clickhouse_connect,
+    import_clickhouse_driver,
 )
 from clickhouse_migrations.defaults import DB_HOST, DB_PASSWORD, DB_USER
+from clickhouse_migrations.drift import DriftRow, database_pattern, drifted_databases
 from clickhouse_migrations.exceptions import MigrationException
-from clickhouse_migrations.migration import Migration, MigrationStorage
-from clickhouse_migrations.migrator import STATUS_PENDING, Migrator, StatusRow
-from clickhouse_migrations.util import quote_identifier, quote_string
+from clickhouse_migrations.hashing import MD5, digest_algorithm, hasher
+from clickhouse_migrations.hooks import MigrationHook
+from clickhouse_migrations.lock import MigrationLock
+from clickhouse_migrations.metrics import MeteredConnection, RunMetrics
+from clickhouse_migrations.migration import (
+    BASELINE_DATABASE,
+    BASELINE_SUFFIX,
+    Baseline,
+    Migration,
+    MigrationDigests,
+    MigrationStorage,
+    _parse_version,
+    format_baseline,
+)
+from clickhouse_migrations.migrator import (
+    STATUS_PENDING,
+    FleetRow,
+    HeadChecksum,
+    Migrator,
+    StatsRow,
+    StatusRow,
+    at_head_query,
+    head_checksum,
+    head_checksum_query,
+)
+from clickhouse_migrations.rehash import (
+    other_digests_query,
+    recorded_head_checksum,
+    rehash_applied,
+)
+from clickhouse_migrations.replicas import ReplicaRow, query_replicas
+from clickhouse_migrations.schema import dependency_layers, schema_objects
+from clickhouse_migrations.util import (
+    atomic_write_text,
+    quote_identifier,
+    quote_string,
+    rewrite_database,
+)
 
 
 class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
-    def __init__(
+    def __init__(  # pylint: disable=too-many-locals
         self,
         db_host: str = DB_HOST,
         db_user: str = DB_USER,
@@ -31,13 +78,28 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
         db_name: Optional[str] = None,
         secure: bool = False,
         driver: str = CLICKHOUSE_DRIVER,
+        hooks: Optional[List[MigrationHook]] = None,
+        chdb_path: Optional[Union[Path, str]] = None,
+        applied_cache: Optional[Union[Path, str]] = None,
+        hash_algorithm: str = MD5,
+        tokenize_workers: int = 0,
         **kwargs,
     ):
         self.db_url: Optional[str] = None
+        self.hooks: List[MigrationHook] = list(hooks or [])
         self.default_db_name: Optional[str] = db_name
         self.secure: bool = secure
         self.driver: str = driver
         self.connection_kwargs = kwargs
+        self.chdb_path = chdb_path
+        self._chdb_session = None
+        self.applied_cache: Optional[AppliedCache] = (
+            AppliedCache(applied_cache) if applied_cache is not None else None
+        )
+        # Fails now on an unknown algorithm or a missing xxhash package.
+        hasher(hash_algorithm)
+        self.hash_algorithm = hash_algorithm
+        self.tokenize_workers = tokenize_workers
         self._parsed_url = None
 
         if db_url:
@@ -66,14 +128,42 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
             self.db_user = db_user
             self.db_password = db_password
 
+    def add_hook(self, hook: MigrationHook) -> None:
+        """Register a listener for the events of every subsequent migrate run."""
+        self.hooks.append(hook)
+
+    def _run_hooks(self, metrics: Optional[RunMetrics]) -> List[MigrationHook]:
+        if metrics is None:
+            return self.hooks
+        return [*self.hooks, metrics]
+
     def _resolved_port(self):
         if self.db_port is not None:
             return self.db_port
         return DEFAULT_PORT[self.driver]
 
+    def _chdb(self):
+        # One session per cluster: an in-memory session loses its data once
+        # dropped, so it must outlive the connections created from it.
+        if self._chdb_session is None:
+            chdb = import_chdb()
+            path = str(self.chdb_path) if self.chdb_path is not None else None
+            try:
+                session = chdb.session.Session(path)
+            except RuntimeError as exc:
+                # chDB runs a single engine per process, bound to one path.
+                raise MigrationException(f"Cannot open chdb session: {exc}") from exc
+            # Return UInt64/Int64 as JSON numbers, like the other drivers do.
+            session.query("SET output_format_json_quote_64bit_integers = 0")
+            self._chdb_session = ChdbSession(session)
+        return self._chdb_session
+
     def connection(self, db_name: Optional[str] = None) -> Connection:
         db_name = db_name if db_name is not None else self.default_db_name
 
+        if self.driver == CHDB:
+            return ChdbConnection(self._chdb(), db_name)
+
         if self.driver == CLICKHOUSE_CONNECT:
             clickhouse_connect = import_clickhouse_connect()
             client = clickhouse_connect.get_client(
@@ -83,9 +173,11 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
                 password=self.db_password,
                 database=db_name or None,
                 secure=self.secure,
+                **self.connection_kwargs,
             )
             return ClickhouseConnectConnection(client)
 
+        Client = import_clickhouse_driver().Client
         if self._parsed_url is not None:
             parsed = self._parsed_url
             if db_name:
@@ -103,12 +195,49 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
             )
         return ClickhouseDriverConnection(ch_client)
 
+    def _metered_connection(
+        self, db_name: Optional[str], metrics: Optional[RunMetrics]
+    ) -> Connection:
+        conn = self.connection(db_name)
+        if metrics is None:
+            return conn
+        return MeteredConnection(conn, metrics)
+
+    def _applied_cache_key(self, db_name: str) -> str:
+        if self.driver == CHDB:
+            server = f"chdb:{self.chdb_path or ':memory:'}"
+        elif self.db_url is not None:
+            server = self.db_url
+        else:
+            server = (
+                f"{self.driver}://{self.db_user}@{self.db_host}:{self._resolved_port()}"
+            )
+        return f"{server}/{db_name}"
+
+    def _applied_migrations(
+        self,
+        conn: Connection,
+        migrator: Migrator,
+        db_name: str,
+        migrations: List[Migration],
+    ) -> List[Migration]:
+        if self.applied_cache is None:
+            return migrator.query_applied_diff(migrations)
+        applied = self.applied_cache.applied(
+            conn, self._applied_cache_key(db_name), migrator.query_applied_meta
+        )
+        # Planning only compares versions and md5s: scripts are not cached.
+        return [Migration(version, md5, None) for version, (md5, _) in applied.items()]
+
     def create_db(
-        self, db_name: Optional[str] = None, cluster_name: Optional[str] = None
+        self,
+        db_name: Optional[str] = None,
+        cluster_name: Optional[str] = None,
+        metrics: Optional[RunMetrics] = None,
     ):
         db_name = db_name if db_name is not None else self.default_db_name
 
-        with self.connection("") as conn:
+        with self._metered_connection("", metrics) as conn:
             if cluster_name is None:
                 conn.command(
                     f"CREATE DATABASE IF NOT EXISTS {quote_identifier(db_name)}"
@@ -134,7 +263,7 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
         with self.connection(db_name) as conn:
             return [row["name"] for row in conn.query("SHOW TABLES")]
 
-    def migrate(
+    def migrate(  # pylint: disable=too-many-locals
         self,
         db_name: Optional[str],
         migration_path: Union[Path, str],
@@ -145,22 +274,111 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
         explicit_migrations: Optional[List[str]] = None,
         fake: bool = False,
         migration_log_format: str = "full",
+        collect_stats: bool = False,
+        metrics: Optional[RunMetrics] = None,
+        record_fingerprint: bool = False,
+        lock_ttl: Optional[float] = None,
+        lock_grace: Optional[float] = None,
     ):
         db_name = db_name if db_name is not None else self.default_db_name
+        if metrics is not None and metrics.database is None:
+            metrics.database = db_name
+
+        # Bundled scripts are read from the bundle until the run is done.
+        with open_migrations(migration_path, self.hash_algorithm) as storage:
+            return self.apply_migrations(
+                db_name,
+                storage.migrations(explicit_migrations, hooks=self._run_hooks(metrics)),
+                cluster_name=cluster_name,
+                create_db_if_no_exists=create_db_if_no_exists,
+                multi_statement=multi_statement,
+                dryrun=dryrun,
+                fake=fake,
+                migration_log_format=migration_log_format,
+                collect_stats=collect_stats,
+                metrics=metrics,
+                # A baseline stands in for the whole history, never for a selection.
+                load_baseline=None if explicit_migrations else storage.baseline,
+                record_fingerprint=record_fingerprint,
+                lock_ttl=lock_ttl,
+                lock_grace=lock_grace,
+            )
 
-        storage = MigrationStorage(migration_path)
-        migrations = storage.migrations(explicit_migrations)
-
-        return self.apply_migrations(
-            db_name,
-            migrations,
-            cluster_name=cluster_name,
-            create_db_if_no_exists=create_db_if_no_exists,
-            multi_statement=multi_statement,
-            dryrun=dryrun,
-            fake=fake,
-            migration_log_format=migration_log_format,
+    def ensure_migrated(
+        self,
+        db_name: Optional[str],
+        migration_path: Union[Path, str],
+        cluster_name: Optional[str] = None,
+        multi_statement: bool = True,
+        metrics: Optional[RunMetrics] = None,
+        lock_ttl: Optional[float] = None,
+        lock_grace: Optional[float] = None,
+    ) -> List[Migration]:
+        """Make sure every migration is applied, e.g. when a service starts.
+
+        The HeadChecksum of the local migrations is compared with the one the
+        server computes over schema_versions, in one query. When they match,
+        nothing else is read or written and [] is returned; otherwise this
+        falls back to migrate, which verifies the applied migrations one by
+        one and applies the pending ones.
+        """
+        db_name = db_name if db_name is not None else self.default_db_name
+        if metrics is not None and metrics.database is None:
+            metrics.database = db_name
+
+        with open_migrations(migration_path, self.hash_algorithm) as storage:
+            incoming = storage.migrations(hooks=self._run_hooks(metrics))
+
+            with self.connection("") as conn:
+                initialized = conn.query(
+                    "SELECT count() AS n FROM system.tables "
+                    f"WHERE database = {quote_string(db_name)} AND name = 'schema_versions'"
+                )[0]["n"]
+                if initialized and self._at_head(conn, db_name, incoming):
+                    return []
+
+            return self.apply_migrations(
+                db_name,
+                incoming,
+                cluster_name=cluster_name,
+                multi_statement=multi_statement,
+                metrics=metrics,
+                load_baseline=storage.baseline,
+                lock_ttl=lock_ttl,
+                lock_grace=lock_grace,
+            )
+
+    def _at_head(
+        self, conn: Connection, db_name: str, incoming: List[Migration]
+    ) -> bool:
+        """Whether the migrations applied to db_name are incoming, compared by
+        HeadChecksum. Only when they differ are the digests recorded with
+        another algorithm than that of incoming (before rehash) read, to digest
+        those migrations again as recorded."""
+        row = conn.query(head_checksum_query(db_name))[0]
+        # 64-bit integers come back as strings from some drivers.
+        applied = HeadChecksum(*(int(row[f]) for f in HeadChecksum._fields))
+        if applied == head_checksum(incoming):
+            logging.info("Database %s is at head", db_name)
+            return True
+
+        algorithm = (
+            digest_algorithm(incoming[0].md5) if incoming else self.hash_algorithm
         )
+        recorded = {
+            int(row["version"]): row["md5"]
+            for row in conn.query(other_digests_query(db_name, algorithm))
+        }
+        if recorded and applied == recorded_head_checksum(incoming, recorded):
+            logging.info(
+                "Database %s is at head, with %d digests recorded with another "
+                "algorithm than %s; run rehash to record them with it",
+                db_name,
+                len(recorded),
+                algorithm,
+            )
+            return True
+        return False
 
     def status(
         self,
@@ -170,22 +388,277 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
     ) -> List[StatusRow]:
         db_name = db_name if db_name is not None else self.default_db_name
 
-        storage = MigrationStorage(migration_path)
-        incoming = storage.migrations(explicit_migrations)
+        with open_migrations(migration_path, self.hash_algorithm) as storage:
+            incoming = storage.migrations(explicit_migrations)
+
+            # Read-only: never create the database or the schema table. If the
+            # schema table is missing, nothing has been applied yet.
+            with self.connection("") as conn:
+                initialized = conn.query(
+                    "SELECT count() AS n FROM system.tables "
+                    f"WHERE database = {quote_string(db_name)} AND name = 'schema_versions'"
+                )[0]["n"]
+
+            if not initialized:
+                return [
+                    StatusRow(m.version, STATUS_PENDING, m.md5, None) for m in incoming
+                ]
+
+            with self.connection(db_name) as conn:
+                migrator = Migrator(conn)
+                if self.applied_cache is None:
+                    return migrator.migration_status(incoming)
+                applied = self.applied_cache.applied(
+                    conn, self._applied_cache_key(db_name), migrator.query_applied_meta
+                )
+                return migrator.migration_status(incoming, applied)
+
+    def rehash(
+        self,
+        db_name: Optional[str],
+        migration_path: Union[Path, str],
+        wait: bool = False,
+        dryrun: bool = False,
+    ) -> List[int]:
+        """Record the digests of the applied migrations made with another
+        algorithm than hash_algorithm again, with it, after checking them
+        against the local migrations (see rehash.py)."""
+        db_name = db_name if db_name is not None else self.default_db_name
+
+        with open_migrations(migration_path, self.hash_algorithm) as storage:
+            incoming = storage.migrations()
+
+            with self.connection("") as conn:
+                initialized = conn.query(
+                    "SELECT count() AS n FROM system.tables "
+                    f"WHERE database = {quote_string(db_name)} AND name = 'schema_versions'"
+                )[0]["n"]
+
+            if not initialized:
+                return []
+
+            with self.connection(db_name) as conn:
+                rehashed = rehash_applied(conn, incoming, wait=wait, dryrun=dryrun)
+            # Rewritten in place: fetched again rather than left to the probe.
+            if rehashed and not dryrun and self.applied_cache is not None:
+                self.applied_cache.drop(self._applied_cache_key(db_name))
+            return rehashed
+
+    def fleet_status(
+        self,
+        migration_path: Union[Path, str],
+        db_pattern: Optional[str] = None,
+        explicit_migrations: Optional[List[str]] = None,
+    ) -> List[FleetRow]:
+        """Status of every database with a schema_versions table (optionally
+        only those matching the db_pattern regular expression) against the
+        local migrations, with two queries whatever the number of databases."""
+        with open_migrations(migration_path, self.hash_algorithm) as storage:
+            incoming = storage.migrations(explicit_migrations)
+
+            condition = (
+                ""
+                if db_pattern is None
+                else f" AND match(database, {quote_string(db_pattern)})"
+            )
+
+            with self.connection("") as conn:
+                databases = [
+                    row["database"]
+                    for row in conn.query(
+                        "SELECT database FROM system.tables "
+                        f"WHERE name = 'schema_versions'{condition}"
+                    )
+                ]
+                if not databases:
+                    return []
+
+                names = "^(?:" + "|".join(re.escape(db) for db in databases) + ")$"
+                rows = conn.query(
+                    "SELECT _database AS database, version, "
+                    "argMax(md5, created_at) AS md5 "
+                    f"FROM merge(REGEXP({quote_string(names)}), '^schema_versions$') "
+                    "GROUP BY database, version ORDER BY database, version"
+                )
+
+            # Columnar: hundreds of databases with long histories stay small.
+            applied = {database: MigrationDigests() for database in databases}
+            for row in rows:
+                applied[row["database"]].append(row["version"], row["md5"])
+            return Migrator.fleet_status(incoming, applied)
 
-        # Read-only: never create the database or the schema table. If the
-        # schema table is missing, nothing has been applied yet.
+    def stats(self, db_name: Optional[str]) -> List[StatsRow]:
+        db_name = db_name if db_name is not None else self.default_db_name
+
+        # Read-only: statistics exist only after a run with collect_stats.
         with self.connection("") as conn:
-            initialized = conn.query(
+            collected = conn.query(
                 "SELECT count() AS n FROM system.tables "
-                f"WHERE database = {quote_string(db_name)} AND name = 'schema_versions'"
+                f"WHERE database = {quote_string(db_name)} "
+                "AND name = 'schema_versions_stats'"
             )[0]["n"]
 
-        if not initialized:
-            return [StatusRow(m.version, STATUS_PENDING, m.md5, None) for m in incoming]
+        if not collected:
+            return []
 
         with self.connection(db_name) as conn:
-            return Migrator(conn).migration_status(incoming)
+            return Migrator(conn).query_stats()
+
+    def drift(
+        self,
+        db_name: Optional[str] = None,
+        db_pattern: Optional[str] = None,
+        diff: bool = False,
+    ) -> List[DriftRow]:
+        """Databases whose schema changed since migrate last recorded its
+        fingerprint (see record_fingerprint). db_pattern is a regular
+        expression checking many databases at once; without it only db_name
+        is checked. With diff, every row lists the changed definitions."""
+        if db_pattern is None:
+            db_name = db_name if db_name is not None else self.default_db_name
+            db_pattern = database_pattern(db_name)
+
+        with self.connection("") as conn:
+            return drifted_databases(conn, db_pattern, diff=diff)
+
+    def verify_replicas(
+        self, db_name: Optional[str], cluster_name: Optional[str]
+    ) -> List[ReplicaRow]:
+        """Applied migrations and schema fingerprint of the database on every
+        replica of the cluster, read with one distributed query through the
+        connected server, and whether each replica is ok, lags or diverged."""
+        db_name = db_name if db_name is not None else self.default_db_name
+        if not cluster_name:
+            raise MigrationException("Verifying replicas requires a cluster name")
+
+        with self.connection("") as conn:
+            return query_replicas(conn, db_name, cluster_name)
+
+    def squash(
+        self,
+        migration_path: Union[Path, str],
+        up_to: int,
+        output: Optional[Union[Path, str]] = None,
+        multi_statement: bool = True,
+    ) -> Path:
+        """Write a baseline of the schema left by the migrations up to a version.
+
+        The migrations are replayed into a scratch database, whose tables,
+        views and dictionaries are then read back in dependency order. Only
+        the schema is captured, not rows inserted by the migrations.
+        """
+        storage = MigrationStorage(migration_path, self.hash_algorithm)
+        migrations = [m for m in storage.migrations() if m.version <= up_to]
+        if not migrations or migrations[-1].version != up_to:
+            raise MigrationException(f"No migration with version {up_to}")
+
+        scratch = f"squash_{uuid.uuid4().hex}"
+        self.create_db(scratch)
+        try:
+            with self.connection(scratch) as conn:
+                migrator = Migrator(conn)
+                migrator.init_schema()
+                migrator.apply_migration(migrations, multi_statement)
+                statements = [
+                    rewrite_database(obj.create_query, scratch, BASELINE_DATABASE)
+                    for layer in dependency_layers(schema_objects(conn, scratch))
+                    for obj in sorted(layer, key=lambda obj: obj.name)
+                ]
+        finally:
+            with self.connection("") as conn:
+                conn.command(f"DROP DATABASE IF EXISTS {quote_identifier(scratch)}")
+
+        if output is None:
+            # Reuse the zero padding of the squashed migration's file name.
+            prefix = next(
+                path.name.split("_")[0]
+                for path in storage.filenames()
+                if _parse_version(path.name) == up_to
+            )
+            output = storage.storage_dir / f"{prefix}_baseline{BASELINE_SUFFIX}"
+
+        atomic_write_text(output, format_baseline(migrations, statements))
+        return Path(output)
+
+    def provision(
+        self,
+        db_name: Optional[str],
+        template_db: str,
+        parallelism: int = 4,
+    ) -> List[str]:
+        """Create a database as a schema-only copy of a fully migrated template.
+
+        The template's tables, views and dictionaries are read with one
+        system.tables query and recreated layer by layer in dependency order,
+        up to parallelism at a time. Its schema_versions rows are then copied
+        with one INSERT ... SELECT, so the new database is already at head.
+        Returns the names of the created objects.
+        """
+        db_name = db_name if db_name is not None else self.default_db_name
+        if parallelism < 1:
+            raise MigrationException("parallelism must be >= 1")
+
+        with self.connection("") as conn:
+            counts = conn.query(
+                "SELECT database, count() AS n, "
+                "countIf(name = 'schema_versions') AS initialized "
+                "FROM system.tables "
+                f"WHERE database IN ({quote_string(template_db)}, "
+                f"{quote_string(db_name)}) GROUP BY database"
+            )
+            counts = {row["database"]: row for row in counts}
+            if not counts.get(template_db, {}).get("initialized"):
+                raise MigrationException(
+                    f"Template database {template_db} has no schema_versions table"
+                )
+            if counts.get(db_name, {}).get("n"):
+                raise MigrationException(f"Database {db_name} is not empty")
+
+            layers = dependency_layers(schema_objects(conn, template_db))
+
+        self.create_db(db_name)
+        self._create_in_layers(
+            [
+                [
+                    rewrite_database(obj.create_query, template_db, db_name)
+                    for obj in layer
+                ]
+                for layer in layers
+            ],
+            parallelism,
+        )
+
+        with self.connection(db_name) as conn:
+            Migrator(conn).init_schema()
+            conn.command(
+                "INSERT INTO schema_versions (version, md5, script) "
+                "SELECT DISTINCT version, md5, script "
+                f"FROM {quote_identifier(template_db)}.schema_versions"
+            )
+
+        return [obj.name for layer in layers for obj in layer]
+
+    def _create_in_layers(self, layers: List[List[str]], parallelism: int) -> None:
+        # Statements are fully qualified, so every worker keeps one
+        # server-level connection for all the statements it runs.
+        local = threading.local()
+
+        with (
+            ExitStack() as connections,
+            ThreadPoolExecutor(
+                max_workers=parallelism, thread_name_prefix="provision"
+            ) as pool,
+        ):
+
+            def execute(statement: str) -> None:
+                if not hasattr(local, "conn"):
+                    local.conn = connections.enter_context(self.connection(""))
+                local.conn.command(statement)
+
+            for layer in layers:
+                # Consume the results so the first failure stops the run
+                # before the next layer starts.
+                list(pool.map(execute, layer))
 
     def rollback(
         self,
@@ -198,29 +671,30 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
     ) -> List[int]:
         db_name = db_name if db_name is not None else self.default_db_name
 
-        down_scripts = MigrationStorage(migration_path).down_scripts()
-
-        # Read-only pre-check: if the schema table is missing, nothing has been
-        # applied yet, so there is nothing to roll back.
-        with self.connection("") as conn:
-            initialized = conn.query(
-                "SELECT count() AS n FROM system.tables "
-                f"WHERE database = {quote_string(db_name)} AND name = 'schema_versions'"
-            )[0]["n"]
-
-        if not initialized:
-            return []
-
-        with self.connection(db_name) as conn:
-            migrator = Migrator(conn, dryrun)
-            return migrator.rollback_migration(
-                down_scripts,
-                steps=steps,
-                to_version=to_version,
-                multi_statement=multi_statement,
-            )
+        with open_migrations(migration_path, self.hash_algorithm) as storage:
+            down_scripts = storage.down_scripts()
+
+            # Read-only pre-check: if the schema table is missing, nothing has been
+            # applied yet, so there is nothing to roll back.
+            with self.connection("") as conn:
+                initialized = conn.query(
+                    "SELECT count() AS n FROM system.tables "
+                    f"WHERE database = {quote_string(db_name)} AND name = 'schema_versions'"
+                )[0]["n"]
+
+            if not initialized:
+                return []
+
+            with self.connection(db_name) as conn:
+                migrator = Migrator(conn, dryrun)
+                return migrator.rollback_migration(
+                    down_scripts,
+                    steps=steps,
+                    to_version=to_version,
+                    multi_statement=multi_statement,
+                )
 
-    def apply_migrations(
+    def apply_migrations(  # pylint: disable=too-many-locals
         self,
         db_name: str,
         migrations: List[Migration],
@@ -230,14 +704,66 @@ class ClickhouseCluster:  # pylint: disable=too-many-instance-attributes
         multi_statement: bool = True,
         fake: bool = False,
         migration_log_format: str = "full",
+        collect_stats: bool = False,
+        metrics: Optional[RunMetrics] = None,
+        load_baseline: Optional[Callable[[], Optional[Baseline]]] = None,
+        record_fingerprint: bool = False,
+        lock_ttl: Optional[float] = None,
+        lock_grace: Optional[float] = None,
     ) -> List[Migration]:
+        """Apply the pending migrations to the database.
+
+        load_baseline returns the baseline to apply to a database without
+        history; it is not called for the others.
+
+        With lock_ttl, concurrent runners (e.g. one per deployed pod) take a
+        lease with that TTL in seconds (see MigrationLock): one applies the
+        migrations, the others wait and return an empty list as soon as the
+        applied migrations are exactly these. A claim of the lease is held
+        after lock_grace seconds without an older one showing up.
+        """
+        lock_ttl = None if dryrun else lock_ttl
         if create_db_if_no_exists:
             if cluster_name is None:
-                self.create_db(db_name)
+                self.create_db(db_name, metrics=metrics)
             else:
-                self.create_db(db_name, cluster_name)
-
-        with self.connection(db_name) as conn:
-            migrator = Migrator(conn, dryrun, migration_log_format=migration_log_format)
+                self.create_db(db_name, cluster_name, metrics=metrics)
+
+        with self._metered_connection(db_name, metrics) as conn:
+            migrator = Migrator(
+                conn,
+                dryrun,
+                migration_log_format=migration_log_format,
+                collect_stats=collect_stats,
+                hooks=self._run_hooks(metrics),
+                record_fingerprint=record_fingerprint,
+                tokenize_workers=self.tokenize_workers,
+            )
             migrator.init_schema(cluster_name)
-            return migrator.apply_migration(migrations, multi_statement, fake=fake)
+            if lock_ttl is None:
+                return migrator.apply_migration(
+                    migrations,
+                    multi_statement,
+                    fake=fake,
+                    load_baseline=load_baseline,
+                    applied=self._applied_migrations(
+                        conn, migrator, db_name, migrations
+                    ),
+                )
+
+            migrator.init_lock_table(cluster_name)
+            lock = MigrationLock(conn, lock_ttl, grace=lock_grace)
+            # Done only when the applied migrations are exactly these: a
+            # backfilled version, an edited script or an unknown one still
+            # take the lock, and are then planned and verified as without it.
+            if not lock.wait(at_head_query(db_name, head_checksum(migrations))):
+                logging.info("Migrations were applied by another runner")
+                return []
+            with lock.held(lambda: self.connection(db_name)):
+                return migrator.apply_migration(
+                    migrations,
+                    multi_statement,
+                    fake=fake,
+                    load_baseline=load_baseline,
+                    applied=migrator.query_applied_diff(migrations),
+                )
@@ -4,20 +4,43 @@ import os
 import sys
 from argparse import ArgumentParser
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, List
 
-from clickhouse_migrations import __version__
-from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+import clickhouse_migrations
 from clickhouse_migrations.connection import CLICKHOUSE_DRIVER, DRIVERS
 from clickhouse_migrations.defaults import (
     DB_HOST,
     DB_PASSWORD,
     DB_USER,
     MIGRATIONS_DIR,
+    WATCH_POLL_INTERVAL,
 )
+from clickhouse_migrations.drift import DriftRow
 from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hashing import HASH_ALGORITHMS, MD5
+from clickhouse_migrations.hooks import load_hook
 from clickhouse_migrations.migration import Migration
-from clickhouse_migrations.migrator import MIGRATION_LOG_FORMATS, Migrator, StatusRow
+from clickhouse_migrations.migrator import (
+    MIGRATION_LOG_FORMATS,
+    FleetRow,
+    Migrator,
+    StatsRow,
+    StatusRow,
+)
+from clickhouse_migrations.replicas import REPLICA_OK, ReplicaRow
+from clickhouse_migrations.reports import (
+    format_drift,
+    format_fleet_status,
+    format_replicas,
+    format_stats,
+)
+from clickhouse_migrations.util import format_table
+
+# The cluster (with its bundle and metrics modules), the watcher and the profiler
+# are imported when used, so that --help and version start without them.
+# pylint: disable=import-outside-toplevel
+if TYPE_CHECKING:
+    from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
 
 
 def log_level(value: str) -> str:
@@ -42,11 +65,38 @@ def migration_log_format(value: str) -> str:
     )
 
 
+class _VersionAction(argparse.Action):
+    """Like action="version", but looks the version up only when asked for."""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, **kwargs):
+        kwargs.setdefault("help", "show program's version number and exit")
+        super().__init__(
+            option_strings, dest, default=argparse.SUPPRESS, nargs=0, **kwargs
+        )
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(f"{parser.prog} {clickhouse_migrations.__version__}")
+        parser.exit()
+
+
 def cast_to_bool(value: str):
     return value.lower() in ("1", "true", "yes", "y")
 
 
-SUBCOMMANDS = ("migrate", "status", "down", "version")
+SUBCOMMANDS = (
+    "migrate",
+    "status",
+    "down",
+    "stats",
+    "squash",
+    "bundle",
+    "provision",
+    "drift",
+    "verify-replicas",
+    "watch",
+    "rehash",
+    "version",
+)
 
 
 def _add_common_arguments(parser):
@@ -72,6 +122,11 @@ def _add_common_arguments(parser):
         choices=DRIVERS,
         help="ClickHouse driver to use",
     )
+    parser.add_argument(
+        "--chdb-path",
+        default=os.environ.get("CHDB_PATH", None),
+        help="Data directory of the embedded chdb engine (default: in-memory)",
+    )
     parser.add_argument(
         "--db-user",
         default=os.environ.get("DB_USER", DB_USER),
@@ -91,7 +146,8 @@ def _add_common_arguments(parser):
         "--migrations-dir",
         default=os.environ.get("MIGRATIONS_DIR", MIGRATIONS_DIR),
         type=Path,
-        help="Path to the directory with migration files",
+        help="Path to the directory with migration files, or to a bundle "
+        "written by the bundle command",
     )
     parser.add_argument(
         "--cluster-name",
@@ -110,6 +166,27 @@ def _add_common_arguments(parser):
         action=argparse.BooleanOptionalAction,
         help="Use secure connection",
     )
+    parser.add_argument(
+        "--applied-cache",
+        default=os.environ.get("APPLIED_CACHE", None),
+        type=Path,
+        help="Directory caching the applied migrations of every database, "
+        "only fetched again when schema_versions changed",
+    )
+    parser.add_argument(
+        "--hash-algorithm",
+        default=os.environ.get("HASH_ALGORITHM", MD5),
+        choices=HASH_ALGORITHMS,
+        help="Algorithm digesting the migration files; digests recorded with "
+        "another one keep verifying (default: md5, xxh3 needs xxhash)",
+    )
+    parser.add_argument(
+        "--tokenize-workers",
+        default=int(os.environ.get("TOKENIZE_WORKERS", "0")),
+        type=int,
+        help="Processes splitting large pending scripts into statements ahead "
+        "of their execution (default: 0, split as they execute)",
+    )
     default_migrations = os.environ.get("MIGRATIONS", "")
     parser.add_argument(
         "--migrations",
@@ -153,6 +230,192 @@ def _add_migrate_arguments(parser):
         action=argparse.BooleanOptionalAction,
         help="Create database if it does not exist",
     )
+    parser.add_argument(
+        "--collect-stats",
+        default=cast_to_bool(os.environ.get("COLLECT_STATS", "0")),
+        action=argparse.BooleanOptionalAction,
+        help="Tag every statement with a query_id/log_comment and store its "
+        "system.query_log statistics in schema_versions_stats",
+    )
+    parser.add_argument(
+        "--lock",
+        default=cast_to_bool(os.environ.get("LOCK", "0")),
+        action=argparse.BooleanOptionalAction,
+        help="Let one of several concurrent runners apply the migrations while "
+        "the others wait for it (a lease in schema_versions_lock)",
+    )
+    parser.add_argument(
+        "--lock-ttl",
+        default=float(os.environ.get("LOCK_TTL", "60")),
+        type=float,
+        help="Seconds the --lock lease lasts without renewal (default: 60)",
+    )
+    parser.add_argument(
+        "--lock-grace",
+        default=float(os.environ.get("LOCK_GRACE", "1")),
+        type=float,
+        help="Seconds a --lock claim waits for older claims still being "
+        "inserted or replicated before it holds the lease (default: 1)",
+    )
+    parser.add_argument(
+        "--record-fingerprint",
+        default=cast_to_bool(os.environ.get("RECORD_FINGERPRINT", "0")),
+        action=argparse.BooleanOptionalAction,
+        help="Record a fingerprint of the schema in schema_versions_fingerprints "
+        "after the run, for the drift subcommand",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=os.environ.get("METRICS_FILE", None),
+        type=Path,
+        help="Atomically write OpenMetrics run metrics to this file after the run "
+        "(e.g. for node_exporter's textfile collector)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=cast_to_bool(os.environ.get("PROFILE", "0")),
+        action=argparse.BooleanOptionalAction,
+        help="Time every phase and statement and print a summary table",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        default=cast_to_bool(os.environ.get("PROFILE_MEMORY", "0")),
+        action=argparse.BooleanOptionalAction,
+        help="Also record tracemalloc peak memory; without --trace-out, implies "
+        "--profile",
+    )
+    parser.add_argument(
+        "--trace-out",
+        default=os.environ.get("TRACE_OUT", None),
+        type=Path,
+        help="Write a Chrome trace-event JSON of the run (open it in Perfetto)",
+    )
+    default_hooks = os.environ.get("HOOKS", "")
+    parser.add_argument(
+        "--hook",
+        dest="hooks",
+        default=default_hooks.split(",") if default_hooks else [],
+        action="append",
+        help="Register a migration hook given as module:Class "
+        "(a clickhouse_migrations.hooks.MigrationHook subclass). Repeatable.",
+    )
+
+
+def _add_stats_arguments(parser):
+    parser.add_argument(
+        "--limit",
+        default=10,
+        type=int,
+        help="Number of migrations to show per ranking (default: 10)",
+    )
+
+
+def _add_squash_arguments(parser):
+    parser.add_argument(
+        "--up-to",
+        required=True,
+        type=int,
+        help="Version of the last migration to squash into the baseline",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        type=Path,
+        help="Baseline file to write "
+        "(default: <migrations-dir>/<VERSION>_baseline.baseline.sql)",
+    )
+    parser.add_argument(
+        "--multi-statement",
+        default=cast_to_bool(os.environ.get("MULTI_STATEMENT", "1")),
+        action=argparse.BooleanOptionalAction,
+        help="Treat each migration file as multiple ';'-separated statements",
+    )
+
+
+def _add_bundle_arguments(parser):
+    parser.add_argument(
+        "--output",
+        default=None,
+        type=Path,
+        help="Bundle file to write (default: <migrations-dir>.bundle)",
+    )
+
+
+def _add_db_pattern_argument(parser, default_help: str):
+    parser.add_argument(
+        "--db-pattern",
+        default=os.environ.get("DB_PATTERN", None),
+        help=f"Regular expression of the databases to check at once ({default_help})",
+    )
+
+
+def _add_status_arguments(parser):
+    parser.add_argument(
+        "--fleet",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Summarize every migrated database at once instead of --db-name",
+    )
+    _add_db_pattern_argument(
+        parser, "with --fleet; default: every database with a schema_versions table"
+    )
+
+
+def _add_drift_arguments(parser):
+    _add_db_pattern_argument(parser, "default: only --db-name")
+    parser.add_argument(
+        "--diff",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="List the changed tables and columns of every drifted database",
+    )
+
+
+def _add_provision_arguments(parser):
+    parser.add_argument(
+        "--from-template",
+        dest="template_db",
+        required=True,
+        help="Fully migrated database whose schema is copied",
+    )
+    parser.add_argument(
+        "--parallelism",
+        default=4,
+        type=int,
+        help="Number of objects created at once (default: 4)",
+    )
+
+
+def _add_watch_arguments(parser):
+    parser.add_argument(
+        "--multi-statement",
+        default=cast_to_bool(os.environ.get("MULTI_STATEMENT", "1")),
+        action=argparse.BooleanOptionalAction,
+        help="Treat each migration file as multiple ';'-separated statements",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        default=float(os.environ.get("POLL_INTERVAL", WATCH_POLL_INTERVAL)),
+        type=float,
+        help="Seconds between two scans of the migrations directory where "
+        f"inotify is not available (default: {WATCH_POLL_INTERVAL})",
+    )
+
+
+def _add_rehash_arguments(parser):
+    parser.add_argument(
+        "--wait",
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Wait for the server to update every row instead of letting it "
+        "run in the background",
+    )
+    parser.add_argument(
+        "--dry-run",
+        default=cast_to_bool(os.environ.get("DRY_RUN", "0")),
+        action=argparse.BooleanOptionalAction,
+        help="Dry run mode",
+    )
 
 
 def _add_down_arguments(parser):
@@ -188,8 +451,7 @@ def get_context(args):
     parser = ArgumentParser(prog="clickhouse-migrations")
     parser.add_argument(
         "--version",
-        action="version",
-        version=f"%(prog)s {__version__}",
+        action=_VersionAction,
     )
 
     subparsers = parser.add_subparsers(dest="command")
@@ -203,6 +465,7 @@ def get_context(args):
         "status", help="Show applied vs pending migrations without applying anything"
     )
     _add_common_arguments(status_parser)
+    _add_status_arguments(status_parser)
 
     down_parser = subparsers.add_parser(
         "down",
@@ -211,6 +474,68 @@ def get_context(args):
     _add_common_arguments(down_parser)
     _add_down_arguments(down_parser)
 
+    stats_parser = subparsers.add_parser(
+        "stats",
+        help="Show the slowest and most memory-hungry migrations "
+        "recorded with --collect-stats",
+    )
+    _add_common_arguments(stats_parser)
+    _add_stats_arguments(stats_parser)
+
+    squash_parser = subparsers.add_parser(
+        "squash",
+        help="Write a baseline with the schema left by the migrations up to "
+        "a version, applied at once to new databases",
+    )
+    _add_common_arguments(squash_parser)
+    _add_squash_arguments(squash_parser)
+
+    bundle_parser = subparsers.add_parser(
+        "bundle",
+        help="Pack the migrations directory into a single indexed file, "
+        "usable as --migrations-dir",
+    )
+    _add_common_arguments(bundle_parser)
+    _add_bundle_arguments(bundle_parser)
+
+    provision_parser = subparsers.add_parser(
+        "provision",
+        help="Create a database as a schema-only copy of a migrated template",
+    )
+    _add_common_arguments(provision_parser)
+    _add_provision_arguments(provision_parser)
+
+    drift_parser = subparsers.add_parser(
+        "drift",
+        help="List databases whose schema changed since migrate recorded "
+        "its fingerprint",
+    )
+    _add_common_arguments(drift_parser)
+    _add_drift_arguments(drift_parser)
+
+    verify_replicas_parser = subparsers.add_parser(
+        "verify-replicas",
+        help="Compare the applied migrations and schema of every replica "
+        "of --cluster-name",
+    )
+    _add_common_arguments(verify_replicas_parser)
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Apply new migrations as they are added to the migrations "
+        "directory, until interrupted",
+    )
+    _add_common_arguments(watch_parser)
+    _add_watch_arguments(watch_parser)
+
+    rehash_parser = subparsers.add_parser(
+        "rehash",
+        help="Record the digests of applied migrations made with another "
+        "algorithm than --hash-algorithm again, with it",
+    )
+    _add_common_arguments(rehash_parser)
+    _add_rehash_arguments(rehash_parser)
+
     subparsers.add_parser("version", help="Show the version and exit")
 
     # Default to the "migrate" subcommand so existing invocations
@@ -224,7 +549,9 @@ def get_context(args):
     return parser.parse_args(args)
 
 
-def create_cluster(ctx) -> ClickhouseCluster:
+def create_cluster(ctx) -> "ClickhouseCluster":
+    from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+
     return ClickhouseCluster(
         db_host=ctx.db_host,
         db_port=ctx.db_port,
@@ -233,10 +560,15 @@ def create_cluster(ctx) -> ClickhouseCluster:
         db_url=ctx.db_url,
         secure=ctx.secure,
         driver=ctx.driver,
+        chdb_path=ctx.chdb_path,
+        applied_cache=ctx.applied_cache,
+        hash_algorithm=ctx.hash_algorithm,
+        tokenize_workers=ctx.tokenize_workers,
+        hooks=[load_hook(spec) for spec in getattr(ctx, "hooks", [])],
     )
 
 
-def do_migrate(cluster, ctx) -> List[Migration]:
+def do_migrate(cluster, ctx, metrics=None) -> List[Migration]:
     return cluster.migrate(
         db_name=ctx.db_name,
         migration_path=ctx.migrations_dir,
@@ -247,6 +579,11 @@ def do_migrate(cluster, ctx) -> List[Migration]:
         dryrun=ctx.dry_run,
         fake=ctx.fake,
         migration_log_format=ctx.migration_log_format,
+        collect_stats=ctx.collect_stats,
+        metrics=metrics,
+        record_fingerprint=ctx.record_fingerprint,
+        lock_ttl=ctx.lock_ttl if ctx.lock else None,
+        lock_grace=ctx.lock_grace,
     )
 
 
@@ -264,6 +601,59 @@ def do_status(cluster, ctx) -> List[StatusRow]:
     )
 
 
+def do_fleet_status(cluster, ctx) -> List[FleetRow]:
+    return cluster.fleet_status(
+        migration_path=ctx.migrations_dir,
+        db_pattern=ctx.db_pattern,
+        explicit_migrations=ctx.migrations,
+    )
+
+
+def do_stats(cluster, ctx) -> List[StatsRow]:
+    return cluster.stats(db_name=ctx.db_name)
+
+
+def do_squash(cluster, ctx) -> Path:
+    return cluster.squash(
+        migration_path=ctx.migrations_dir,
+        up_to=ctx.up_to,
+        output=ctx.output,
+        multi_statement=ctx.multi_statement,
+    )
+
+
+def do_drift(cluster, ctx) -> List[DriftRow]:
+    return cluster.drift(db_name=ctx.db_name, db_pattern=ctx.db_pattern, diff=ctx.diff)
+
+
+def do_verify_replicas(cluster, ctx) -> List[ReplicaRow]:
+    return cluster.verify_replicas(db_name=ctx.db_name, cluster_name=ctx.cluster_name)
+
+
+def do_provision(cluster, ctx) -> List[str]:
+    if ctx.cluster_name:
+        # The copy would exist on the node connected to only, recorded as
+        # migrated all the same.
+        raise MigrationException(
+            "provision does not support --cluster-name: objects are created "
+            "on the connected node only, without ON CLUSTER"
+        )
+    return cluster.provision(
+        db_name=ctx.db_name,
+        template_db=ctx.template_db,
+        parallelism=ctx.parallelism,
+    )
+
+
+def do_rehash(cluster, ctx) -> List[int]:
+    return cluster.rehash(
+        db_name=ctx.db_name,
+        migration_path=ctx.migrations_dir,
+        wait=ctx.wait,
+        dryrun=ctx.dry_run,
+    )
+
+
 def do_rollback(cluster, ctx) -> List[int]:
     return cluster.rollback(
         db_name=ctx.db_name,
@@ -290,18 +680,47 @@ def format_status(rows: List[StatusRow]) -> str:
             )
         )
 
-    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
-    return "\n".join(
-        "  ".join(cell.ljust(widths[i]) for i, cell in enumerate(row)) for row in table
-    )
+    return format_table(table)
 
 
 def migrate(ctx) -> List[Migration]:
     logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
 
     cluster = create_cluster(ctx)
-    migrations = do_migrate(cluster, ctx)
-    return migrations
+    # Alone, --profile-memory reports the peak in the summary table.
+    profile = ctx.profile or (ctx.profile_memory and ctx.trace_out is None)
+    if not profile and ctx.trace_out is None:
+        return _run_migrate(cluster, ctx)
+
+    from clickhouse_migrations.profiler import Profiler
+
+    profiler = Profiler(trace_memory=ctx.profile_memory)
+    cluster.add_hook(profiler)
+    try:
+        return _run_migrate(cluster, ctx)
+    finally:
+        if profile:
+            print(profiler.summary())
+        if ctx.trace_out is not None:
+            profiler.write_trace(ctx.trace_out)
+
+
+def _run_migrate(cluster, ctx) -> List[Migration]:
+    if ctx.metrics_file is None:
+        return do_migrate(cluster, ctx)
+
+    from clickhouse_migrations.metrics import RunMetrics, write_openmetrics
+
+    # Written even when the run fails, so last_run_success can be alerted on.
+    metrics = RunMetrics(ctx.db_name or cluster.default_db_name)
+    try:
+        migrations = do_migrate(cluster, ctx, metrics)
+        metrics.finish(success=True)
+        return migrations
+    finally:
+        if not metrics.success:
+            metrics.finish(success=False)
+        write_openmetrics(ctx.metrics_file, [metrics])
 
 
 def show_status(ctx) -> List[StatusRow]:
@@ -313,6 +732,24 @@ def show_status(ctx) -> List[StatusRow]:
     return rows
 
 
+def show_fleet_status(ctx) -> List[FleetRow]:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    rows = do_fleet_status(cluster, ctx)
+    print(format_fleet_status(rows))
+    return rows
+
+
+def show_stats(ctx) -> List[StatsRow]:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    rows = do_stats(cluster, ctx)
+    print(format_stats(rows, ctx.limit))
+    return rows
+
+
 def rollback(ctx) -> List[int]:
     logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
 
@@ -320,18 +757,130 @@ def rollback(ctx) -> List[int]:
     return do_rollback(cluster, ctx)
 
 
+def squash(ctx) -> Path:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    path = do_squash(cluster, ctx)
+    print(f"Baseline written to {path}")
+    return path
+
+
+def bundle(ctx) -> Path:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    from clickhouse_migrations.bundle import write_bundle
+
+    path = write_bundle(ctx.migrations_dir, ctx.output, ctx.hash_algorithm)
+    print(f"Bundle written to {path}")
+    return path
+
+
+def rehash(ctx) -> List[int]:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    versions = do_rehash(cluster, ctx)
+    print(f"Rehashed {len(versions)} applied migrations with {ctx.hash_algorithm}")
+    return versions
+
+
+def show_drift(ctx) -> List[DriftRow]:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    rows = do_drift(cluster, ctx)
+    print(format_drift(rows))
+    return rows
+
+
+def show_replicas(ctx) -> List[ReplicaRow]:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    rows = do_verify_replicas(cluster, ctx)
+    print(format_replicas(rows))
+    return rows
+
+
+def provision(ctx) -> List[str]:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    cluster = create_cluster(ctx)
+    created = do_provision(cluster, ctx)
+    print(
+        f"Provisioned {ctx.db_name or cluster.default_db_name} "
+        f"from {ctx.template_db} with {len(created)} objects"
+    )
+    return created
+
+
+def watch(ctx) -> None:
+    logging.basicConfig(level=ctx.log_level, style="{", format="{levelname}:{message}")
+
+    from clickhouse_migrations.watch import Watcher
+
+    cluster = create_cluster(ctx)
+    with Watcher(
+        cluster,
+        ctx.db_name,
+        ctx.migrations_dir,
+        cluster_name=ctx.cluster_name,
+        multi_statement=ctx.multi_statement,
+        poll_interval=ctx.poll_interval,
+    ) as watcher:
+        logging.info("Watching %s, press Ctrl+C to stop", ctx.migrations_dir)
+        try:
+            watcher.watch()
+        except KeyboardInterrupt:
+            pass
+
+
+def _drift_found(ctx) -> bool:
+    return bool(show_drift(ctx))
+
+
+def _replicas_inconsistent(ctx) -> bool:
+    return any(row.state != REPLICA_OK for row in show_replicas(ctx))
+
+
+def _status(ctx) -> None:
+    if ctx.fleet:
+        show_fleet_status(ctx)
+    else:
+        show_status(ctx)
+
+
+def _print_version(_ctx) -> None:
+    print(f"clickhouse-migrations {clickhouse_migrations.__version__}")
+
+
+_COMMANDS = {
+    "version": _print_version,
+    "migrate": migrate,
+    "status": _status,
+    "down": rollback,
+    "stats": show_stats,
+    "squash": squash,
+    "bundle": bundle,
+    "provision": provision,
+    "watch": watch,
+    "rehash": rehash,
+}
+
+# Checks fail the command when they find something, so they can gate a deploy.
+_CHECKS = {
+    "drift": _drift_found,
+    "verify-replicas": _replicas_inconsistent,
+}
+
+
 def main() -> int:
     ctx = get_context(sys.argv[1:])
-    if ctx.command == "version":
-        print(f"clickhouse-migrations {__version__}")
-        return 0
     try:
-        if ctx.command == "status":
-            show_status(ctx)
-        elif ctx.command == "down":
-            rollback(ctx)
-        else:
-            migrate(ctx)
+        if ctx.command in _CHECKS:
+            return 1 if _CHECKS[ctx.command](ctx) else 0
+        _COMMANDS[ctx.command](ctx)
     except MigrationException as exc:
         logging.error("Migration failed: %s", exc)
         return 1
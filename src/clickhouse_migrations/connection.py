@@ -1,18 +1,30 @@
+import json
 import logging
+import threading
 from abc import ABC, abstractmethod
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.util import quote_identifier
 
 CLICKHOUSE_DRIVER = "clickhouse-driver"
 CLICKHOUSE_CONNECT = "clickhouse-connect"
-DRIVERS = (CLICKHOUSE_DRIVER, CLICKHOUSE_CONNECT)
+CHDB = "chdb"
+DRIVERS = (CLICKHOUSE_DRIVER, CLICKHOUSE_CONNECT, CHDB)
 
 # Default native (clickhouse-driver) / HTTP (clickhouse-connect) ports, used
 # when the caller does not set a port explicitly.
 DEFAULT_PORT = {CLICKHOUSE_DRIVER: 9000, CLICKHOUSE_CONNECT: 8123}
 
 
+def import_clickhouse_driver():
+    # Imported on first connection only: clickhouse-driver is slow to import
+    # and not needed by the other drivers or by version/--help.
+    import clickhouse_driver  # pylint: disable=import-outside-toplevel
+
+    return clickhouse_driver
+
+
 def import_clickhouse_connect():
     try:
         import clickhouse_connect  # pylint: disable=import-outside-toplevel
@@ -25,6 +37,18 @@ def import_clickhouse_connect():
     return clickhouse_connect
 
 
+def import_chdb():
+    try:
+        import chdb.session  # pylint: disable=import-outside-toplevel
+    except ImportError as exc:
+        raise MigrationException(
+            "The chdb driver is not installed. "
+            "Install it with: pip install 'clickhouse-migrations[chdb]'"
+        ) from exc
+
+    return chdb
+
+
 class Connection(ABC):
     """Driver-agnostic connection used by the migrator.
 
@@ -33,13 +57,25 @@ class Connection(ABC):
     """
 
     @abstractmethod
-    def command(self, statement: str) -> None:
-        """Execute a statement that does not return rows (DDL/DML)."""
+    def command(
+        self,
+        statement: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict] = None,
+    ) -> None:
+        """Execute a statement that does not return rows (DDL/DML).
+
+        query_id and settings are forwarded to the server as-is, so callers can
+        tag a statement (e.g. with a log_comment) and find it in system.query_log.
+        """
         raise NotImplementedError  # pragma: no cover
 
     @abstractmethod
-    def query(self, statement: str) -> List[Dict]:
-        """Execute a query and return its rows as dicts keyed by column name."""
+    def query(self, statement: str, settings: Optional[Dict] = None) -> List[Dict]:
+        """Execute a query and return its rows as dicts keyed by column name.
+
+        settings are forwarded to the server as-is, ahead of the query.
+        """
         raise NotImplementedError  # pragma: no cover
 
     @abstractmethod
@@ -62,13 +98,20 @@ class ClickhouseDriverConnection(Connection):
     def __init__(self, client):
         self._client = client
 
-    def command(self, statement: str) -> None:
+    def command(
+        self,
+        statement: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict] = None,
+    ) -> None:
         logging.debug(statement)
-        self._client.execute(statement)
+        self._client.execute(statement, query_id=query_id, settings=settings)
 
-    def query(self, statement: str) -> List[Dict]:
+    def query(self, statement: str, settings: Optional[Dict] = None) -> List[Dict]:
         logging.debug(statement)
-        data, columns = self._client.execute(statement, with_column_types=True)
+        data, columns = self._client.execute(
+            statement, with_column_types=True, settings=settings
+        )
         names = [c[0] for c in columns]
         return [dict(zip(names, row)) for row in data]
 
@@ -96,13 +139,21 @@ class ClickhouseConnectConnection(Connection):
     def __init__(self, client):
         self._client = client
 
-    def command(self, statement: str) -> None:
+    def command(
+        self,
+        statement: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict] = None,
+    ) -> None:
         logging.debug(statement)
-        self._client.command(statement)
+        # query_id is a transport setting in clickhouse-connect.
+        if query_id is not None:
+            settings = {**(settings or {}), "query_id": query_id}
+        self._client.command(statement, settings=settings)
 
-    def query(self, statement: str) -> List[Dict]:
+    def query(self, statement: str, settings: Optional[Dict] = None) -> List[Dict]:
         logging.debug(statement)
-        result = self._client.query(statement)
+        result = self._client.query(statement, settings=settings)
         return [dict(zip(result.column_names, row)) for row in result.result_rows]
 
     def insert(self, table: str, rows: List[Dict]) -> None:
@@ -115,3 +166,78 @@ class ClickhouseConnectConnection(Connection):
 
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         self._client.close()
+
+
+class ChdbSession:
+    """chDB session shared by the connections of a cluster.
+
+    The current database belongs to the session, not to a connection, so
+    every statement first switches to the database of its connection, under
+    a lock, when another connection or a USE in a command switched away from
+    it.
+    """
+
+    def __init__(self, session):
+        self._session = session
+        self._lock = threading.RLock()
+        self._database: Optional[str] = None
+
+    def query(self, database: str, statement: str, fmt: str = "CSV"):
+        with self._lock:
+            if database != self._database:
+                self._session.query(f"USE {quote_identifier(database)}")
+                self._database = database
+            return self._session.query(statement, fmt)
+
+    def command(self, database: str, statement: str) -> None:
+        with self._lock:
+            try:
+                self.query(database, statement)
+            finally:
+                # A script may switch the database itself with USE.
+                self._database = None
+
+
+class ChdbConnection(Connection):
+    """Connection backed by chDB (ClickHouse engine running in-process).
+
+    The session is owned by the cluster and shared by every connection, so
+    closing a connection keeps its data. chDB has no query log, so query_id
+    is not forwarded, and neither are settings: queries pass theirs in a
+    SETTINGS clause.
+    """
+
+    def __init__(self, session: ChdbSession, database: Optional[str] = None):
+        self._session = session
+        self._database = database or "default"
+        # Fails early, like the other drivers, when the database is missing.
+        self._session.query(self._database, "SELECT 1")
+
+    def command(
+        self,
+        statement: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict] = None,
+    ) -> None:
+        logging.debug(statement)
+        self._session.command(self._database, statement)
+
+    def query(self, statement: str, settings: Optional[Dict] = None) -> List[Dict]:
+        logging.debug(statement)
+        result = self._session.query(self._database, statement, "JSONEachRow")
+        return [json.loads(line) for line in result.bytes().splitlines() if line]
+
+    def insert(self, table: str, rows: List[Dict]) -> None:
+        columns = list(rows[0].keys())
+        column_list = ", ".join(columns)
+        data = "\n".join(json.dumps(row, default=str) for row in rows)
+        self._session.query(
+            self._database,
+            f"INSERT INTO {table} ({column_list}) FORMAT JSONEachRow\n{data}",
+        )
+
+    def __enter__(self) -> "ChdbConnection":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
@@ -10,3 +10,6 @@ DB_PASSWORD = ""
 MIGRATIONS_DIR = abspath(Path(os.getcwd()) / "migrations")
 
 DB_URL = "clickhouse://default:@localhost:9000/db_placeholder"
+
+# Seconds between two scans of a watched migrations directory (see watch).
+WATCH_POLL_INTERVAL = 1.0
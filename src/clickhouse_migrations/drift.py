@@ -0,0 +1,140 @@
+import re
+from collections import namedtuple
+from typing import List, Mapping
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.util import quote_string
+
+FINGERPRINTS_TABLE = "schema_versions_fingerprints"
+
+# A database whose schema no longer matches the fingerprint recorded by its
+# last migrate run. changes is None unless a column-level diff was requested.
+DriftRow = namedtuple(
+    "DriftRow",
+    ["database", "version", "recorded_at", "recorded", "current", "changes"],
+)
+
+# One differing definition: name is a table or table.column; recorded or
+# current is None when the object was added or dropped since the record.
+DefinitionChange = namedtuple("DefinitionChange", ["name", "recorded", "current"])
+
+# Aggregates over the rows of schema_definitions(). The fingerprint is an XOR
+# of per-definition hashes, so it does not depend on the order rows come in.
+FINGERPRINT = "groupBitXor(cityHash64(name, definition))"
+DEFINITIONS = "mapFromArrays(groupArray(name), groupArray(definition))"
+
+
+def schema_definitions(
+    condition: str,
+    key: str = "database",
+    columns: str = "system.columns",
+    tables: str = "system.tables",
+) -> str:
+    """Rows (key..., name, definition) for every table and column of the
+    databases matching condition, with the database name itself stripped so
+    that identical schemas have identical fingerprints. columns and tables
+    name the sources, e.g. to read them from every replica of a cluster."""
+    strip = "replaceAll({}, concat(database, '.'), '')"
+    skipped = "NOT startsWith({0}, 'schema_versions') AND NOT startsWith({0}, '.inner')"
+    return (
+        f"SELECT {key}, concat(table, '.', name) AS name, "
+        "concat(type, "
+        "if(default_kind = '', '', concat(' ', default_kind, ' ', "
+        "default_expression)), "
+        "if(compression_codec = '', '', concat(' ', compression_codec))"
+        ") AS definition "
+        f"FROM {columns} WHERE {condition} AND {skipped.format('table')} "
+        "UNION ALL "
+        f"SELECT {key}, name, "
+        f"concat(if(engine_full = '', engine, {strip.format('engine_full')}), "
+        f"if(as_select = '', '', concat(' AS ', {strip.format('as_select')}))) "
+        f"FROM {tables} WHERE {condition} AND {skipped.format('name')} "
+        "AND NOT is_temporary"
+    )
+
+
+def record_fingerprint_query(force: bool) -> str:
+    """INSERT ... SELECT recording the fingerprint of the current database.
+
+    Unless force is set, a row is only written when none exists yet, so a
+    run that applied nothing cannot make a hand-made change look expected.
+    """
+    return (
+        f"INSERT INTO {FINGERPRINTS_TABLE} (version, fingerprint, definitions) "
+        "SELECT (SELECT max(version) FROM schema_versions), "
+        f"{FINGERPRINT}, {DEFINITIONS} "
+        f"FROM ({schema_definitions('database = currentDatabase()')}) "
+        f"HAVING {int(force)} OR (SELECT count() FROM {FINGERPRINTS_TABLE}) = 0"
+    )
+
+
+def database_pattern(db_name: str) -> str:
+    """Regular expression matching exactly one database name."""
+    return "^" + re.escape(db_name) + "$"
+
+
+def definition_changes(
+    recorded: Mapping[str, str], current: Mapping[str, str]
+) -> List[DefinitionChange]:
+    return [
+        DefinitionChange(name, recorded.get(name), current.get(name))
+        for name in sorted(recorded.keys() | current.keys())
+        if recorded.get(name) != current.get(name)
+    ]
+
+
+def drifted_databases(
+    conn: Connection, pattern: str, diff: bool = False
+) -> List[DriftRow]:
+    """Compare the last recorded fingerprint of every database matching the
+    regular expression with its current schema, in one query, and return the
+    databases that differ."""
+    condition = f"match(database, {quote_string(pattern)})"
+
+    recorded = conn.query(
+        "SELECT count() AS n FROM system.tables "
+        f"WHERE {condition} AND name = {quote_string(FINGERPRINTS_TABLE)}"
+    )[0]["n"]
+    if not recorded:
+        return []
+
+    definitions = (
+        ", r.definitions AS recorded_definitions, c.definitions AS current_definitions"
+        if diff
+        else ""
+    )
+    rows = conn.query(
+        "SELECT r.database AS database, r.version AS version, "
+        "r.created_at AS recorded_at, r.fingerprint AS recorded, "
+        f"c.fingerprint AS current{definitions} "
+        "FROM ("
+        "SELECT _database AS database, version, fingerprint, definitions, "
+        "created_at "
+        f"FROM merge(REGEXP({quote_string(pattern)}), "
+        f"{quote_string('^' + FINGERPRINTS_TABLE + '$')}) "
+        "ORDER BY created_at DESC, version DESC LIMIT 1 BY _database"
+        ") AS r LEFT JOIN ("
+        f"SELECT database, {FINGERPRINT} AS fingerprint"
+        f"{', ' + DEFINITIONS + ' AS definitions' if diff else ''} "
+        f"FROM ({schema_definitions(condition)}) GROUP BY database"
+        ") AS c ON r.database = c.database "
+        "WHERE r.fingerprint != c.fingerprint ORDER BY database"
+    )
+
+    return [
+        DriftRow(
+            row["database"],
+            row["version"],
+            row["recorded_at"],
+            row["recorded"],
+            row["current"],
+            (
+                definition_changes(
+                    row["recorded_definitions"], row["current_definitions"]
+                )
+                if diff
+                else None
+            ),
+        )
+        for row in rows
+    ]
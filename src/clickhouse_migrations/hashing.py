@@ -0,0 +1,167 @@
+import hashlib
+import logging
+import subprocess
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from clickhouse_migrations.exceptions import MigrationException
+
+# Algorithms digesting the migration files. md5 digests are written as 32 hex
+# digits, as they always were; the others are prefixed with the algorithm,
+# e.g. "blake2b:<hex>", so that every schema_versions row says how its digest
+# was made and rows written before switching keep verifying.
+MD5 = "md5"
+BLAKE2B = "blake2b"
+XXH3 = "xxh3"
+# The id git gives the file as a blob, read from the git index when the
+# migrations directory is a git checkout (see git_blob_ids).
+GIT = "git"
+HASH_ALGORITHMS = (MD5, BLAKE2B, XXH3, GIT)
+
+
+def import_xxhash():
+    try:
+        import xxhash  # pylint: disable=import-outside-toplevel
+    except ImportError as exc:
+        raise MigrationException(
+            "The xxh3 hash algorithm needs the xxhash package. "
+            "Install it with: pip install 'clickhouse-migrations[xxhash]'"
+        ) from exc
+
+    return xxhash
+
+
+def _md5(content: bytes) -> str:
+    return hashlib.md5(content).hexdigest()
+
+
+def _blake2b(content: bytes) -> str:
+    # 128 bits, like md5 and xxh3.
+    return f"{BLAKE2B}:{hashlib.blake2b(content, digest_size=16).hexdigest()}"
+
+
+def _git_blob(content: bytes) -> str:
+    blob = hashlib.sha1(b"blob %d\0" % len(content))
+    blob.update(content)
+    return f"{GIT}:{blob.hexdigest()}"
+
+
+def hasher(algorithm: str) -> Callable[[bytes], str]:
+    """Function digesting file contents with algorithm, as recorded in the
+    md5 column of schema_versions."""
+    if algorithm == MD5:
+        return _md5
+    if algorithm == BLAKE2B:
+        return _blake2b
+    if algorithm == GIT:
+        return _git_blob
+    if algorithm == XXH3:
+        xxh3_128 = import_xxhash().xxh3_128
+        return lambda content: f"{XXH3}:{xxh3_128(content).hexdigest()}"
+    raise MigrationException(
+        f"Unknown hash algorithm: {algorithm}. "
+        f"Expected one of: {', '.join(HASH_ALGORITHMS)}"
+    )
+
+
+def digest_algorithm(digest: str) -> str:
+    """Algorithm a recorded digest was made with."""
+    algorithm, separator, _ = digest.partition(":")
+    return algorithm if separator else MD5
+
+
+def script_digest(script: str, algorithm: str) -> str:
+    """Digest of a migration script: that of its file, read as UTF-8."""
+    return hasher(algorithm)(script.encode("utf8"))
+
+
+# Attributes under which git may check a file out with other bytes than
+# those of its blob.
+_CONVERSION_ATTRIBUTES = ("text", "eol", "filter", "working-tree-encoding")
+
+
+def _converted_files(directory: Path, names: Iterable[str]) -> Optional[Set[str]]:
+    """The names of the files of directory that git may convert between the
+    blob and the working copy; None if git cannot tell.
+
+    With core.autocrlf, that is every file. Otherwise, the files with a
+    conversion attribute set, found in one check-attr call.
+    """
+    names = list(names)
+    git = ["git", "-C", str(directory)]
+    try:
+        # Exits with 1 when the option is not set.
+        autocrlf = subprocess.run(
+            git + ["config", "--get", "core.autocrlf"],
+            capture_output=True,
+            check=False,
+        ).stdout.strip()
+        if autocrlf.lower() not in (b"", b"false", b"no", b"off", b"0"):
+            return set(names)
+        output = subprocess.run(
+            git + ["check-attr", "-z", "--stdin", *_CONVERSION_ATTRIBUTES],
+            input=b"\0".join(name.encode("utf8", "surrogateescape") for name in names),
+            capture_output=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logging.debug("No git attributes for %s: %s", directory, exc)
+        return None
+
+    # (path, attribute, value) triples; text unset marks a binary file.
+    fields = output.split(b"\0")
+    return {
+        fields[i].decode("utf8", "surrogateescape")
+        for i in range(0, len(fields) - 2, 3)
+        if fields[i + 2] not in (b"unspecified", b"unset")
+    }
+
+
+def git_blob_ids(directory: Path) -> Dict[str, str]:
+    """GIT digests of the files of directory (not of its subdirectories) that
+    git tracks and that are unchanged since staged, by file name.
+
+    They come from the git index without reading the files: ls-files lists a
+    modified file twice, once as staged and once as modified. Files git may
+    convert on checkout (see _converted_files) are left out, since their
+    working bytes, which the other files are hashed from, may differ from
+    the blob. Empty when directory is not in a git checkout.
+    """
+    try:
+        output = subprocess.run(
+            ["git", "-C", str(directory), "ls-files", "--stage", "--modified"]
+            + ["-z", "--", "."],
+            capture_output=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as exc:
+        logging.debug("No git index for %s: %s", directory, exc)
+        return {}
+
+    ids: Dict[str, str] = {}
+    unusable: Set[str] = set()
+    for entry in output.split(b"\0"):
+        if not entry:
+            continue
+        info, _, name_bytes = entry.partition(b"\t")
+        mode, object_id, stage = info.split()
+        name = name_bytes.decode("utf8", "surrogateescape")
+        # Regular files only, merged, of a SHA-1 repository.
+        if (
+            name in ids
+            or not mode.startswith(b"100")
+            or stage != b"0"
+            or len(object_id) != 40
+        ):
+            unusable.add(name)
+        ids[name] = f"{GIT}:{object_id.decode()}"
+
+    ids = {
+        name: digest
+        for name, digest in ids.items()
+        if name not in unusable and "/" not in name
+    }
+    converted = _converted_files(directory, ids) if ids else set()
+    if converted is None:
+        return {}
+    return {name: digest for name, digest in ids.items() if name not in converted}
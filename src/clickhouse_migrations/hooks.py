@@ -0,0 +1,83 @@
+import importlib
+from typing import List, Optional
+
+from clickhouse_migrations.exceptions import MigrationException
+
+PHASE_LOAD = "load"
+PHASE_HASH = "hash"
+PHASE_FETCH_APPLIED = "fetch_applied"
+PHASE_TOKENIZE = "tokenize"
+PHASE_EXECUTE = "execute"
+PHASE_BOOKKEEPING = "bookkeeping"
+PHASES = (
+    PHASE_LOAD,
+    PHASE_HASH,
+    PHASE_FETCH_APPLIED,
+    PHASE_TOKENIZE,
+    PHASE_EXECUTE,
+    PHASE_BOOKKEEPING,
+)
+
+
+class MigrationHook:
+    """Listener for migration run events.
+
+    Subclass it and override the events you care about; every method is a
+    no-op by default. Timestamps come from time.perf_counter() and durations
+    are in seconds. Hooks are only invoked when at least one is registered, so
+    a run without hooks does not pay for timing or event arguments.
+    """
+
+    def on_load(self, migrations: List, duration: float) -> None:
+        """Migrations were loaded from the migrations directory."""
+
+    def on_phase(self, phase: str, started: float, duration: float) -> None:
+        """A run phase (one of the PHASE_* constants) finished.
+
+        Statement execution and bookkeeping are reported per migration through
+        after_statement and after_bookkeeping instead.
+        """
+
+    def before_migration(self, migration) -> None:
+        """A pending migration is about to be applied."""
+
+    def before_baseline(self, baseline, versions: int) -> None:
+        """A Baseline is about to be applied in place of the pending migrations
+        up to its version; versions is how many of them it covers.
+
+        Its statements and its bookkeeping are then reported like those of a
+        migration, with the Baseline passed as migration: the events below
+        receive a Migration or a Baseline, both with version and md5. Its one
+        after_bookkeeping records all the versions it covers.
+        """
+
+    def before_statement(self, migration, index: int, statement: str) -> None:
+        """The index-th (1-based) statement of a migration is about to run."""
+
+    def after_statement(
+        self,
+        migration,
+        index: int,
+        statement: str,
+        started: float,
+        duration: float,
+        error: Optional[BaseException],
+    ) -> None:
+        """A statement finished; error is set if it raised."""
+
+    def after_bookkeeping(self, migration, started: float, duration: float) -> None:
+        """The migration was recorded in schema_versions."""
+
+
+def load_hook(spec: str) -> MigrationHook:
+    """Instantiate a hook from a "module:Class" spec, e.g. for --hook."""
+    module_name, _, attr = spec.partition(":")
+    if not module_name or not attr:
+        raise MigrationException(f"Hook must be given as module:Class, got: {spec}")
+
+    try:
+        hook_class = getattr(importlib.import_module(module_name), attr)
+    except (ImportError, AttributeError) as exc:
+        raise MigrationException(f"Cannot load hook {spec}: {exc}") from exc
+
+    return hook_class()
@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Iterator, Optional
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.util import quote_string
+
+LOCK_TABLE = "schema_versions_lock"
+
+# Seconds between two checks of a runner waiting for the lock.
+POLL_INTERVAL = 1.0
+
+# Seconds a claim waits before checking again that it is the oldest: longer
+# than an insert into the lock table takes to become visible to every runner
+# (including replication with --cluster-name).
+GRACE_PERIOD = 1.0
+
+# Every row claims, renews or releases the lease of one runner (owner) until
+# expires_at. The first claim of a runner whose latest row has not expired
+# holds the lock.
+_HOLDER = (
+    "SELECT owner FROM ("
+    "SELECT owner, min(renewed_at) AS claimed_at, "
+    "argMax(expires_at, renewed_at) AS expires_at "
+    f"FROM {LOCK_TABLE} GROUP BY owner"
+    ") WHERE expires_at > now64(6) ORDER BY claimed_at, owner LIMIT 1"
+)
+
+
+class MigrationLock:
+    """Lease on running the migrations of one database, kept in the
+    schema_versions_lock table.
+
+    ClickHouse has no compare-and-set, so a runner claims the lease by
+    inserting a row and holds it if its claim is the oldest live one. A claim
+    is stamped when its insert starts but only seen once it is committed, so
+    an older claim may still show up: the oldest claim is read again after
+    grace seconds, and only then held. The holder renews the lease every
+    ttl / 3 seconds; if it dies, the lease expires after ttl and a waiting
+    runner takes over. Clocks are the server's, never the runners'.
+    """
+
+    def __init__(
+        self,
+        conn: Connection,
+        ttl: float = 60.0,
+        poll_interval: float = POLL_INTERVAL,
+        owner: Optional[str] = None,
+        grace: Optional[float] = None,
+    ):
+        grace = GRACE_PERIOD if grace is None else grace
+        if grace * 2 >= ttl:
+            raise MigrationException(
+                f"The lock grace period ({grace}s) must be shorter than half "
+                f"the lock TTL ({ttl}s)"
+            )
+        self._conn = conn
+        self._ttl = ttl
+        self._poll_interval = poll_interval
+        self._grace = grace
+        self.owner = owner or str(uuid.uuid4())
+
+    def _holder(self) -> str:
+        return self._conn.query(f"SELECT ({_HOLDER}) AS holder")[0]["holder"]
+
+    def _write(self, expires_at: str) -> None:
+        self._conn.command(
+            f"INSERT INTO {LOCK_TABLE} (owner, renewed_at, expires_at) "
+            f"SELECT {quote_string(self.owner)}, now64(6), {expires_at}"
+        )
+
+    def renew(self) -> None:
+        self._write(f"now64(6) + toIntervalMillisecond({int(self._ttl * 1000)})")
+
+    def release(self) -> None:
+        # Expired now rather than at 0, so that the TTL of the lock table does
+        # not drop the release before the claim it ends.
+        self._write("now64(6)")
+
+    def acquire(self) -> bool:
+        """Claim the lease; True if this runner now holds it."""
+        # A fresh owner per claim, so that the rows of an earlier, released
+        # lease never make this claim look older than it is.
+        self.owner = str(uuid.uuid4())
+        self.renew()
+        if self._holder() == self.owner:
+            # Claims stamped earlier but committed after the read above are
+            # visible once the grace period is over.
+            time.sleep(self._grace)
+            if self._holder() == self.owner:
+                return True
+
+        # Lost the race: withdraw the claim so it never blocks anyone.
+        self.release()
+        return False
+
+    def wait(self, at_head: str) -> bool:
+        """Block until this runner holds the lock (True), or until another
+        runner applied the migrations (False).
+
+        at_head is a query of one boolean: whether the migrations applied to
+        the database are those this runner would leave (see
+        migrator.at_head_query). Waiting costs one query per poll_interval:
+        at_head and the current holder together.
+        """
+        while True:
+            state = self._conn.query(
+                f"SELECT ({at_head}) AS applied, ({_HOLDER}) AS holder"
+            )[0]
+            if state["applied"]:
+                return False
+            if not state["holder"] and self.acquire():
+                return True
+            logging.info("Waiting for runner %s to apply migrations", state["holder"])
+            time.sleep(self._poll_interval)
+
+    @contextmanager
+    def held(self, connect: Callable[[], ContextManager[Connection]]) -> Iterator[None]:
+        """Renew the lease in the background until the block exits, then
+        release it. Renewals go through their own connection from connect(),
+        since a connection cannot run two queries at once."""
+        stopped = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew_until,
+            args=(stopped, connect),
+            name="migration-lock",
+            daemon=True,
+        )
+        renewer.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            renewer.join()
+            self.release()
+
+    def _renew_until(
+        self,
+        stopped: threading.Event,
+        connect: Callable[[], ContextManager[Connection]],
+    ) -> None:
+        with connect() as conn:
+            lease = MigrationLock(conn, self._ttl, owner=self.owner, grace=0)
+            while not stopped.wait(self._ttl / 3):
+                try:
+                    lease.renew()
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    logging.warning("Failed to renew the migration lock: %s", exc)
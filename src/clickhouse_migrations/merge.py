@@ -0,0 +1,56 @@
+from operator import attrgetter
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.migration import Migration
+
+_T = TypeVar("_T")
+
+
+def by_version(
+    migrations: Iterable[_T], version_of: Callable[[_T], int] = attrgetter("version")
+) -> List[_T]:
+    # Linear when already sorted, as they mostly are; stable, so that the last
+    # of the applied rows of a version stays last.
+    return sorted(migrations, key=version_of)
+
+
+def merge_by_version(
+    local: Iterable[Migration],
+    applied: Iterable[_T],
+    version_of: Callable[[_T], int] = attrgetter("version"),
+) -> Iterator[Tuple[int, Optional[Migration], Optional[_T]]]:
+    """Full outer join, in one pass, of local and applied migrations, both
+    sorted by version (see by_version): (version, migration or None, applied
+    item or None) in version order. Of consecutive applied items with the same
+    version, the last one wins."""
+    local = iter(local)
+    applied = iter(applied)
+    left = next(local, None)
+    right = next(applied, None)
+    following = None if right is None else next(applied, None)
+    last_version = -1
+    while left is not None or right is not None:
+        if right is not None:
+            right_version = version_of(right)
+            while following is not None and version_of(following) == right_version:
+                right, following = following, next(applied, None)
+
+        if right is None or (left is not None and left.version < right_version):
+            version, joined_left, joined_right = left.version, left, None
+            left = next(local, None)
+        else:
+            if left is None or right_version < left.version:
+                version, joined_left, joined_right = right_version, None, right
+            else:
+                version, joined_left, joined_right = right_version, left, right
+                left = next(local, None)
+            right = following
+            following = None if right is None else next(applied, None)
+
+        if version <= last_version:
+            raise MigrationException(
+                f"Migrations are not sorted by version: {version} after {last_version}."
+            )
+        last_version = version
+        yield version, joined_left, joined_right
@@ -0,0 +1,189 @@
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.hooks import (
+    PHASE_BOOKKEEPING,
+    PHASE_EXECUTE,
+    PHASES,
+    MigrationHook,
+)
+from clickhouse_migrations.util import atomic_write_text
+
+METRIC_PREFIX = "clickhouse_migrations"
+
+
+def _text_bytes(value) -> int:
+    """UTF-8 length of the text of value, without encoding ASCII text."""
+    text = value if isinstance(value, str) else str(value)
+    return len(text) if text.isascii() else len(text.encode("utf8"))
+
+
+def _rows_bytes(rows: List[Dict]) -> int:
+    # Value by value: the rows are never formatted as a whole.
+    return sum(_text_bytes(value) for row in rows for value in row.values())
+
+
+class RunMetrics(MigrationHook):  # pylint: disable=too-many-instance-attributes
+    """Counters and per-phase durations of one migrate run against one database,
+    collected as a hook."""
+
+    def __init__(self, database: Optional[str] = None):
+        self.database: Optional[str] = database
+        self.migrations_applied = 0
+        self.statements_executed = 0
+        self.queries_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.phase_seconds: Dict[str, float] = dict.fromkeys(PHASES, 0.0)
+        self.success = False
+        self.started_at = time.time()
+        self.duration_seconds = 0.0
+        self._started = time.perf_counter()
+        # Versions the next bookkeeping records: all those a baseline covers.
+        self._recording = 1
+
+    def add_phase(self, phase: str, seconds: float) -> None:
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+
+    def on_phase(self, phase: str, started: float, duration: float) -> None:
+        self.add_phase(phase, duration)
+
+    def after_statement(
+        self, migration, index, statement, started, duration, error
+    ) -> None:
+        self.add_phase(PHASE_EXECUTE, duration)
+        if error is None:
+            self.statements_executed += 1
+
+    def before_baseline(self, baseline, versions: int) -> None:
+        self._recording = versions
+
+    def after_bookkeeping(self, migration, started: float, duration: float) -> None:
+        self.add_phase(PHASE_BOOKKEEPING, duration)
+        self.migrations_applied += self._recording
+        self._recording = 1
+
+    def add_query(self, statement: str, rows: Optional[List[Dict]] = None) -> None:
+        """Count a query, of the text of statement and of inserted rows."""
+        self.queries_sent += 1
+        self.bytes_sent += _text_bytes(statement)
+        if rows:
+            self.bytes_sent += _rows_bytes(rows)
+
+    def add_result(self, rows: List[Dict]) -> None:
+        self.bytes_received += _rows_bytes(rows)
+
+    def finish(self, success: bool) -> None:
+        self.success = success
+        self.duration_seconds = time.perf_counter() - self._started
+
+
+class MeteredConnection(Connection):
+    """Connection wrapper counting every query sent and the bytes of its text
+    (and of inserted values), and the bytes of the values of query results,
+    into a RunMetrics."""
+
+    def __init__(self, conn: Connection, metrics: RunMetrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def command(self, statement, query_id=None, settings=None) -> None:
+        self._metrics.add_query(statement)
+        self._conn.command(statement, query_id=query_id, settings=settings)
+
+    def query(self, statement, settings=None):
+        self._metrics.add_query(statement)
+        rows = self._conn.query(statement, settings=settings)
+        self._metrics.add_result(rows)
+        return rows
+
+    def insert(self, table, rows) -> None:
+        self._metrics.add_query(table, rows)
+        self._conn.insert(table, rows)
+
+    def __enter__(self) -> "MeteredConnection":
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._conn.__exit__(exc_type, exc_value, traceback)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return ",".join(
+        f'{name}="{_escape_label(str(value))}"' for name, value in labels.items()
+    )
+
+
+def format_openmetrics(runs: List[RunMetrics]) -> str:
+    """Render runs in the OpenMetrics text format, one label set per database."""
+    families = [
+        (
+            "migrations_applied",
+            "Migrations applied by the last run.",
+            lambda m: [({}, m.migrations_applied)],
+        ),
+        (
+            "statements_executed",
+            "Statements executed by the last run.",
+            lambda m: [({}, m.statements_executed)],
+        ),
+        (
+            "queries_sent",
+            "Queries sent to ClickHouse by the last run.",
+            lambda m: [({}, m.queries_sent)],
+        ),
+        (
+            "sent_bytes",
+            "Bytes of query text and inserted values sent by the last run.",
+            lambda m: [({}, m.bytes_sent)],
+        ),
+        (
+            "received_bytes",
+            "Bytes of the values of query results received by the last run.",
+            lambda m: [({}, m.bytes_received)],
+        ),
+        (
+            "phase_duration_seconds",
+            "Wall time spent in each phase of the last run.",
+            lambda m: [({"phase": p}, s) for p, s in m.phase_seconds.items()],
+        ),
+        (
+            "run_duration_seconds",
+            "Total wall time of the last run.",
+            lambda m: [({}, m.duration_seconds)],
+        ),
+        (
+            "last_run_success",
+            "1 if the last run succeeded, 0 otherwise.",
+            lambda m: [({}, int(m.success))],
+        ),
+        (
+            "last_run_timestamp_seconds",
+            "Unix time the last run started at.",
+            lambda m: [({}, m.started_at)],
+        ),
+    ]
+
+    lines: List[str] = []
+    for name, help_text, samples in families:
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        for run in runs:
+            for labels, value in samples(run):
+                label_text = _labels(database=run.database or "", **labels)
+                lines.append(f"{metric}{{{label_text}}} {value}")
+    lines.append("# EOF")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_openmetrics(path: Union[Path, str], runs: List[RunMetrics]) -> None:
+    atomic_write_text(path, format_openmetrics(runs))
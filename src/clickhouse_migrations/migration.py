@@ -1,17 +1,249 @@
 import hashlib
 import os
+import re
+import time
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
+from functools import partial
 from pathlib import Path
-from typing import Dict, List, Optional, Union
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
 
 from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hashing import (
+    GIT,
+    MD5,
+    digest_algorithm,
+    git_blob_ids,
+    hasher,
+    script_digest,
+)
+from clickhouse_migrations.hooks import PHASE_HASH, PHASE_LOAD, MigrationHook
 
 Migration = namedtuple("Migration", ["version", "md5", "script"])
 
+
+class BundledMigration(Migration):
+    """Migration read from a bundle (see bundle.py).
+
+    Its script and statements stay in the bundle until used, so checking the
+    md5s of the migrations (status, planning) never reads them. source is the
+    bundle entry they are read from.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, version: int, md5: str, source):
+        return super().__new__(cls, version, md5, source)
+
+    @property
+    def script(self) -> str:
+        return self[2].script()
+
+    def statements(self) -> List[str]:
+        """The ';'-separated statements of the script, split when bundled."""
+        return self[2].statements()
+
+    def __repr__(self) -> str:
+        return (
+            f"Migration(version={self.version!r}, md5={self.md5!r}, "
+            f"script={self.script!r})"
+        )
+
+
+class FileMigration(Migration):
+    """Migration whose script stays in its file (path) until used, for
+    digests known without reading it (see hashing.git_blob_ids)."""
+
+    __slots__ = ()
+
+    def __new__(cls, version: int, md5: str, path: Path):
+        return super().__new__(cls, version, md5, path)
+
+    @property
+    def script(self) -> str:
+        return self[2].read_bytes().decode("utf8")
+
+    def __repr__(self) -> str:
+        return (
+            f"Migration(version={self.version!r}, md5={self.md5!r}, "
+            f"script={self.script!r})"
+        )
+
+
+def _md5_digest(md5: str) -> Union[bytes, str]:
+    """The 16 bytes of an md5 written as 32 lowercase hex digits, else md5
+    as is (schema_versions accepts any string)."""
+    if len(md5) == 32:
+        try:
+            digest = bytes.fromhex(md5)
+        except ValueError:
+            return md5
+        if digest.hex() == md5:
+            return digest
+    return md5
+
+
+class CompactMigration:
+    """Version and md5 of a migration, without script, in a slotted record
+    that keeps the md5 as its 16 bytes (digest). It reads like a Migration
+    whose script is None; to_migration() and from_migration() convert."""
+
+    __slots__ = ("version", "digest")
+
+    script = None
+
+    def __init__(self, version: int, md5: Union[str, bytes]):
+        self.version = version
+        # bytes are a digest already, as stored by MigrationDigests.
+        self.digest = md5 if isinstance(md5, bytes) else _md5_digest(md5)
+
+    @property
+    def md5(self) -> str:
+        digest = self.digest
+        return digest.hex() if isinstance(digest, bytes) else digest
+
+    @classmethod
+    def from_migration(cls, migration: Migration) -> "CompactMigration":
+        return cls(migration.version, migration.md5)
+
+    def to_migration(self) -> Migration:
+        return Migration(self.version, self.md5, None)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CompactMigration):
+            return NotImplemented
+        return (self.version, self.digest) == (other.version, other.digest)
+
+    def __hash__(self) -> int:
+        return hash((self.version, self.digest))
+
+    def __repr__(self) -> str:
+        return f"CompactMigration(version={self.version!r}, md5={self.md5!r})"
+
+
+class MigrationDigests:
+    """Versions and md5s of migrations sorted by version, in two columns: an
+    array of versions (UInt32, as in schema_versions) and a buffer of 16-byte
+    digests, so that holding many histories at once costs about 20 bytes per
+    migration. md5s that are not hex digests are kept aside by position.
+
+    Iterating yields CompactMigration records in version order, which
+    migrations_to_apply and the other merges by version accept as applied
+    migrations; md5() looks one version up in O(log n).
+    """
+
+    def __init__(self, migrations: Iterable[Migration] = ()):
+        self._versions = array("I")
+        self._digests = bytearray()
+        self._others: Dict[int, str] = {}
+        for migration in migrations:
+            self.append(migration.version, migration.md5)
+
+    def append(self, version: int, md5: str) -> None:
+        """Add a migration at least as recent as the last one; a repeated
+        version is kept, as schema_versions keeps every row."""
+        if self._versions and version < self._versions[-1]:
+            raise MigrationException(
+                "Migrations are not sorted by version: "
+                f"{version} after {self._versions[-1]}."
+            )
+        digest = _md5_digest(md5)
+        if isinstance(digest, str):
+            self._others[len(self._versions)] = digest
+            digest = bytes(16)
+        self._versions.append(version)
+        self._digests += digest
+
+    def __len__(self) -> int:
+        return len(self._versions)
+
+    def _record(self, index: int) -> CompactMigration:
+        md5 = self._others.get(index)
+        if md5 is None:
+            md5 = bytes(self._digests[index * 16 : index * 16 + 16])
+        return CompactMigration(self._versions[index], md5)
+
+    def __getitem__(self, index: int) -> CompactMigration:
+        if index < 0:
+            index += len(self._versions)
+        if not 0 <= index < len(self._versions):
+            raise IndexError("migration index out of range")
+        return self._record(index)
+
+    def __iter__(self) -> Iterator[CompactMigration]:
+        return map(self._record, range(len(self._versions)))
+
+    def __contains__(self, version: int) -> bool:
+        return self._index(version) is not None
+
+    def _index(self, version: int) -> Optional[int]:
+        # The last row of a repeated version wins, as in the merges.
+        index = bisect_right(self._versions, version) - 1
+        if index < 0 or self._versions[index] != version:
+            return None
+        return index
+
+    def md5(self, version: int) -> Optional[str]:
+        """md5 of version, None when it is not there."""
+        index = self._index(version)
+        return None if index is None else self._record(index).md5
+
+    @property
+    def last_version(self) -> Optional[int]:
+        return self._versions[-1] if self._versions else None
+
+    def to_migrations(self) -> List[Migration]:
+        return [record.to_migration() for record in self]
+
+
 # Suffix that marks an optional, hand-written rollback ("down") script paired
 # with a migration by version, e.g. 001_init.sql <-> 001_init.down.sql.
 DOWN_SUFFIX = ".down.sql"
 
+# Suffix of a baseline written by squash: the schema left by every migration
+# up to its version, e.g. 0042_baseline.baseline.sql. sources_md5 identifies
+# the migrations it was made from (see baseline_sources_md5).
+BASELINE_SUFFIX = ".baseline.sql"
+Baseline = namedtuple("Baseline", ["version", "md5", "script", "sources_md5"])
+
+# Placeholder for the target database in the statements of a baseline.
+BASELINE_DATABASE = "{database}"
+
+_BASELINE_SOURCES_RE = re.compile(r"^-- sources: ([0-9a-f]{32})$", re.M)
+
+
+def _md5_of(migration: Migration) -> str:
+    if digest_algorithm(migration.md5) == MD5:
+        return migration.md5
+    return script_digest(migration.script, MD5)
+
+
+def baseline_sources_md5(migrations: List[Migration]) -> str:
+    """Digest of the versions and md5s of the migrations a baseline covers,
+    the same whichever hash algorithm digested them."""
+    lines = "".join(f"{m.version}:{_md5_of(m)}\n" for m in migrations)
+    return hashlib.md5(lines.encode("utf8")).hexdigest()
+
+
+def format_baseline(migrations: List[Migration], statements: List[str]) -> str:
+    header = (
+        f"-- Baseline of migrations up to version {migrations[-1].version}, "
+        "written by clickhouse-migrations squash.\n"
+        f"-- sources: {baseline_sources_md5(migrations)}\n\n"
+    )
+    return header + ";\n\n".join(statements) + ";\n"
+
 
 def _parse_version(filename: str) -> int:
     version_string = filename.split("_")[0]
@@ -24,9 +256,75 @@ def _parse_version(filename: str) -> int:
         ) from exc
 
 
+def _is_migration_file(filename: str) -> bool:
+    # ".down.sql" files are rollback scripts and ".baseline.sql" files
+    # squashed snapshots, not migrations to apply; they are collected
+    # separately via down_scripts() and baseline().
+    return filename.endswith(".sql") and not filename.endswith(
+        (DOWN_SUFFIX, BASELINE_SUFFIX)
+    )
+
+
+def _is_selected(
+    full_path: Path, version_number: int, explicit_migrations: Optional[List[str]]
+) -> bool:
+    return (
+        not explicit_migrations
+        or full_path.name in explicit_migrations
+        or full_path.stem in explicit_migrations
+        or full_path.name.split("_")[0] in explicit_migrations
+        or str(version_number) in explicit_migrations
+    )
+
+
+class DownScripts(Mapping):
+    """Down scripts by version, each read when first looked up: which
+    versions have one is known without reading any, so a rollback only reads
+    the scripts of the versions it rolls back."""
+
+    def __init__(self, loaders: Dict[int, Callable[[], str]]):
+        self._loaders = loaders
+        self._scripts: Dict[int, str] = {}
+
+    def __getitem__(self, version: int) -> str:
+        script = self._scripts.get(version)
+        if script is None:
+            script = self._scripts[version] = self._loaders[version]()
+        return script
+
+    def __contains__(self, version) -> bool:
+        return version in self._loaders
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._loaders)
+
+    def __len__(self) -> int:
+        return len(self._loaders)
+
+
+# File names of a migrations directory by kind, from one scan.
+_DirectoryScan = namedtuple("_DirectoryScan", ["migrations", "down", "baselines"])
+
+
 class MigrationStorage:
-    def __init__(self, storage_dir: Union[Path, str]):
+    """Migrations of a directory, digested with hash_algorithm (see
+    hashing.py). The directory is scanned once, on first use, for every kind
+    of file; files are read when asked for."""
+
+    def __init__(self, storage_dir: Union[Path, str], hash_algorithm: str = MD5):
         self.storage_dir: Path = Path(storage_dir)
+        self.hash_algorithm = hash_algorithm
+        self._digest = hasher(hash_algorithm)
+        self._scanned: Optional[_DirectoryScan] = None
+
+    def close(self) -> None:
+        """Nothing is held open; for open_migrations, like MigrationBundle."""
+
+    def __enter__(self) -> "MigrationStorage":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
     def _require_dir(self) -> None:
         if not self.storage_dir.is_dir():
@@ -34,47 +332,82 @@ class MigrationStorage:
                 f"Migrations directory does not exist: {self.storage_dir}"
             )
 
+    def _scan(self) -> _DirectoryScan:
+        if self._scanned is None:
+            self._require_dir()
+            scan = _DirectoryScan([], [], [])
+            for entry in os.scandir(self.storage_dir):
+                if entry.name.endswith(DOWN_SUFFIX):
+                    scan.down.append(entry.name)
+                elif entry.name.endswith(BASELINE_SUFFIX):
+                    scan.baselines.append(entry.name)
+                elif _is_migration_file(entry.name):
+                    scan.migrations.append(entry.name)
+            self._scanned = scan
+        return self._scanned
+
     def filenames(self) -> List[Path]:
-        self._require_dir()
+        return [self.storage_dir / name for name in self._scan().migrations]
 
-        # ".down.sql" files are rollback scripts, not migrations to apply; they
-        # are collected separately via down_scripts().
-        return [
-            self.storage_dir / f.name
-            for f in os.scandir(self.storage_dir)
-            if f.name.endswith(".sql") and not f.name.endswith(DOWN_SUFFIX)
-        ]
+    def baseline(self) -> Optional[Baseline]:
+        """The baseline with the highest version, if any."""
+        baselines = {_parse_version(name): name for name in self._scan().baselines}
+        if not baselines:
+            return None
 
-    def down_scripts(self) -> Dict[int, str]:
-        self._require_dir()
+        version_number = max(baselines)
+        full_path = self.storage_dir / baselines[version_number]
+        script = full_path.read_text(encoding="utf8")
+        sources = _BASELINE_SOURCES_RE.search(script)
+        if sources is None:
+            raise MigrationException(
+                f"Baseline {full_path.name} has no '-- sources:' header; "
+                "re-run squash"
+            )
 
-        scripts: Dict[int, str] = {}
-        seen_versions: Dict[int, str] = {}
-        for entry in os.scandir(self.storage_dir):
-            if not entry.name.endswith(DOWN_SUFFIX):
-                continue
+        return Baseline(
+            version=version_number,
+            md5=hashlib.md5(full_path.read_bytes()).hexdigest(),
+            script=script,
+            sources_md5=sources.group(1),
+        )
 
-            version_number = _parse_version(entry.name)
+    def down_scripts(self) -> DownScripts:
+        loaders: Dict[int, Callable[[], str]] = {}
+        seen_versions: Dict[int, str] = {}
+        for name in self._scan().down:
+            version_number = _parse_version(name)
             if version_number in seen_versions:
                 raise MigrationException(
                     f"Duplicate down migration version {version_number}: "
-                    f"{seen_versions[version_number]} and {entry.name}"
+                    f"{seen_versions[version_number]} and {name}"
                 )
-            seen_versions[version_number] = entry.name
-            scripts[version_number] = (self.storage_dir / entry.name).read_text(
-                encoding="utf8"
+            seen_versions[version_number] = name
+            loaders[version_number] = partial(
+                (self.storage_dir / name).read_text, encoding="utf8"
             )
 
-        return scripts
+        return DownScripts(loaders)
 
     def migrations(
-        self, explicit_migrations: Optional[List[str]] = None
+        self,
+        explicit_migrations: Optional[List[str]] = None,
+        hooks: Sequence[MigrationHook] = (),
     ) -> List[Migration]:
         migrations: List[Migration] = []
         seen_versions: Dict[int, str] = {}
 
+        # Timing is only taken when a hook listens, so the plain load path does
+        # not pay for the clock calls.
+        if hooks:
+            load_started = time.perf_counter()
+        # Files unchanged in a git checkout are not read: the index has their
+        # digests. Their scripts are read when used.
+        blob_ids = git_blob_ids(self.storage_dir) if self.hash_algorithm == GIT else {}
+        if hooks:
+            hash_seconds = time.perf_counter() - load_started
+
         for full_path in self.filenames():
-            version_string = full_path.name.split("_")[0]
             version_number = _parse_version(full_path.name)
 
             if version_number in seen_versions:
@@ -84,21 +417,96 @@ class MigrationStorage:
                 )
             seen_versions[version_number] = full_path.name
 
-            migration = Migration(
-                version=version_number,
-                script=str(full_path.read_text(encoding="utf8")),
-                md5=hashlib.md5(full_path.read_bytes()).hexdigest(),
-            )
+            if not _is_selected(full_path, version_number, explicit_migrations):
+                continue
+
+            md5 = blob_ids.get(full_path.name)
+            if md5 is not None:
+                migrations.append(FileMigration(version_number, md5, full_path))
+                continue
+
+            content = full_path.read_bytes()
+            if hooks:
+                hash_started = time.perf_counter()
+            md5 = self._digest(content)
+            if hooks:
+                hash_seconds += time.perf_counter() - hash_started
 
-            if (
-                not explicit_migrations
-                or full_path.name in explicit_migrations
-                or full_path.stem in explicit_migrations
-                or version_string in explicit_migrations
-                or str(version_number) in explicit_migrations
-            ):
-                migrations.append(migration)
+            # The script is the file as is, so that it digests like the file.
+            migrations.append(
+                Migration(
+                    version=version_number, script=content.decode("utf8"), md5=md5
+                )
+            )
 
         migrations.sort(key=lambda m: m.version)
 
+        if hooks:
+            # Hashing is interleaved with reading, so it is reported as one
+            # aggregated span starting with the load.
+            duration = time.perf_counter() - load_started
+            for hook in hooks:
+                hook.on_phase(PHASE_LOAD, load_started, duration - hash_seconds)
+                hook.on_phase(PHASE_HASH, load_started, hash_seconds)
+                hook.on_load(migrations, duration)
+
         return migrations
+
+
+class MigrationIndex:
+    """In-memory index of the migrations in a directory, for long-running
+    processes (see watch). refresh() only stats the files and re-reads and
+    re-hashes those whose size, mtime or inode changed since the last call.
+    """
+
+    def __init__(self, storage: MigrationStorage):
+        self._storage = storage
+        self._digest = hasher(storage.hash_algorithm)
+        # file name -> (stat signature, migration)
+        self._entries: Dict[str, tuple] = {}
+
+    def refresh(self) -> bool:
+        """Rescan the directory; True if any migration was added, changed or
+        removed."""
+        self._storage._require_dir()  # pylint: disable=protected-access
+
+        entries: Dict[str, tuple] = {}
+        seen_versions: Dict[int, str] = {}
+        for entry in os.scandir(self._storage.storage_dir):
+            if not _is_migration_file(entry.name):
+                continue
+
+            version_number = _parse_version(entry.name)
+            if version_number in seen_versions:
+                raise MigrationException(
+                    f"Duplicate migration version {version_number}: "
+                    f"{seen_versions[version_number]} and {entry.name}"
+                )
+            seen_versions[version_number] = entry.name
+
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            cached = self._entries.get(entry.name)
+            if cached is not None and cached[0] == signature:
+                entries[entry.name] = cached
+                continue
+
+            content = Path(entry.path).read_bytes()
+            migration = Migration(
+                version=version_number,
+                md5=self._digest(content),
+                script=content.decode("utf8"),
+            )
+            entries[entry.name] = (signature, migration)
+
+        changed = {name: e[1] for name, e in entries.items()} != {
+            name: e[1] for name, e in self._entries.items()
+        }
+        self._entries = entries
+        return changed
+
+    def migrations(self) -> List[Migration]:
+        return sorted(
+            (migration for _, migration in self._entries.values()),
+            key=lambda m: m.version,
+        )
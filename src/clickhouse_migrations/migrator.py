@@ -1,12 +1,55 @@
+import hashlib
+import itertools
 import logging
 import re
+import time
+import uuid
 from collections import namedtuple
-from typing import Dict, List, Optional, Tuple
+from contextlib import closing
+from operator import itemgetter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Sized,
+    Tuple,
+    Union,
+)
 
 from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.drift import FINGERPRINTS_TABLE, record_fingerprint_query
 from clickhouse_migrations.exceptions import MigrationException
-from clickhouse_migrations.migration import Migration
-from clickhouse_migrations.util import quote_identifier
+from clickhouse_migrations.hashing import (
+    HASH_ALGORITHMS,
+    digest_algorithm,
+    script_digest,
+)
+from clickhouse_migrations.hooks import (
+    PHASE_FETCH_APPLIED,
+    PHASE_TOKENIZE,
+    MigrationHook,
+)
+from clickhouse_migrations.lock import LOCK_TABLE
+from clickhouse_migrations.merge import by_version, merge_by_version
+from clickhouse_migrations.migration import (
+    BASELINE_DATABASE,
+    Baseline,
+    BundledMigration,
+    CompactMigration,
+    Migration,
+    MigrationDigests,
+    baseline_sources_md5,
+)
+from clickhouse_migrations.util import (
+    quote_identifier,
+    quote_string,
+    rewrite_database,
+)
 
 MIGRATION_LOG_FORMAT_FULL = "full"
 MIGRATION_LOG_FORMAT_COMPACT = "compact"
@@ -21,6 +64,42 @@ STATUS_UNKNOWN = "unknown"
 # applied_at is None for migrations that have not been applied yet.
 StatusRow = namedtuple("StatusRow", ["version", "state", "md5", "applied_at"])
 
+# Summary of one database in a fleet status report: its highest applied
+# version (None if nothing is applied), the number of pending migrations,
+# and the applied versions whose md5 differs from the local file or that
+# have no local file at all.
+FleetRow = namedtuple(
+    "FleetRow", ["database", "last_applied", "pending", "md5_mismatch", "unknown"]
+)
+
+# Server-side execution statistics of one migration, aggregated over its
+# statements from schema_versions_stats.
+StatsRow = namedtuple(
+    "StatsRow",
+    [
+        "version",
+        "statements",
+        "duration_ms",
+        "read_rows",
+        "read_bytes",
+        "written_rows",
+        "written_bytes",
+        "peak_memory_usage",
+    ],
+)
+
+# Order-independent summary of a set of applied migrations: their number,
+# highest version (0 if none) and the XOR of a 64-bit hash of every
+# (version, md5). See head_checksum and head_checksum_query.
+HeadChecksum = namedtuple("HeadChecksum", ["count", "last_version", "checksum"])
+
+# Room for the query around the local migrations sent by
+# Migrator.query_applied_diff, when raising max_query_size to fit them.
+_DIFF_QUERY_SIZE = 4096
+
+# Namespace for the deterministic query_id given to every migration statement.
+_QUERY_ID_NAMESPACE = uuid.UUID("1e9c2a04-7f31-4c36-9a57-1b2b6f0d8e53")
+
 # Tokenizer used to split a script into statements without treating a ";" that
 # lives inside a string literal, quoted identifier or comment as a delimiter.
 _STATEMENT_TOKEN_RE = re.compile(
@@ -37,12 +116,160 @@ _STATEMENT_TOKEN_RE = re.compile(
 )
 
 
-class Migrator:
+def head_checksum(migrations: Sequence[Migration]) -> HeadChecksum:
+    """HeadChecksum of migrations, as head_checksum_query computes it for the
+    migrations applied to a database."""
+    checksum = 0
+    for migration in migrations:
+        digest = hashlib.md5(f"{migration.version}:{migration.md5}".encode("utf8"))
+        checksum ^= int.from_bytes(digest.digest()[:8], "little")
+    return HeadChecksum(
+        len(migrations), max((m.version for m in migrations), default=0), checksum
+    )
+
+
+def head_checksum_query(database: str) -> str:
+    """SELECT of the HeadChecksum of the migrations applied to database: one
+    row, whatever the size of its history, and no OPTIMIZE."""
+    return (
+        "SELECT count() AS count, max(version) AS last_version, "
+        "groupBitXor(reinterpretAsUInt64(substring("
+        "MD5(concat(toString(version), ':', md5)), 1, 8))) AS checksum "
+        "FROM (SELECT version, argMax(md5, created_at) AS md5 "
+        f"FROM {quote_identifier(database)}.schema_versions GROUP BY version)"
+    )
+
+
+def at_head_query(database: str, head: HeadChecksum) -> str:
+    """SELECT of whether the migrations applied to database have the
+    HeadChecksum head: all of them, with the same digests, and no others."""
+    return (
+        "SELECT (count, last_version, checksum) = "
+        f"({head.count}, {head.last_version}, {head.checksum}) "
+        f"FROM ({head_checksum_query(database)})"
+    )
+
+
+def _digest_matches(local: Migration, digest: str) -> bool:
+    """Whether digest, recorded with any hash algorithm, is that of local."""
+    if local.md5 == digest:
+        return True
+    algorithm = digest_algorithm(digest)
+    if algorithm == digest_algorithm(local.md5) or algorithm not in HASH_ALGORITHMS:
+        return False
+    # Recorded before switching algorithms: digest the script again.
+    return script_digest(local.script, algorithm) == digest
+
+
+def _applied_diff_query(local: List[Migration]) -> Tuple[str, int]:
+    """SELECT of the versions of local that are pending (applied_md5 is NULL)
+    or applied with another md5, and of the applied versions missing from
+    local; and the max_query_size it needs."""
+    applied = (
+        "SELECT version, argMax(md5, created_at) AS md5 "
+        "FROM schema_versions GROUP BY version"
+    )
+    if not local:
+        return (
+            f"SELECT version, md5 AS applied_md5 FROM ({applied}) ORDER BY version",
+            _DIFF_QUERY_SIZE,
+        )
+
+    # One string literal, split by the server: parsing thousands of literals
+    # (e.g. a VALUES list) would cost more than the rest of the query.
+    entries = quote_string(" ".join(f"{int(m.version)}:{m.md5}" for m in local))
+    max_query_size = len(entries.encode("utf8")) + _DIFF_QUERY_SIZE
+    query = (
+        "SELECT ifNull(local.version, applied.version) AS version, "
+        "applied.md5 AS applied_md5 "
+        # Digests other than md5 contain ':' too: split at the first one.
+        "FROM (SELECT toUInt32(substring(entry, 1, position(entry, ':') - 1)) "
+        "AS version, substring(entry, position(entry, ':') + 1) AS md5 "
+        f"FROM (SELECT arrayJoin(splitByChar(' ', {entries})) AS entry)"
+        ") AS local "
+        f"FULL OUTER JOIN ({applied}) AS applied "
+        "ON local.version = applied.version "
+        "WHERE local.version IS NULL OR applied.version IS NULL "
+        "OR local.md5 != applied.md5 "
+        "ORDER BY version "
+        f"SETTINGS join_use_nulls = 1, max_query_size = {max_query_size}"
+    )
+    return query, max_query_size
+
+
+def statement_log_comment(version: int, index: int) -> str:
+    return f"migration={int(version)};stmt={int(index)}"
+
+
+def statement_query_id(database: str, migration: Migration, index: int) -> str:
+    """Deterministic query_id for the index-th statement of a migration.
+
+    It only depends on the database and the migration itself, so the same
+    statement always maps to the same system.query_log entry, while the same
+    migration running against two databases never clashes.
+    """
+    name = f"{database}/{migration.version}/{migration.md5}/{index}"
+    return str(uuid.uuid5(_QUERY_ID_NAMESPACE, name))
+
+
+def _table_ddl(
+    name: str, columns: str, cluster_name: Optional[str], ttl: Optional[str] = None
+) -> str:
+    ttl_clause = "" if ttl is None else f" TTL {ttl}"
+    if cluster_name is None:
+        return f"""CREATE TABLE IF NOT EXISTS {name} (
+{columns}
+) ENGINE = MergeTree ORDER BY tuple(created_at){ttl_clause}"""
+
+    return f"""CREATE TABLE IF NOT EXISTS {name} ON CLUSTER {quote_identifier(cluster_name)} (
+{columns}
+) ENGINE = ReplicatedMergeTree('/clickhouse/tables/{{database}}/{{table}}', '{{replica}}')
+ORDER BY tuple(created_at){ttl_clause}"""
+
+
+_SCHEMA_VERSIONS_COLUMNS = """    version UInt32,
+    md5 String,
+    script String,
+    created_at DateTime DEFAULT now()"""
+
+_SCHEMA_VERSIONS_STATS_COLUMNS = """    version UInt32,
+    statement UInt32,
+    query_id String,
+    query_duration_ms UInt64,
+    read_rows UInt64,
+    read_bytes UInt64,
+    written_rows UInt64,
+    written_bytes UInt64,
+    memory_usage UInt64,
+    exception String,
+    created_at DateTime DEFAULT now()"""
+
+_SCHEMA_VERSIONS_LOCK_COLUMNS = """    owner String,
+    renewed_at DateTime64(6),
+    expires_at DateTime64(6),
+    created_at DateTime DEFAULT now()"""
+
+# Rows of leases expired a day ago are dropped by merges, so that the lock
+# table stays small. The claim row of a run holding the lease for less than a
+# day, which dates its claim, is kept.
+_SCHEMA_VERSIONS_LOCK_TTL = "toDateTime(expires_at) + INTERVAL 1 DAY"
+
+_SCHEMA_VERSIONS_FINGERPRINTS_COLUMNS = """    version UInt32,
+    fingerprint UInt64,
+    definitions Map(String, String),
+    created_at DateTime DEFAULT now()"""
+
+
+class Migrator:  # pylint: disable=too-many-instance-attributes
     def __init__(
         self,
         conn: Connection,
         dryrun: bool = False,
         migration_log_format: str = MIGRATION_LOG_FORMAT_FULL,
+        collect_stats: bool = False,
+        hooks: Sequence[MigrationHook] = (),
+        record_fingerprint: bool = False,
+        tokenize_workers: int = 0,
     ):
         if migration_log_format not in MIGRATION_LOG_FORMATS:
             raise ValueError(
@@ -53,25 +280,45 @@ class Migrator:
         self._conn: Connection = conn
         self._dryrun = dryrun
         self._migration_log_format = migration_log_format
+        self._collect_stats = collect_stats
+        self._record_fingerprint = record_fingerprint
+        self._database: Optional[str] = None
+        self._hooks = tuple(hooks)
+        # Above 1, scripts are split by that many processes ahead of execution.
+        self._tokenize_workers = tokenize_workers
 
     def init_schema(self, cluster_name: Optional[str] = None):
-        if cluster_name is None:
-            schema = """CREATE TABLE IF NOT EXISTS schema_versions (
-    version UInt32,
-    md5 String,
-    script String,
-    created_at DateTime DEFAULT now()
-) ENGINE = MergeTree ORDER BY tuple(created_at)"""
-        else:
-            schema = f"""CREATE TABLE IF NOT EXISTS schema_versions ON CLUSTER {quote_identifier(cluster_name)} (
-    version UInt32,
-    md5 String,
-    script String,
-    created_at DateTime DEFAULT now()
-) ENGINE = ReplicatedMergeTree('/clickhouse/tables/{{database}}/{{table}}', '{{replica}}')
-ORDER BY tuple(created_at)"""
+        self._conn.command(
+            _table_ddl("schema_versions", _SCHEMA_VERSIONS_COLUMNS, cluster_name)
+        )
+
+        if self._collect_stats:
+            self._conn.command(
+                _table_ddl(
+                    "schema_versions_stats",
+                    _SCHEMA_VERSIONS_STATS_COLUMNS,
+                    cluster_name,
+                )
+            )
 
-        self._conn.command(schema)
+        if self._record_fingerprint:
+            self._conn.command(
+                _table_ddl(
+                    FINGERPRINTS_TABLE,
+                    _SCHEMA_VERSIONS_FINGERPRINTS_COLUMNS,
+                    cluster_name,
+                )
+            )
+
+    def init_lock_table(self, cluster_name: Optional[str] = None):
+        self._conn.command(
+            _table_ddl(
+                LOCK_TABLE,
+                _SCHEMA_VERSIONS_LOCK_COLUMNS,
+                cluster_name,
+                ttl=_SCHEMA_VERSIONS_LOCK_TTL,
+            )
+        )
 
     def query_applied_migrations(self) -> List[Migration]:
         self.optimize_schema_table()
@@ -85,55 +332,132 @@ ORDER BY tuple(created_at)"""
 
         return [Migration(**row) for row in self._conn.query(query)]
 
-    def migrations_to_apply(self, incoming: List[Migration]) -> List[Migration]:
-        applied = self.query_applied_migrations()
-
-        if not applied:
-            return incoming
+    def _fetch_applied_migrations(self) -> List[Migration]:
+        if not self._hooks:
+            return self.query_applied_migrations()
 
-        if len(incoming) == 0 or len(incoming) < len(applied):
+        started = time.perf_counter()
+        applied = self.query_applied_migrations()
+        duration = time.perf_counter() - started
+        for hook in self._hooks:
+            hook.on_phase(PHASE_FETCH_APPLIED, started, duration)
+        return applied
+
+    def query_applied_diff(self, incoming: List[Migration]) -> List[Migration]:
+        """The applied migrations, as migrations_to_apply needs them, computed
+        from the differences between incoming and schema_versions only.
+
+        The versions and md5s of incoming are sent along with a join that
+        returns the pending versions, the md5 mismatches and the unknown
+        applied versions, so what comes back scales with the difference rather
+        than the history, and schema_versions needs no OPTIMIZE. Every other
+        incoming migration is applied as is.
+        """
+        if self._hooks:
+            started = time.perf_counter()
+
+        incoming = by_version(incoming)
+        query, max_query_size = _applied_diff_query(incoming)
+        # The limit applies while the query is read, so it is also sent ahead
+        # of the query: the SETTINGS clause alone is too late over HTTP.
+        rows = self._conn.query(query, settings={"max_query_size": max_query_size})
+        applied: List[Migration] = []
+        for version, local, row in merge_by_version(
+            incoming, rows, itemgetter("version")
+        ):
+            if row is None:
+                applied.append(local)
+            elif row["applied_md5"] is not None:
+                # Applied with another md5, or unknown locally; else pending.
+                applied.append(Migration(version, row["applied_md5"], None))
+
+        if self._hooks:
+            duration = time.perf_counter() - started
+            for hook in self._hooks:
+                hook.on_phase(PHASE_FETCH_APPLIED, started, duration)
+        return applied
+
+    def migrations_to_apply(
+        self,
+        incoming: Iterable[Migration],
+        applied: Optional[Iterable[Migration]] = None,
+    ) -> List[Migration]:
+        """The incoming migrations not applied yet. Callers that keep the
+        applied migrations up to date themselves (see watch) pass them as
+        applied, which saves querying schema_versions.
+
+        Both are read once, in a single merge. incoming, and applied when a
+        list, are sorted by version first; applied may also be an iterator
+        (e.g. a streamed query result) sorted by version.
+        """
+        incoming = by_version(incoming)
+        if applied is None:
+            applied = self._fetch_applied_migrations()
+        applied = by_version(applied) if isinstance(applied, list) else applied
+
+        # Every applied row counts, as in schema_versions, even duplicates.
+        rows = itertools.count()
+        if isinstance(applied, Sized):
+            applied_count = len(applied)
+        else:
+            applied_count = None
+            applied = (migration for migration, _ in zip(applied, rows))
+
+        incoming_count = 0
+        pending: List[Migration] = []
+        md5_mismatch = unknown = None
+        for version, local, remote in merge_by_version(incoming, applied):
+            if local is None:
+                unknown = version if unknown is None else unknown
+                continue
+            incoming_count += 1
+            if remote is None:
+                pending.append(local)
+            elif md5_mismatch is None and not _digest_matches(local, remote.md5):
+                md5_mismatch = version
+
+        if applied_count is None:
+            # zip stops at the end of the applied rows, before counting on.
+            applied_count = next(rows)
+
+        if not applied_count:
+            return pending
+
+        if incoming_count == 0 or incoming_count < applied_count:
             raise MigrationException(
                 "Migrations have gone missing, "
                 "your code base should not truncate migrations, "
                 "use migrations to correct older migrations"
             )
 
-        # create outer join
-        joined_migrations: Dict[Tuple[Migration, Migration]] = {
-            m.version: [m, None] for m in incoming
-        }
-        for m in applied:
-            if m.version in joined_migrations:
-                joined_migrations[m.version][1] = m
-            else:
-                joined_migrations[m.version] = [None, m]
-
         # md5 of applied function must be equal
-        for version, p in joined_migrations.items():
-            left, right = p
-            if left and right and left.md5 != right.md5:
-                raise MigrationException(
-                    "Migrations md5 is not equal, " f"Migration version is {version}."
-                )
+        if md5_mismatch is not None:
+            raise MigrationException(
+                "Migrations md5 is not equal, " f"Migration version is {md5_mismatch}."
+            )
 
         # all migrations should be known
-        for version, p in joined_migrations.items():
-            left, right = p
-            if not left and right:
-                raise MigrationException(
-                    "There is applied migrations, which is not known by current migrations list. "
-                    f"Migration version is {version}."
-                )
-
-        to_apply = [
-            left for left, right in joined_migrations.values() if left and not right
-        ]
-        return sorted(to_apply, key=lambda x: x.version)
+        if unknown is not None:
+            raise MigrationException(
+                "There is applied migrations, which is not known by current migrations list. "
+                f"Migration version is {unknown}."
+            )
 
-    def migration_status(self, incoming: List[Migration]) -> List[StatusRow]:
-        return self._build_status(incoming, self._query_applied_meta())
+        return pending
 
-    def _query_applied_meta(self) -> Dict[int, Tuple[str, object]]:
+    def migration_status(
+        self,
+        incoming: List[Migration],
+        applied: Optional[Dict[int, Tuple[str, object]]] = None,
+    ) -> List[StatusRow]:
+        """Status of every local or applied migration. applied, as returned
+        by query_applied_meta, saves querying schema_versions."""
+        if applied is None:
+            applied = self.query_applied_meta()
+        return self._build_status(incoming, applied)
+
+    def query_applied_meta(self) -> Dict[int, Tuple[str, object]]:
+        """md5 and time of application of every applied migration."""
         rows = self._conn.query(
             "SELECT version, argMax(md5, created_at) AS md5, "
             "max(created_at) AS applied_at "
@@ -141,21 +465,81 @@ ORDER BY tuple(created_at)"""
         )
         return {row["version"]: (row["md5"], row["applied_at"]) for row in rows}
 
+    @staticmethod
+    def fleet_status(
+        incoming: List[Migration],
+        applied_by_database: Dict[
+            str, Union[MigrationDigests, Mapping[int, Tuple[str, object]]]
+        ],
+    ) -> List[FleetRow]:
+        """Compare the applied migrations of many databases, as returned by
+        one query, with the same local migrations. Applied migrations are
+        MigrationDigests, or mappings of version to (md5, applied_at)."""
+        # Digests are compared as bytes, without formatting them in hex.
+        local_migrations = {m.version: m for m in incoming}
+        incoming = [CompactMigration.from_migration(m) for m in by_version(incoming)]
+        # Digests of another algorithm, checked once for all the databases.
+        matches: Dict[Tuple[int, str], bool] = {}
+
+        def matching(version: int, digest: str) -> bool:
+            if (version, digest) not in matches:
+                matches[version, digest] = _digest_matches(
+                    local_migrations[version], digest
+                )
+            return matches[version, digest]
+
+        fleet: List[FleetRow] = []
+        for database, applied in sorted(applied_by_database.items()):
+            if isinstance(applied, Mapping):
+                applied = MigrationDigests(
+                    Migration(version, md5, None)
+                    for version, (md5, _) in sorted(applied.items())
+                )
+            pending = 0
+            md5_mismatch: List[int] = []
+            unknown: List[int] = []
+            for version, local, remote in merge_by_version(incoming, applied):
+                if remote is None:
+                    pending += 1
+                elif local is None:
+                    unknown.append(version)
+                elif local.digest != remote.digest and not matching(
+                    version, remote.md5
+                ):
+                    md5_mismatch.append(version)
+            fleet.append(
+                FleetRow(
+                    database,
+                    applied.last_version,
+                    pending,
+                    tuple(md5_mismatch),
+                    tuple(unknown),
+                )
+            )
+        return fleet
+
     @staticmethod
     def _build_status(
-        incoming: List[Migration], applied: Dict[int, Tuple[str, object]]
+        incoming: Iterable[Migration],
+        applied: Union[
+            Mapping[int, Tuple[str, object]], Iterable[Tuple[int, Tuple[str, object]]]
+        ],
     ) -> List[StatusRow]:
-        incoming_by_version = {m.version: m for m in incoming}
+        """Status rows of incoming and applied, as a mapping or an iterable of
+        (version, (md5, applied_at)) sorted by version."""
+        incoming = by_version(incoming)
+        if isinstance(applied, Mapping):
+            applied = by_version(applied.items(), itemgetter(0))
 
         rows: List[StatusRow] = []
-        for version in sorted(set(incoming_by_version) | set(applied)):
-            local = incoming_by_version.get(version)
-            applied_meta = applied.get(version)
-
+        for version, local, item in merge_by_version(incoming, applied, itemgetter(0)):
+            applied_meta = None if item is None else item[1]
             if local and applied_meta:
                 applied_md5, applied_at = applied_meta
                 state = (
-                    STATUS_APPLIED if local.md5 == applied_md5 else STATUS_MD5_MISMATCH
+                    STATUS_APPLIED
+                    if _digest_matches(local, applied_md5)
+                    else STATUS_MD5_MISMATCH
                 )
                 rows.append(StatusRow(version, state, applied_md5, applied_at))
             elif local:
@@ -177,51 +561,249 @@ ORDER BY tuple(created_at)"""
         migrations: List[Migration],
         multi_statement: bool,
         fake: bool = False,
+        load_baseline: Optional[Callable[[], Optional[Baseline]]] = None,
+        applied: Optional[Iterable[Migration]] = None,
     ) -> List[Migration]:
+        """Apply the pending ones of migrations and return them.
+
+        load_baseline is only called, to read and verify the baseline, when
+        every migration is pending.
+        """
         migrations_to_process = (
-            migrations if fake else self.migrations_to_apply(migrations)
+            migrations if fake else self.migrations_to_apply(migrations, applied)
         )
 
         logging.info("Total migrations to apply: %d", len(migrations_to_process))
 
         if not migrations_to_process:
+            if self._record_fingerprint:
+                self.record_fingerprint(applied=False)
             return []
 
-        for migration in migrations_to_process:
-            logging.info("Execute migration %s", self.format_migration_log(migration))
+        # A baseline only replaces the history of a database that has none;
+        # elsewhere the applied migrations keep being verified one by one.
+        baseline = None
+        if load_baseline is not None and not fake:
+            if len(migrations_to_process) == len(migrations):
+                baseline = load_baseline()
+        use_baseline = (
+            baseline is not None
+            and migrations_to_process[0].version <= baseline.version
+        )
 
-            statements = self.script_to_statements(migration.script, multi_statement)
+        query_ids: List[str] = []
+        try:
+            remaining = migrations_to_process
+            if use_baseline:
+                remaining = self._apply_baseline(baseline, remaining, query_ids)
+            self._apply_migrations(remaining, multi_statement, fake, query_ids)
+        finally:
+            if query_ids:
+                self.collect_statement_stats(query_ids)
+
+        if self._record_fingerprint:
+            self.record_fingerprint(applied=True)
+        return migrations_to_process
 
-            logging.info("Migration contains %s statements to apply", len(statements))
-            for statement in statements:
-                if fake:
-                    logging.warning(
-                        "Fake mode, statement will be skipped: %s", statement
-                    )
-                elif self._dryrun:
-                    logging.info("Dry run mode, would have executed: %s", statement)
+    def _apply_baseline(
+        self, baseline: Baseline, pending: List[Migration], query_ids: List[str]
+    ) -> List[Migration]:
+        """Apply the baseline and record every migration it covers with one
+        insert; return the migrations left to apply after it."""
+        covered = [m for m in pending if m.version <= baseline.version]
+        if baseline_sources_md5(covered) != baseline.sources_md5:
+            raise MigrationException(
+                f"Baseline {baseline.version} was not made from the current "
+                f"migrations up to version {baseline.version}; re-run squash."
+            )
+
+        logging.info(
+            "Apply baseline of %d migrations up to version %d",
+            len(covered),
+            baseline.version,
+        )
+        if self._database is None:
+            self._database = self._conn.query("SELECT currentDatabase() AS db")[0]["db"]
+
+        for hook in self._hooks:
+            hook.before_baseline(baseline, len(covered))
+        statements = [
+            rewrite_database(statement, BASELINE_DATABASE, self._database)
+            for statement in self.script_to_statements(baseline.script, True)
+        ]
+        tag_statements = self._collect_stats and not self._dryrun
+        self._run_statements(baseline, statements, False, tag_statements, query_ids)
+
+        if self._dryrun:
+            logging.debug("Skip updating schema versions because dry run is enabled")
+        else:
+            if self._hooks:
+                started = time.perf_counter()
+            self._conn.insert(
+                "schema_versions",
+                [
+                    {"version": m.version, "script": m.script, "md5": m.md5}
+                    for m in covered
+                ],
+            )
+            if self._hooks:
+                duration = time.perf_counter() - started
+                for hook in self._hooks:
+                    hook.after_bookkeeping(baseline, started, duration)
+
+        return pending[len(covered) :]
+
+    def _apply_migrations(
+        self,
+        migrations: List[Migration],
+        multi_statement: bool,
+        fake: bool,
+        query_ids: List[str],
+    ) -> None:
+        tag_statements = self._collect_stats and not fake and not self._dryrun
+        if tag_statements and self._database is None:
+            self._database = self._conn.query("SELECT currentDatabase() AS db")[0]["db"]
+
+        hooks = self._hooks
+        with closing(self._statements_of(migrations, multi_statement)) as split:
+            for migration in migrations:
+                logging.info(
+                    "Execute migration %s", self.format_migration_log(migration)
+                )
+                if not hooks:
+                    statements = next(split)
                 else:
-                    self._conn.command(statement)
+                    for hook in hooks:
+                        hook.before_migration(migration)
+                    started = time.perf_counter()
+                    statements = next(split)
+                    duration = time.perf_counter() - started
+                    for hook in hooks:
+                        hook.on_phase(PHASE_TOKENIZE, started, duration)
 
-            logging.info("Migration applied, need to update schema version table.")
-            if fake:
-                logging.debug("update schema versions because fake option is enabled")
-                self._conn.command(
-                    "ALTER TABLE schema_versions "
-                    f"DELETE WHERE version = {int(migration.version)}"
+                logging.info(
+                    "Migration contains %s statements to apply", len(statements)
+                )
+                self._run_statements(
+                    migration, statements, fake, tag_statements, query_ids
                 )
-                self._insert_schema_version(migration)
+
+                logging.info("Migration applied, need to update schema version table.")
+                self._update_schema_version(migration, fake)
+
+                logging.info("Migration is fully applied.")
+
+    def _statements_of(
+        self, migrations: List[Migration], multi_statement: bool
+    ) -> Iterator[List[str]]:
+        """The statements of each of migrations, in order, split when needed."""
+        if multi_statement and self._tokenize_workers > 1 and len(migrations) > 1:
+            # Imported when used: multiprocessing is slow to import.
+            # pylint: disable=import-outside-toplevel
+            from clickhouse_migrations.tokenizing import statements_ahead
+
+            return statements_ahead(
+                migrations,
+                self.statement_spans,
+                lambda m: self._statements(m, True),
+                self._tokenize_workers,
+            )
+        return (self._statements(m, multi_statement) for m in migrations)
+
+    def _statements(self, migration: Migration, multi_statement: bool) -> List[str]:
+        # Bundles store the statements of their migrations already split.
+        if multi_statement and isinstance(migration, BundledMigration):
+            return migration.statements()
+        return self.script_to_statements(migration.script, multi_statement)
+
+    def _run_statements(
+        self,
+        migration,
+        statements: List[str],
+        fake: bool,
+        tag_statements: bool,
+        query_ids: List[str],
+    ) -> None:
+        for index, statement in enumerate(statements, start=1):
+            if fake:
+                logging.warning("Fake mode, statement will be skipped: %s", statement)
             elif self._dryrun:
-                logging.debug(
-                    "Skip updating schema versions because dry run is enabled"
+                logging.info("Dry run mode, would have executed: %s", statement)
+            elif tag_statements:
+                query_id = statement_query_id(self._database, migration, index)
+                query_ids.append(query_id)
+                self._execute_statement(
+                    migration,
+                    index,
+                    statement,
+                    query_id=query_id,
+                    settings={
+                        "log_comment": statement_log_comment(migration.version, index)
+                    },
                 )
             else:
-                logging.debug("Insert new schemas")
-                self._insert_schema_version(migration)
+                self._execute_statement(migration, index, statement)
 
-            logging.info("Migration is fully applied.")
+    def _execute_statement(
+        self,
+        migration: Migration,
+        index: int,
+        statement: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict] = None,
+    ) -> None:
+        if not self._hooks:
+            self._send_statement(statement, query_id, settings)
+            return
+
+        for hook in self._hooks:
+            hook.before_statement(migration, index, statement)
+
+        error: Optional[BaseException] = None
+        started = time.perf_counter()
+        try:
+            self._send_statement(statement, query_id, settings)
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            for hook in self._hooks:
+                hook.after_statement(
+                    migration, index, statement, started, duration, error
+                )
 
-        return migrations_to_process
+    def _send_statement(
+        self, statement: str, query_id: Optional[str], settings: Optional[Dict]
+    ) -> None:
+        if query_id is None:
+            self._conn.command(statement)
+        else:
+            self._conn.command(statement, query_id=query_id, settings=settings)
+
+    def _update_schema_version(self, migration: Migration, fake: bool) -> None:
+        if self._dryrun and not fake:
+            logging.debug("Skip updating schema versions because dry run is enabled")
+            return
+
+        if self._hooks:
+            started = time.perf_counter()
+
+        if fake:
+            logging.debug("update schema versions because fake option is enabled")
+            self._conn.command(
+                "ALTER TABLE schema_versions "
+                f"DELETE WHERE version = {int(migration.version)}"
+            )
+            self._insert_schema_version(migration)
+        else:
+            logging.debug("Insert new schemas")
+            self._insert_schema_version(migration)
+
+        if self._hooks:
+            duration = time.perf_counter() - started
+            for hook in self._hooks:
+                hook.after_bookkeeping(migration, started, duration)
 
     def _rollback_targets(self, steps: int, to_version: Optional[int]) -> List[int]:
         applied_versions = [m.version for m in self.query_applied_migrations()]
@@ -238,7 +820,7 @@ ORDER BY tuple(created_at)"""
 
     def rollback_migration(
         self,
-        down_scripts: Dict[int, str],
+        down_scripts: Mapping[int, str],
         steps: int = 1,
         to_version: Optional[int] = None,
         multi_statement: bool = True,
@@ -249,7 +831,8 @@ ORDER BY tuple(created_at)"""
             return []
 
         # Fail-fast: refuse to start unless every target has a down script, so we
-        # never leave the database half rolled back on a missing file.
+        # never leave the database half rolled back on a missing file. Only
+        # which versions have one is checked: scripts are read as rolled back.
         missing = sorted(v for v in targets if v not in down_scripts)
         if missing:
             raise MigrationException(
@@ -301,6 +884,70 @@ ORDER BY tuple(created_at)"""
             ],
         )
 
+    def collect_statement_stats(self, query_ids: List[str]) -> None:
+        """Copy the system.query_log entries of the given statements into
+        schema_versions_stats with a single INSERT ... SELECT.
+
+        Statistics are best effort: query_log may be disabled or the user may
+        lack SYSTEM FLUSH LOGS, and neither should fail a migration run.
+        """
+        id_list = ", ".join(quote_string(query_id) for query_id in query_ids)
+        try:
+            self._conn.command("SYSTEM FLUSH LOGS")
+            self._conn.command(
+                "INSERT INTO schema_versions_stats (version, statement, query_id, "
+                "query_duration_ms, read_rows, read_bytes, written_rows, "
+                "written_bytes, memory_usage, exception) "
+                "SELECT "
+                "toUInt32OrZero(extract(log_comment, 'migration=([0-9]+)')), "
+                "toUInt32OrZero(extract(log_comment, 'stmt=([0-9]+)')), "
+                "query_id, "
+                "argMax(query_duration_ms, event_time_microseconds), "
+                "argMax(read_rows, event_time_microseconds), "
+                "argMax(read_bytes, event_time_microseconds), "
+                "argMax(written_rows, event_time_microseconds), "
+                "argMax(written_bytes, event_time_microseconds), "
+                "argMax(memory_usage, event_time_microseconds), "
+                "argMax(exception, event_time_microseconds) "
+                "FROM system.query_log "
+                "WHERE event_date >= yesterday() "
+                "AND type IN ('QueryFinish', 'ExceptionWhileProcessing') "
+                f"AND query_id IN ({id_list}) "
+                "GROUP BY query_id, log_comment"
+            )
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            logging.warning("Failed to collect statement statistics: %s", exc)
+
+    def record_fingerprint(self, applied: bool) -> None:
+        """Record the fingerprint of the database schema with one
+        INSERT ... SELECT, for the drift check to compare against.
+
+        A run that applied nothing only records one if none exists yet.
+        """
+        if self._dryrun:
+            logging.debug("Skip recording the schema fingerprint in dry run mode")
+            return
+        self._conn.command(record_fingerprint_query(force=applied))
+
+    def query_stats(self) -> List[StatsRow]:
+        # Only the latest entry of every statement counts, so re-applying a
+        # migration (e.g. after a failed run) does not double its numbers.
+        rows = self._conn.query(
+            "SELECT version, "
+            "count() AS statements, "
+            "sum(query_duration_ms) AS duration_ms, "
+            "sum(read_rows) AS read_rows, "
+            "sum(read_bytes) AS read_bytes, "
+            "sum(written_rows) AS written_rows, "
+            "sum(written_bytes) AS written_bytes, "
+            "max(memory_usage) AS peak_memory_usage "
+            "FROM ("
+            "SELECT * FROM schema_versions_stats "
+            "ORDER BY created_at DESC LIMIT 1 BY version, statement"
+            ") GROUP BY version ORDER BY version"
+        )
+        return [StatsRow(**row) for row in rows]
+
     def optimize_schema_table(self):
         self._conn.command("OPTIMIZE TABLE schema_versions FINAL")
 
@@ -309,19 +956,27 @@ ORDER BY tuple(created_at)"""
         if not multi_statement:
             return [script.strip()]
 
-        statements: List[str] = []
-        current: List[str] = []
+        return [script[start:end] + ";" for start, end in cls.statement_spans(script)]
+
+    @classmethod
+    def statement_spans(cls, script: str) -> List[Tuple[int, int]]:
+        """(start, end) of every ';'-separated statement of script, without
+        its surrounding whitespace and terminating ';'."""
+        spans: List[Tuple[int, int]] = []
+        begin = 0
         for match in _STATEMENT_TOKEN_RE.finditer(script):
             if match.lastgroup == "semicolon":
-                statement = "".join(current).strip()
-                if statement:
-                    statements.append(statement + ";")
-                current = []
-            else:
-                current.append(match.group())
-
-        statement = "".join(current).strip()
-        if statement:
-            statements.append(statement + ";")
+                cls._append_span(spans, script, begin, match.start())
+                begin = match.end()
+        cls._append_span(spans, script, begin, len(script))
+        return spans
 
-        return statements
+    @staticmethod
+    def _append_span(
+        spans: List[Tuple[int, int]], script: str, begin: int, end: int
+    ) -> None:
+        text = script[begin:end]
+        stripped = text.strip()
+        if stripped:
+            start = begin + len(text) - len(text.lstrip())
+            spans.append((start, start + len(stripped)))
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from clickhouse_migrations.hooks import MigrationHook
+from clickhouse_migrations.util import atomic_write_text, format_table
+
+CATEGORY_PHASE = "phase"
+CATEGORY_MIGRATION = "migration"
+CATEGORY_STATEMENT = "statement"
+
+# One timed span. started/duration are perf_counter seconds; tid is the thread
+# that produced it, which names its track in the trace.
+Span = namedtuple("Span", ["name", "category", "started", "duration", "tid", "args"])
+
+
+class Profiler(MigrationHook):
+    """Hook timing every phase, migration and statement of a run.
+
+    Use summary() for a per-phase table and write_trace() for a Chrome
+    trace-event JSON file that can be opened in Perfetto or chrome://tracing.
+    With trace_memory, tracemalloc is started and the Python-side peak memory
+    of every migration and of the whole run is recorded as well.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.spans: List[Span] = []
+        self.trace_memory = trace_memory
+        self.peak_memory: Optional[int] = None
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread_names: Dict[int, str] = {}
+
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _add(self, name, category, started, duration, args=None) -> None:
+        thread = threading.current_thread()
+        with self._lock:
+            self._thread_names.setdefault(thread.ident, thread.name)
+            self.spans.append(
+                Span(name, category, started, duration, thread.ident, args or {})
+            )
+
+    def on_phase(self, phase: str, started: float, duration: float) -> None:
+        self._add(phase, CATEGORY_PHASE, started, duration)
+
+    def before_migration(self, migration) -> None:
+        self._local.migration_started = time.perf_counter()
+        self._local.versions = 1
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+    def before_baseline(self, baseline, versions: int) -> None:
+        self.before_migration(baseline)
+        self._local.versions = versions
+
+    def after_statement(
+        self, migration, index, statement, started, duration, error
+    ) -> None:
+        args = {"version": migration.version, "statement": index}
+        if error is not None:
+            args["error"] = repr(error)
+        self._add(
+            f"v{migration.version} stmt {index}",
+            CATEGORY_STATEMENT,
+            started,
+            duration,
+            args,
+        )
+
+    def after_bookkeeping(self, migration, started: float, duration: float) -> None:
+        self._add("bookkeeping", CATEGORY_PHASE, started, duration)
+
+        migration_started = getattr(self._local, "migration_started", started)
+        args = {"version": migration.version}
+        versions = getattr(self._local, "versions", 1)
+        if versions > 1:
+            args["versions"] = versions
+        if self.trace_memory:
+            args["peak_memory_bytes"] = tracemalloc.get_traced_memory()[1]
+            self.peak_memory = max(self.peak_memory or 0, args["peak_memory_bytes"])
+        self._add(
+            f"migration {migration.version}",
+            CATEGORY_MIGRATION,
+            migration_started,
+            started + duration - migration_started,
+            args,
+        )
+
+    def phase_totals(self) -> Dict[str, List[float]]:
+        """Map every phase (and "execute" for statements) to [count, total, max]."""
+        totals: Dict[str, List[float]] = {}
+        for span in self.spans:
+            if span.category == CATEGORY_MIGRATION:
+                continue
+            name = "execute" if span.category == CATEGORY_STATEMENT else span.name
+            entry = totals.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += span.duration
+            entry[2] = max(entry[2], span.duration)
+        return totals
+
+    def summary(self) -> str:
+        wall = time.perf_counter() - self._origin
+        table = [("PHASE", "COUNT", "TOTAL MS", "MAX MS", "% OF RUN")]
+        for name, (count, total, longest) in sorted(
+            self.phase_totals().items(), key=lambda item: item[1][1], reverse=True
+        ):
+            table.append(
+                (
+                    name,
+                    str(count),
+                    f"{total * 1000:.3f}",
+                    f"{longest * 1000:.3f}",
+                    f"{total / wall * 100:.1f}" if wall else "",
+                )
+            )
+
+        lines = [format_table(table)]
+        lines.append(f"Total wall time: {wall * 1000:.3f} ms")
+        if self.trace_memory:
+            peak = max(self.peak_memory or 0, tracemalloc.get_traced_memory()[1])
+            lines.append(f"Peak traced memory: {peak} bytes")
+        return "\n".join(lines)
+
+    def trace_events(self) -> List[Dict]:
+        pid = os.getpid()
+        # Small, stable track ids in order of appearance; the first thread to
+        # report is the main runner.
+        tids = {ident: n for n, ident in enumerate(self._thread_names, start=1)}
+
+        events: List[Dict] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tids[ident],
+                "args": {"name": name},
+            }
+            for ident, name in self._thread_names.items()
+        ]
+        for span in self.spans:
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": round((span.started - self._origin) * 1e6, 3),
+                    "dur": round(span.duration * 1e6, 3),
+                    "pid": pid,
+                    "tid": tids[span.tid],
+                    "args": span.args,
+                }
+            )
+        return events
+
+    def write_trace(self, path: Union[Path, str]) -> None:
+        atomic_write_text(
+            path,
+            json.dumps({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}),
+        )
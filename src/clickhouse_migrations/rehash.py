@@ -0,0 +1,114 @@
+import logging
+from typing import List, Mapping, Sequence, Tuple
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.hashing import (
+    HASH_ALGORITHMS,
+    MD5,
+    digest_algorithm,
+    script_digest,
+)
+from clickhouse_migrations.migration import Migration
+from clickhouse_migrations.migrator import (
+    HeadChecksum,
+    Migrator,
+    _digest_matches,
+    head_checksum,
+)
+from clickhouse_migrations.util import quote_identifier, quote_string
+
+# Room left in max_query_size for the statement around the listed rows.
+_STATEMENT_SIZE = 4096
+
+
+def rehash_statement(
+    updates: List[Tuple[int, str, str]], wait: bool
+) -> Tuple[str, int]:
+    """ALTER ... UPDATE replacing, for every (version, md5, digest) of
+    updates, md5 with digest in the rows of version that have it; and the
+    max_query_size it needs.
+
+    One mutation updates every row. The server runs it in the background
+    unless wait; rows not updated yet keep verifying as they did.
+    """
+    versions = ", ".join(str(int(version)) for version, _, _ in updates)
+    digests = ", ".join(quote_string(digest) for _, _, digest in updates)
+    rows = ", ".join(
+        f"({int(version)}, {quote_string(md5)})" for version, md5, _ in updates
+    )
+    max_query_size = len(versions) + len(digests) + len(rows) + _STATEMENT_SIZE
+    statement = (
+        "ALTER TABLE schema_versions "
+        f"UPDATE md5 = transform(version, [{versions}], [{digests}], md5) "
+        f"WHERE has([{rows}], (version, md5)) "
+        f"SETTINGS mutations_sync = {2 if wait else 0}, "
+        f"max_query_size = {max_query_size}"
+    )
+    return statement, max_query_size
+
+
+def rehash_applied(
+    conn: Connection,
+    incoming: List[Migration],
+    wait: bool = False,
+    dryrun: bool = False,
+) -> List[int]:
+    """Record the digests of incoming in place of the applied ones of the
+    database of conn made with another hash algorithm, for the versions where
+    both match. Returns the versions rehashed."""
+    applied = Migrator(conn).query_applied_meta()
+    updates: List[Tuple[int, str, str]] = []
+    for migration in incoming:
+        if migration.version not in applied:
+            continue
+        md5 = applied[migration.version][0]
+        if digest_algorithm(md5) != digest_algorithm(migration.md5) and _digest_matches(
+            migration, md5
+        ):
+            updates.append((migration.version, md5, migration.md5))
+
+    if not updates:
+        logging.info("Nothing to rehash.")
+        return []
+
+    statement, max_query_size = rehash_statement(updates, wait)
+    if dryrun:
+        logging.info("Dry run mode, would have executed: %s", statement)
+    else:
+        # The limit applies while the statement is read: sent ahead of it too.
+        conn.command(statement, settings={"max_query_size": max_query_size})
+    return [version for version, _, _ in updates]
+
+
+def recorded_head_checksum(
+    migrations: Sequence[Migration], recorded: Mapping[int, str]
+) -> HeadChecksum:
+    """HeadChecksum of migrations as a database records them, when recorded
+    maps some of their versions to a digest made with another algorithm (not
+    rehashed yet): those are digested again with the algorithm of theirs."""
+    as_recorded = []
+    for migration in migrations:
+        algorithm = digest_algorithm(recorded.get(migration.version, migration.md5))
+        if (
+            algorithm != digest_algorithm(migration.md5)
+            and algorithm in HASH_ALGORITHMS
+        ):
+            migration = Migration(
+                migration.version, script_digest(migration.script, algorithm), None
+            )
+        as_recorded.append(migration)
+    return head_checksum(as_recorded)
+
+
+def other_digests_query(database: str, algorithm: str) -> str:
+    """SELECT of the version and md5 of the migrations applied to database
+    whose digest was recorded with another algorithm than algorithm."""
+    recorded = (
+        "if(position(md5, ':') > 0, substring(md5, 1, position(md5, ':') - 1), "
+        f"{quote_string(MD5)})"
+    )
+    return (
+        "SELECT version, md5 FROM (SELECT version, argMax(md5, created_at) AS md5 "
+        f"FROM {quote_identifier(database)}.schema_versions GROUP BY version) "
+        f"WHERE {recorded} != {quote_string(algorithm)}"
+    )
@@ -0,0 +1,173 @@
+import logging
+from collections import Counter, namedtuple
+from operator import attrgetter
+from typing import List, Optional
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.drift import FINGERPRINT, schema_definitions
+from clickhouse_migrations.util import quote_string
+
+REPLICA_OK = "ok"
+REPLICA_LAGGING = "lagging"
+REPLICA_DIVERGED = "diverged"
+
+# One replica of a cluster as seen by verify-replicas: the number of applied
+# migrations and the highest one, a digest of its applied (version, md5)
+# pairs, the fingerprint of its schema and one of the REPLICA_* states.
+ReplicaRow = namedtuple(
+    "ReplicaRow",
+    [
+        "host",
+        "shard",
+        "last_applied",
+        "applied",
+        "versions_digest",
+        "fingerprint",
+        "state",
+    ],
+)
+
+
+def tables_query(database: str, cluster_name: str) -> str:
+    """Whether every replica of the cluster has the schema_versions table of
+    the database, which clusterAllReplicas needs from all of them."""
+    # The system tables list the replicas lacking the database too.
+    return (
+        "SELECT hostName() AS host, _shard_num AS shard, "
+        f"countIf(database = {quote_string(database)} "
+        "AND name = 'schema_versions') AS initialized "
+        f"FROM clusterAllReplicas({quote_string(cluster_name)}, system.tables) "
+        f"WHERE database IN ({quote_string(database)}, 'system') "
+        "GROUP BY host, shard ORDER BY shard, host"
+    )
+
+
+def replicas_query(database: str, cluster_name: str, versions: bool = True) -> str:
+    """One distributed query returning, per replica, the applied migrations
+    and the schema fingerprint of the database, along with the host name of
+    the server running it.
+
+    Without versions, schema_versions is not read and the applied
+    migrations are 0 for every replica.
+    """
+    cluster = quote_string(cluster_name)
+    key = "hostName() AS host, _shard_num AS shard"
+    condition = f"database = {quote_string(database)}"
+    definitions = schema_definitions(
+        condition,
+        key=key,
+        columns=f"clusterAllReplicas({cluster}, system.columns)",
+        tables=f"clusterAllReplicas({cluster}, system.tables)",
+    )
+    schema = (
+        f"SELECT host, shard, {FINGERPRINT} AS fingerprint "
+        f"FROM ({definitions}) GROUP BY host, shard"
+    )
+    if not versions:
+        return (
+            "SELECT hostName() AS initiator, host, shard, 0 AS last_applied, "
+            "0 AS applied, 0 AS versions_digest, fingerprint "
+            f"FROM ({schema}) ORDER BY shard, host"
+        )
+
+    return (
+        "SELECT hostName() AS initiator, host, shard, "
+        "v.last_applied AS last_applied, v.applied AS applied, "
+        "v.versions_digest AS versions_digest, s.fingerprint AS fingerprint "
+        "FROM ("
+        f"SELECT {key}, max(version) AS last_applied, "
+        "uniqExact(version) AS applied, "
+        "groupBitXorDistinct(cityHash64(version, md5)) AS versions_digest "
+        f"FROM clusterAllReplicas({cluster}, {quote_string(database)}, "
+        "'schema_versions') "
+        "GROUP BY host, shard"
+        f") AS v FULL JOIN ({schema}) AS s USING (host, shard) ORDER BY shard, host"
+    )
+
+
+def replica_states(
+    rows: List[ReplicaRow], reference_host: Optional[str] = None
+) -> List[ReplicaRow]:
+    """Fill in the state of every replica.
+
+    Replicas are compared with the reference_host one: migrations run through
+    that server, so its schema is the one they produced. Without it, the
+    reference is the most common history among the replicas with the most
+    applied migrations, and the most common schema among the replicas with
+    that history. A replica with fewer migrations lags; one with a different
+    history or schema diverged.
+    """
+    if not rows:
+        return []
+
+    reference = next((row for row in rows if row.host == reference_host), None)
+    if reference is not None:
+        most_applied = reference.applied
+        versions_digest = reference.versions_digest
+        fingerprint = reference.fingerprint
+    else:
+        most_applied = max(row.applied for row in rows)
+        versions_digest = Counter(
+            row.versions_digest for row in rows if row.applied == most_applied
+        ).most_common(1)[0][0]
+        fingerprint = Counter(
+            row.fingerprint for row in rows if row.versions_digest == versions_digest
+        ).most_common(1)[0][0]
+
+    def state(row: ReplicaRow) -> str:
+        if row.versions_digest == versions_digest:
+            return REPLICA_OK if row.fingerprint == fingerprint else REPLICA_DIVERGED
+        return REPLICA_LAGGING if row.applied < most_applied else REPLICA_DIVERGED
+
+    return [row._replace(state=state(row)) for row in rows]
+
+
+def query_replicas(
+    conn: Connection, database: str, cluster_name: str
+) -> List[ReplicaRow]:
+    """The state of every replica of the database.
+
+    Replicas without schema_versions diverged. When there are any, the
+    applied migrations cannot be read from the others in one query either,
+    so these are only compared by schema.
+    """
+    uninitialized = {
+        (row["host"], row["shard"])
+        for row in conn.query(tables_query(database, cluster_name))
+        if not row["initialized"]
+    }
+    if uninitialized:
+        logging.warning(
+            "Replicas without schema_versions in %s: %s; comparing the others "
+            "by schema only",
+            database,
+            ", ".join(sorted(host for host, _ in uninitialized)),
+        )
+
+    rows = conn.query(
+        replicas_query(database, cluster_name, versions=not uninitialized)
+    )
+    replicas = [
+        ReplicaRow(
+            row["host"],
+            row["shard"],
+            row["last_applied"],
+            row["applied"],
+            row["versions_digest"],
+            row["fingerprint"],
+            None,
+        )
+        for row in rows
+        if (row["host"], row["shard"]) not in uninitialized
+    ]
+    replicas = replica_states(
+        replicas, reference_host=rows[0]["initiator"] if rows else None
+    )
+    fingerprints = {(row["host"], row["shard"]): row["fingerprint"] for row in rows}
+    replicas += [
+        ReplicaRow(
+            host, shard, 0, 0, 0, fingerprints.get((host, shard), 0), REPLICA_DIVERGED
+        )
+        for host, shard in uninitialized
+    ]
+    return sorted(replicas, key=attrgetter("shard", "host"))
@@ -0,0 +1,142 @@
+from collections import Counter
+from typing import List
+
+from clickhouse_migrations.drift import DriftRow
+from clickhouse_migrations.migrator import FleetRow, StatsRow
+from clickhouse_migrations.replicas import (
+    REPLICA_DIVERGED,
+    REPLICA_LAGGING,
+    REPLICA_OK,
+    ReplicaRow,
+)
+from clickhouse_migrations.util import format_table
+
+
+def format_fleet_status(rows: List[FleetRow]) -> str:
+    if not rows:
+        return "No migrated databases found."
+
+    behind = [row for row in rows if row.pending]
+    mismatched = [row for row in rows if row.md5_mismatch or row.unknown]
+    at_head = sum(1 for row in rows if row not in behind and row not in mismatched)
+
+    by_pending = Counter(row.pending for row in behind)
+    summary = f"{len(rows)} databases: {at_head} at head, {len(behind)} behind"
+    if behind:
+        summary += (
+            " ("
+            + ", ".join(
+                f"{n} by {pending}" for pending, n in sorted(by_pending.items())
+            )
+            + ")"
+        )
+    summary += f", {len(mismatched)} with md5 mismatches"
+    sections = [summary]
+
+    if behind:
+        table = [("DATABASE", "LAST APPLIED", "PENDING")]
+        for row in behind:
+            last_applied = "" if row.last_applied is None else str(row.last_applied)
+            table.append((row.database, last_applied, str(row.pending)))
+        sections.append("Behind:\n" + format_table(table))
+
+    if mismatched:
+        table = [("DATABASE", "MD5 MISMATCH", "UNKNOWN")]
+        for row in mismatched:
+            table.append(
+                (
+                    row.database,
+                    ", ".join(map(str, row.md5_mismatch)),
+                    ", ".join(map(str, row.unknown)),
+                )
+            )
+        sections.append("Mismatched:\n" + format_table(table))
+
+    return "\n\n".join(sections)
+
+
+def format_stats(rows: List[StatsRow], limit: int = 10) -> str:
+    if not rows:
+        return "No statistics found. Run migrate with --collect-stats first."
+
+    header = (
+        "VERSION",
+        "STATEMENTS",
+        "DURATION MS",
+        "READ ROWS",
+        "READ BYTES",
+        "WRITTEN ROWS",
+        "WRITTEN BYTES",
+        "PEAK MEMORY",
+    )
+
+    sections = []
+    for title, key in (
+        ("Slowest migrations:", lambda r: r.duration_ms),
+        ("Most memory-hungry migrations:", lambda r: r.peak_memory_usage),
+    ):
+        ranked = sorted(rows, key=key, reverse=True)[:limit]
+        table = [header] + [tuple(str(value) for value in row) for row in ranked]
+        sections.append(title + "\n" + format_table(table))
+
+    return "\n\n".join(sections)
+
+
+def format_drift(rows: List[DriftRow]) -> str:
+    if not rows:
+        return "No drift found."
+
+    table = [("DATABASE", "VERSION", "RECORDED AT", "RECORDED", "CURRENT")]
+    for row in rows:
+        table.append(
+            (
+                row.database,
+                str(row.version),
+                str(row.recorded_at),
+                f"{row.recorded:016x}",
+                f"{row.current:016x}",
+            )
+        )
+    lines = [format_table(table)]
+
+    for row in rows:
+        if not row.changes:
+            continue
+        lines.append(f"\n{row.database}:")
+        for change in row.changes:
+            if change.recorded is None:
+                lines.append(f"  + {change.name}: {change.current}")
+            elif change.current is None:
+                lines.append(f"  - {change.name}: {change.recorded}")
+            else:
+                lines.append(
+                    f"  ~ {change.name}: {change.recorded} -> {change.current}"
+                )
+
+    return "\n".join(lines)
+
+
+def format_replicas(rows: List[ReplicaRow]) -> str:
+    if not rows:
+        return "No replicas found."
+
+    states = Counter(row.state for row in rows)
+    summary = f"{len(rows)} replicas: " + ", ".join(
+        f"{states[state]} {state}"
+        for state in (REPLICA_OK, REPLICA_LAGGING, REPLICA_DIVERGED)
+    )
+
+    table = [("SHARD", "HOST", "LAST APPLIED", "APPLIED", "FINGERPRINT", "STATE")]
+    for row in rows:
+        table.append(
+            (
+                str(row.shard),
+                row.host,
+                "" if row.applied == 0 else str(row.last_applied),
+                str(row.applied),
+                f"{row.fingerprint:016x}",
+                row.state,
+            )
+        )
+
+    return summary + "\n\n" + format_table(table)
@@ -0,0 +1,90 @@
+import re
+from collections import namedtuple
+from typing import Dict, List, Set
+
+from clickhouse_migrations.connection import Connection
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.util import quote_string
+
+# One table, view or dictionary of a database. depends_on holds the names of
+# the objects of the same database that must exist before it is created.
+SchemaObject = namedtuple(
+    "SchemaObject", ["name", "engine", "create_query", "depends_on"]
+)
+
+# Bookkeeping tables of this tool and the implicit inner tables of
+# materialized views are not part of a schema.
+_SKIPPED_PREFIXES = ("schema_versions", ".inner.", ".inner_id.")
+
+
+def _references(create_query: str, database: str) -> Set[str]:
+    """Names of the objects a create query refers to as database.name."""
+    escaped = re.escape(database)
+    pattern = re.compile(
+        rf"""(?<![\w.`"])(?:`{escaped}`|"{escaped}"|{escaped})\.(`(?:``|[^`])*`|"[^"]*"|\w+)"""
+    )
+    return {
+        match.group(1).strip('`"').replace("``", "`")
+        for match in pattern.finditer(create_query)
+    }
+
+
+def schema_objects(conn: Connection, database: str) -> List[SchemaObject]:
+    """Read the tables, views and dictionaries of a database from
+    system.tables, with the dependencies between them."""
+    rows = [
+        row
+        for row in conn.query(
+            "SELECT name, engine, create_table_query, dependencies_table, "
+            "loading_dependencies_table "
+            f"FROM system.tables WHERE database = {quote_string(database)} "
+            "AND NOT is_temporary ORDER BY name"
+        )
+        if not row["name"].startswith(_SKIPPED_PREFIXES)
+    ]
+    names = {row["name"] for row in rows}
+
+    depends_on: Dict[str, Set[str]] = {
+        row["name"]: (
+            _references(row["create_table_query"], database)
+            | set(row["loading_dependencies_table"])
+        )
+        for row in rows
+    }
+    # dependencies_table lists the materialized views reading from a table.
+    for row in rows:
+        for dependent in row["dependencies_table"]:
+            if dependent in depends_on:
+                depends_on[dependent].add(row["name"])
+
+    return [
+        SchemaObject(
+            row["name"],
+            row["engine"],
+            row["create_table_query"],
+            frozenset((depends_on[row["name"]] & names) - {row["name"]}),
+        )
+        for row in rows
+    ]
+
+
+def dependency_layers(objects: List[SchemaObject]) -> List[List[SchemaObject]]:
+    """Group objects into layers: every object depends only on objects of the
+    layers before it, so the objects of one layer can be created in any order
+    (or in parallel)."""
+    remaining = {obj.name: obj for obj in objects}
+    created: Set[str] = set()
+    layers: List[List[SchemaObject]] = []
+
+    while remaining:
+        layer = [obj for obj in remaining.values() if obj.depends_on <= created]
+        if not layer:
+            raise MigrationException(
+                "Circular dependency between: " + ", ".join(sorted(remaining))
+            )
+        for obj in layer:
+            del remaining[obj.name]
+            created.add(obj.name)
+        layers.append(layer)
+
+    return layers
@@ -0,0 +1,67 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Deque, Iterator, List, Optional, Sequence, Tuple
+
+from clickhouse_migrations.migration import BundledMigration, Migration
+
+Spans = List[Tuple[int, int]]
+
+# Smaller scripts are split faster than they are sent to a worker.
+POOL_MIN_SCRIPT_SIZE = 64 * 1024
+
+
+def statements_ahead(
+    migrations: Sequence[Migration],
+    spans: Callable[[str], Spans],
+    statements: Callable[[Migration], List[str]],
+    workers: int,
+) -> Iterator[List[str]]:
+    """The statements of each of migrations, in order, split by a pool of
+    worker processes while the previous ones execute.
+
+    Workers call spans(script) and only send back the (start, end) of the
+    statements, which are cut from the script here. Bundled migrations, whose
+    statements are already split, and small scripts go to statements()
+    instead. At most 2 * workers scripts are held ahead. The pool is shut
+    down, and the scripts not split yet are dropped, when the iteration ends,
+    fails or is closed.
+    """
+    # Spawned rather than forked: the parent holds driver threads and sockets.
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        ahead: Deque[Tuple[Migration, Optional[str], Optional[Future]]] = deque()
+        try:
+            for migration in migrations:
+                if len(ahead) == 2 * workers:
+                    yield _statements(ahead.popleft(), statements)
+                ahead.append(_submit(executor, migration, spans))
+            while ahead:
+                yield _statements(ahead.popleft(), statements)
+        finally:
+            for _, _, future in ahead:
+                if future is not None:
+                    future.cancel()
+
+
+def _submit(
+    executor: ProcessPoolExecutor, migration: Migration, spans: Callable[[str], Spans]
+) -> Tuple[Migration, Optional[str], Optional[Future]]:
+    if isinstance(migration, BundledMigration):
+        return migration, None, None
+    # Read once: kept to cut the statements from.
+    script = migration.script
+    if len(script) < POOL_MIN_SCRIPT_SIZE:
+        return migration, None, None
+    return migration, script, executor.submit(spans, script)
+
+
+def _statements(
+    job: Tuple[Migration, Optional[str], Optional[Future]],
+    statements: Callable[[Migration], List[str]],
+) -> List[str]:
+    migration, script, future = job
+    if future is None:
+        return statements(migration)
+    return [script[start:end] + ";" for start, end in future.result()]
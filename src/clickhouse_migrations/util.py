@@ -1,3 +1,10 @@
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import List, Sequence, Union
+
+
 def quote_identifier(identifier: str) -> str:
     """Quote a ClickHouse identifier (database, cluster name, ...) safely.
 
@@ -14,3 +21,55 @@ def quote_string(value: str) -> str:
     of the surrounding quotes.
     """
     return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def rewrite_database(statement: str, old: str, new: str) -> str:
+    """Point the references to database old in a DDL statement to database new.
+
+    Rewrites qualified identifiers (old.t, `old`.t, "old".t), names qualified
+    inside a string literal ('old.dict' of dictGet) and the 'old' literal
+    itself (the DB of a dictionary source), as they appear in
+    system.tables.create_table_query.
+    """
+    escaped = re.escape(old)
+    qualified = re.compile(
+        rf"""(?<![\w.`"'])(?:`{escaped}`|"{escaped}"|{escaped})\.(?=[\w`"])"""
+    )
+    statement = qualified.sub(lambda _: quote_identifier(new) + ".", statement)
+    statement = re.sub(rf"(?<=')({escaped})\.(?=\w)", lambda _: new + ".", statement)
+    return statement.replace(quote_string(old), quote_string(new))
+
+
+def format_table(table: List[Sequence[str]]) -> str:
+    """Render rows of cells (the first row being the header) as aligned text."""
+    widths = [max(len(row[i]) for row in table) for i in range(len(table[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(widths[i]) for i, cell in enumerate(row)) for row in table
+    )
+
+
+def atomic_write_text(path: Union[Path, str], text: str) -> None:
+    """Write a text file atomically (see atomic_write_bytes)."""
+    atomic_write_bytes(path, text.encode("utf8"))
+
+
+def atomic_write_bytes(path: Union[Path, str], data: bytes) -> None:
+    """Write a file atomically.
+
+    The content goes to a temporary file in the same directory which then
+    replaces the target, so a concurrent reader (e.g. node_exporter's textfile
+    collector) never sees a partially written file.
+    """
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        # mkstemp creates the file as 0600; keep it readable by collectors.
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,197 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import threading
+import time
+from contextlib import ExitStack
+from operator import attrgetter
+from pathlib import Path
+from typing import List, Optional, Union
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.defaults import WATCH_POLL_INTERVAL
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.migration import (
+    Migration,
+    MigrationDigests,
+    MigrationIndex,
+    MigrationStorage,
+)
+from clickhouse_migrations.migrator import Migrator
+
+# Seconds between two scans of the migrations directory when inotify is not
+# available, and the longest a watcher waits before noticing a stop request.
+POLL_INTERVAL = WATCH_POLL_INTERVAL
+
+# Seconds to wait for more changes after the first one, so that an editor
+# saving a file in several steps triggers a single run.
+_SETTLE_INTERVAL = 0.1
+
+# inotify(7) events meaning a file of the directory was written, created,
+# renamed or deleted.
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_EVENTS = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+
+class _DirectoryEvents:
+    """Wait for changes in a directory through Linux inotify, called via
+    libc so that watching needs no extra dependency."""
+
+    def __init__(self, path: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), _IN_EVENTS) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+
+    def wait(self, timeout: float) -> bool:
+        """Block until the directory changes (True) or timeout (False)."""
+        if not self._drain(timeout):
+            return False
+        while self._drain(_SETTLE_INTERVAL):
+            pass
+        return True
+
+    def _drain(self, timeout: float) -> bool:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self._fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def _directory_events(path: Path) -> Optional[_DirectoryEvents]:
+    try:
+        return _DirectoryEvents(path)
+    except (AttributeError, OSError, TypeError) as exc:
+        # No inotify (not Linux, or out of watches): poll the directory.
+        logging.info("Watching %s by polling: %s", path, exc)
+        return None
+
+
+class Watcher:  # pylint: disable=too-many-instance-attributes
+    """Apply new migrations as they appear in a directory, for development
+    loops.
+
+    Unlike a migrate run per change, a watcher keeps its connection, an index
+    of the migration files (see MigrationIndex) and the applied migrations
+    between runs: a change costs reading the changed files and running the
+    new migrations, nothing else. A failed run is logged and the applied
+    migrations are queried again on the next change.
+    """
+
+    def __init__(
+        self,
+        cluster: ClickhouseCluster,
+        db_name: Optional[str],
+        migration_path: Union[Path, str],
+        cluster_name: Optional[str] = None,
+        multi_statement: bool = True,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self._cluster = cluster
+        self._db_name = db_name if db_name is not None else cluster.default_db_name
+        self._storage = MigrationStorage(migration_path, cluster.hash_algorithm)
+        self._index = MigrationIndex(self._storage)
+        self._cluster_name = cluster_name
+        self._multi_statement = multi_statement
+        self._poll_interval = poll_interval
+        self._stack = ExitStack()
+        self._migrator: Optional[Migrator] = None
+        self._applied: Optional[MigrationDigests] = None
+        self._pending = True
+
+    def __enter__(self) -> "Watcher":
+        self._cluster.create_db(self._db_name, self._cluster_name)
+        conn = self._stack.enter_context(self._cluster.connection(self._db_name))
+        self._migrator = Migrator(conn, hooks=self._cluster.hooks)
+        self._migrator.init_schema(self._cluster_name)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stack.close()
+
+    def apply_changes(self) -> List[Migration]:
+        """Apply the migrations added since the last call; raises like
+        migrate when a run fails."""
+        # A failed run is retried once the files change, not on every scan.
+        if not self._index.refresh() and not self._pending:
+            return []
+        self._pending = False
+
+        incoming = self._index.migrations()
+        if self._applied is None:
+            # Only versions and md5s are compared: scripts are not kept.
+            self._applied = MigrationDigests(self._migrator.query_applied_migrations())
+        try:
+            migrations = self._migrator.apply_migration(
+                incoming, self._multi_statement, applied=self._applied
+            )
+        except Exception:
+            self._applied = None
+            raise
+
+        self._applied = MigrationDigests(
+            sorted([*self._applied, *migrations], key=attrgetter("version"))
+        )
+        return migrations
+
+    def watch(self, stop: Optional[threading.Event] = None) -> None:
+        """Apply changes until stop is set (or forever)."""
+        stop = stop or threading.Event()
+        events = _directory_events(self._storage.storage_dir)
+        try:
+            while not stop.is_set():
+                self._apply_logged(settle=events is None)
+                self._wait_for_change(events, stop)
+        finally:
+            if events is not None:
+                events.close()
+
+    def _settle(self) -> None:
+        # A scan may find a file half written: only apply the changes once a
+        # scan finds the directory as the previous one left it.
+        while self._index.refresh():
+            self._pending = True
+            time.sleep(_SETTLE_INTERVAL)
+
+    def _apply_logged(self, settle: bool) -> None:
+        try:
+            if settle:
+                self._settle()
+            migrations = self.apply_changes()
+        except MigrationException as exc:
+            logging.error("Migrations not applied: %s", exc)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logging.exception("Migrations failed, waiting for the next change")
+        else:
+            if migrations:
+                logging.info(
+                    "Applied migrations %s",
+                    ", ".join(str(m.version) for m in migrations),
+                )
+
+    def _wait_for_change(
+        self, events: Optional[_DirectoryEvents], stop: threading.Event
+    ) -> None:
+        if events is None:
+            stop.wait(self._poll_interval)
+        else:
+            # Wake up every poll_interval anyway to notice stop requests.
+            events.wait(self._poll_interval)
@@ -1,4 +1,10 @@
 import os
+import uuid
+from typing import Dict, List, Optional
+
+import pytest
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
 
 
 def pytest_collection_modifyitems(items):
@@ -7,3 +13,61 @@ def pytest_collection_modifyitems(items):
     for item in items:
         if integration_marker in str(item.fspath):
             item.add_marker("integration")
+
+
+class RecordingConnection:
+    """Connection stub with an empty schema_versions table, recording every
+    command with the query_id and settings it was tagged with. The command
+    equal to fail_on raises."""
+
+    def __init__(self, fail_on: Optional[str] = None):
+        self.fail_on = fail_on
+        self.commands: List[tuple] = []
+
+    def command(
+        self,
+        statement: str,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict] = None,
+    ) -> None:
+        if statement == self.fail_on:
+            raise RuntimeError("boom")
+        self.commands.append((statement, query_id, settings))
+
+    def query(self, statement: str, settings: Optional[Dict] = None) -> List[Dict]:
+        # pylint: disable=unused-argument
+        if "currentDatabase()" in statement:
+            return [{"db": "mydb"}]
+        return []
+
+    def insert(self, table: str, rows: List[Dict]) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+@pytest.fixture(name="recording_conn")
+def fixture_recording_conn():
+    return RecordingConnection()
+
+
+@pytest.fixture(name="cluster")
+def fixture_cluster():
+    """A chDB cluster, for the modules that skip without chdb."""
+    return ClickhouseCluster(driver="chdb")
+
+
+@pytest.fixture(name="db_name")
+def fixture_db_name():
+    # chDB keeps in-memory state per process, so keep databases apart.
+    return f"chdb_{uuid.uuid4().hex}"
+
+
+@pytest.fixture(name="prefix")
+def fixture_prefix():
+    # chDB keeps in-memory state per process, so keep every test's tenants apart.
+    return f"tenants_{uuid.uuid4().hex[:12]}_"
@@ -1,6 +1,7 @@
 from pathlib import Path
 
 from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.replicas import REPLICA_DIVERGED, REPLICA_OK
 
 TESTS_DIR = Path(__file__).parents[1]
 
@@ -56,3 +57,37 @@ def test_migration_with_replicated_schema(_schema):
                 )[0]
             )
         assert len(result_set) == len(CLICKHOUSE_SERVERS) and len(set(result_set)) == 1
+
+
+def test_verify_replicas(_schema):
+    cluster = ClickhouseCluster(db_host="localhost", db_user="default", db_password="")
+    cluster.migrate("pytest", TESTS_DIR / "migrations", "company_cluster")
+
+    rows = cluster.verify_replicas("pytest", "company_cluster")
+
+    assert len(rows) == len(CLICKHOUSE_SERVERS)
+    assert {row.applied for row in rows} == {1}
+    # The migration has no ON CLUSTER, so only the connected server has the
+    # table; every other replica diverged from it.
+    assert sorted(row.state for row in rows) == [
+        REPLICA_DIVERGED,
+        REPLICA_DIVERGED,
+        REPLICA_DIVERGED,
+        REPLICA_OK,
+    ]
+
+
+def test_verify_replicas_without_schema_versions(_schema):
+    cluster = ClickhouseCluster(db_host="localhost", db_user="default", db_password="")
+    # Without a cluster name, schema_versions only exists on the connected server.
+    cluster.migrate("pytest", TESTS_DIR / "migrations")
+
+    rows = cluster.verify_replicas("pytest", "company_cluster")
+
+    assert len(rows) == len(CLICKHOUSE_SERVERS)
+    assert sorted(row.state for row in rows) == [
+        REPLICA_DIVERGED,
+        REPLICA_DIVERGED,
+        REPLICA_DIVERGED,
+        REPLICA_OK,
+    ]
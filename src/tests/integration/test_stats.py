@@ -0,0 +1,20 @@
+from pathlib import Path
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+
+TESTS_DIR = Path(__file__).parents[1]
+
+
+def test_stats_empty_without_collect_stats(cluster: ClickhouseCluster):
+    cluster.migrate("pytest", TESTS_DIR / "complex_migrations")
+
+    assert not cluster.stats("pytest")
+
+
+def test_collect_stats_records_every_statement(cluster: ClickhouseCluster):
+    cluster.migrate("pytest", TESTS_DIR / "complex_migrations", collect_stats=True)
+
+    rows = cluster.stats("pytest")
+
+    assert [r.version for r in rows] == [1, 2, 3, 10]
+    assert [r.statements for r in rows] == [1, 2, 3, 1]
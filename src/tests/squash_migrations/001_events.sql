@@ -0,0 +1,2 @@
+CREATE TABLE events (id UInt64, kind String, payload String) ENGINE = MergeTree ORDER BY id;
+CREATE TABLE scratch (id UInt64) ENGINE = Memory;
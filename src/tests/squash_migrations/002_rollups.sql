@@ -0,0 +1,3 @@
+CREATE TABLE events_by_kind (kind String, n UInt64) ENGINE = SummingMergeTree ORDER BY kind;
+CREATE MATERIALIZED VIEW events_by_kind_mv TO events_by_kind AS
+SELECT kind, count() AS n FROM events GROUP BY kind;
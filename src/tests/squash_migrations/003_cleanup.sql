@@ -0,0 +1,4 @@
+DROP TABLE scratch;
+ALTER TABLE events DROP COLUMN payload;
+CREATE VIEW recent_events AS SELECT * FROM events WHERE id > 100;
+CREATE VIEW recent_kinds AS SELECT DISTINCT kind FROM recent_events;
@@ -0,0 +1 @@
+CREATE TABLE kinds (kind String, title String) ENGINE = MergeTree ORDER BY kind;
@@ -0,0 +1,196 @@
+import re
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qsl, urlparse
+
+# One HTTP request received by the stub: the SQL text, the remaining URL
+# parameters (database, query_id, settings) and whether it was answered with
+# an injected failure.
+StubRequest = namedtuple("StubRequest", ["query", "params", "failed"])
+
+# A failure rule: requests whose SQL matches pattern get a ClickHouse-style
+# error; times is how many more requests to fail (None: all of them).
+_Failure = namedtuple("_Failure", ["pattern", "code", "message", "times"])
+
+_INSERT_RE = re.compile(rb"^\s*(INSERT\s+INTO\s+.+?\s+FORMAT\s+Native)\s", re.I | re.S)
+_FORMAT_RE = re.compile(r"\bFORMAT\s+(\w+)\s*$", re.I)
+
+
+class ClickhouseStub:
+    """Stand-in for the ClickHouse HTTP interface, enough for clickhouse-connect.
+
+    Queries are executed by an in-process chDB engine, so results are real,
+    while every request is recorded and may be delayed (latency, in seconds)
+    or answered with an injected error (fail()). Use it as a context manager
+    and point a clickhouse-connect client at host/port.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        from chdb import session  # pylint: disable=import-outside-toplevel
+
+        self.latency = latency
+        self.requests: List[StubRequest] = []
+        self._session = session.Session()
+        self._session.query("SET output_format_json_quote_64bit_integers = 0")
+        self._failures: List[_Failure] = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="clickhouse-stub", daemon=True
+        )
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    @property
+    def round_trips(self) -> int:
+        return len(self.requests)
+
+    def queries(self) -> List[str]:
+        return [request.query for request in self.requests]
+
+    def reset(self) -> None:
+        with self._lock:
+            self.requests.clear()
+
+    def fail(
+        self,
+        pattern: str,
+        code: int = 1000,
+        message: str = "Injected failure",
+        times: Optional[int] = None,
+    ) -> None:
+        """Answer requests whose SQL matches the pattern with an error."""
+        with self._lock:
+            self._failures.append(
+                _Failure(re.compile(pattern, re.I), code, message, times)
+            )
+
+    def __enter__(self) -> "ClickhouseStub":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _injected_failure(self, query: str) -> Optional[_Failure]:
+        for n, failure in enumerate(self._failures):
+            if failure.pattern.search(query):
+                if failure.times is not None:
+                    if failure.times <= 1:
+                        del self._failures[n]
+                    else:
+                        self._failures[n] = failure._replace(times=failure.times - 1)
+                return failure
+        return None
+
+    def handle(self, query: str, params: dict, data: bytes):
+        """Return (status, payload, headers) for one request."""
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            failure = self._injected_failure(query)
+            self.requests.append(StubRequest(query, params, failure is not None))
+            if failure is not None:
+                return (
+                    500,
+                    f"Code: {failure.code}. DB::Exception: {failure.message}".encode(),
+                    {"X-ClickHouse-Exception-Code": str(failure.code)},
+                )
+
+            try:
+                return 200, self._execute(query, params, data), {}
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                code = re.match(r"Code: (\d+)", str(exc))
+                return (
+                    500,
+                    str(exc).encode(),
+                    {"X-ClickHouse-Exception-Code": code.group(1) if code else "0"},
+                )
+
+    def _execute(self, query: str, params: dict, data: bytes) -> bytes:
+        self._session.query(f"USE `{params.get('database') or 'default'}`")
+
+        if data:
+            # chDB takes SQL text only, so inserted Native blocks go through
+            # a temporary file.
+            columns = query[: query.upper().rindex("FORMAT")]
+            with tempfile.NamedTemporaryFile(suffix=".native") as block:
+                block.write(data)
+                block.flush()
+                self._session.query(
+                    f"{columns} SELECT * FROM file('{block.name}', Native)"
+                )
+            return b""
+
+        # A FORMAT clause in the query wins; commands default to TabSeparated
+        # like the real HTTP interface.
+        fmt = _FORMAT_RE.search(query)
+        result = self._session.query(query, fmt.group(1) if fmt else "TabSeparated")
+        return result.bytes()
+
+
+def _handler(stub: ClickhouseStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def _body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    return b"".join(chunks)
+
+        def _serve(self):
+            url = urlparse(self.path)
+            params = dict(parse_qsl(url.query))
+            body = self._body()
+            insert = _INSERT_RE.match(body)
+
+            if url.path == "/ping":
+                status, payload, headers = 200, b"Ok.\n", {}
+            elif "query" in params:
+                # SQL in the URL, insert data (if any) in the body.
+                status, payload, headers = stub.handle(
+                    params.pop("query"), params, body
+                )
+            elif insert:
+                # Streamed inserts put the SQL in front of the data.
+                status, payload, headers = stub.handle(
+                    insert.group(1).decode(), params, body[insert.end() :]
+                )
+            else:
+                status, payload, headers = stub.handle(body.decode(), params, b"")
+
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = _serve
+        do_POST = _serve
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    return Handler
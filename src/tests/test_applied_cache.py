@@ -0,0 +1,165 @@
+import logging
+import shutil
+import uuid
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.command_line import get_context
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hashing import BLAKE2B
+from clickhouse_migrations.migrator import STATUS_APPLIED, STATUS_PENDING, Migrator
+
+pytest.importorskip("chdb")
+
+TESTS_DIR = Path(__file__).parent
+
+
+@pytest.fixture(name="cluster")
+def fixture_cluster(tmp_path):
+    return ClickhouseCluster(driver="chdb", applied_cache=tmp_path / "cache")
+
+
+@pytest.fixture(name="fetches")
+def fixture_fetches(monkeypatch):
+    fetches = []
+    query_applied_meta = Migrator.query_applied_meta
+
+    def counted(migrator):
+        fetches.append(migrator)
+        return query_applied_meta(migrator)
+
+    monkeypatch.setattr(Migrator, "query_applied_meta", counted)
+    return fetches
+
+
+@pytest.fixture(name="migrations_dir")
+def fixture_migrations_dir(tmp_path):
+    return Path(shutil.copytree(TESTS_DIR / "down_migrations", tmp_path / "migrations"))
+
+
+def test_unchanged_applied_migrations_are_fetched_once(
+    cluster, db_name, migrations_dir, fetches
+):
+    cluster.migrate(db_name, migrations_dir)
+    fetches.clear()
+
+    for _ in range(3):
+        assert not cluster.migrate(db_name, migrations_dir)
+        rows = cluster.status(db_name, migrations_dir)
+        assert {row.state for row in rows} == {STATUS_APPLIED}
+
+    assert len(fetches) == 1
+
+
+def test_changes_are_noticed(cluster, db_name, migrations_dir, fetches):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.status(db_name, migrations_dir)
+
+    cluster.rollback(db_name, migrations_dir)
+    rows = cluster.status(db_name, migrations_dir)
+    assert [row.state for row in rows] == [STATUS_APPLIED, STATUS_PENDING]
+
+    # Fetched before and after migrating, then after the rollback: the last
+    # migrate reuses what the last status fetched.
+    (migrations_dir / "003_more.sql").write_text("SELECT 3;", encoding="utf8")
+    assert [m.version for m in cluster.migrate(db_name, migrations_dir)] == [2, 3]
+    assert len(fetches) == 3
+
+
+def test_cached_md5s_are_verified(cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.migrate(db_name, migrations_dir)
+
+    with open(migrations_dir / "001_create.sql", "a", encoding="utf8") as script:
+        script.write("\n-- edited after being applied\n")
+
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        cluster.migrate(db_name, migrations_dir)
+
+
+def test_digests_changed_in_place_are_noticed(cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.status(db_name, migrations_dir)
+
+    # Same count, versions and created_at: only the digests changed.
+    with cluster.connection(db_name) as conn:
+        conn.command(
+            "ALTER TABLE schema_versions UPDATE md5 = 'edited' WHERE version = 1 "
+            "SETTINGS mutations_sync = 2"
+        )
+
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        cluster.migrate(db_name, migrations_dir)
+
+
+def test_edited_head_applied_again_is_verified(cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.status(db_name, migrations_dir)
+
+    # Another runner, within the same second: the head is rolled back, edited
+    # and applied again.
+    applied_cache, cluster.applied_cache = cluster.applied_cache, None
+    cluster.rollback(db_name, migrations_dir)
+    with open(migrations_dir / "002_create.sql", "a", encoding="utf8") as script:
+        script.write("\n-- edited\n")
+    cluster.migrate(db_name, migrations_dir)
+    cluster.applied_cache = applied_cache
+
+    rows = cluster.status(db_name, migrations_dir)
+    assert {row.state for row in rows} == {STATUS_APPLIED}
+
+
+def test_rehash_drops_the_entry(cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.status(db_name, migrations_dir)
+    cluster.hash_algorithm = BLAKE2B
+
+    assert cluster.rehash(db_name, migrations_dir, dryrun=True) == [1, 2]
+    assert list(cluster.applied_cache.directory.iterdir())
+    assert cluster.rehash(db_name, migrations_dir) == [1, 2]
+    assert not list(cluster.applied_cache.directory.iterdir())
+
+
+def test_unreadable_entries_are_fetched_again(
+    cluster, db_name, migrations_dir, fetches
+):
+    cluster.migrate(db_name, migrations_dir)
+    for entry in cluster.applied_cache.directory.iterdir():
+        entry.write_text("{not json", encoding="utf8")
+    fetches.clear()
+
+    assert not cluster.migrate(db_name, migrations_dir)
+    assert not cluster.migrate(db_name, migrations_dir)
+    assert len(fetches) == 1
+
+
+def test_unwritable_cache_is_skipped(db_name, migrations_dir, tmp_path, caplog):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("", encoding="utf8")
+    cluster = ClickhouseCluster(driver="chdb", applied_cache=blocker / "cache")
+
+    with caplog.at_level(logging.WARNING):
+        assert [m.version for m in cluster.migrate(db_name, migrations_dir)] == [1, 2]
+
+    assert "Cannot write the applied migrations cache" in caplog.text
+
+
+def test_databases_have_their_own_entries(cluster, migrations_dir, fetches):
+    names = [f"cache_{uuid.uuid4().hex}" for _ in range(2)]
+    for db_name in names:
+        cluster.migrate(db_name, migrations_dir)
+        cluster.migrate(db_name, migrations_dir)
+
+    assert len(list(cluster.applied_cache.directory.iterdir())) == 2
+    fetches.clear()
+    for db_name in names:
+        assert not cluster.migrate(db_name, migrations_dir)
+    assert not fetches
+
+
+def test_applied_cache_option(tmp_path):
+    assert get_context([]).applied_cache is None
+    context = get_context(["status", "--applied-cache", str(tmp_path)])
+    assert context.applied_cache == tmp_path
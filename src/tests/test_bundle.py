@@ -0,0 +1,250 @@
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.bundle import (
+    BUNDLE_MAGIC,
+    MigrationBundle,
+    open_migrations,
+    write_bundle,
+)
+from clickhouse_migrations.command_line import main
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.migration import MigrationStorage
+from clickhouse_migrations.migrator import STATUS_APPLIED, STATUS_PENDING, Migrator
+
+pytest.importorskip("chdb")
+
+TESTS_DIR = Path(__file__).parent
+
+
+def _contents(migrations):
+    return [(m.version, m.md5, m.script) for m in migrations]
+
+
+@pytest.mark.parametrize(
+    "migrations_dir", ["complex_migrations", "down_migrations", "squash_migrations"]
+)
+def test_bundle_has_the_migrations_of_the_directory(tmp_path, migrations_dir):
+    storage = MigrationStorage(TESTS_DIR / migrations_dir)
+
+    bundle = MigrationBundle(write_bundle(storage.storage_dir, tmp_path / "m.bundle"))
+
+    assert _contents(bundle.migrations()) == _contents(storage.migrations())
+    assert bundle.down_scripts() == storage.down_scripts()
+    assert bundle.baseline() is None
+    for migration in bundle.migrations():
+        assert migration.statements() == Migrator.script_to_statements(
+            migration.script, True
+        )
+
+
+def test_statements_of_non_ascii_scripts(tmp_path):
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    (migrations_dir / "001_comments.sql").write_text(
+        "-- Überblick;\nSELECT 'naïve; café';\n  SELECT '日本';  ", encoding="utf8"
+    )
+
+    (migration,) = MigrationBundle(write_bundle(migrations_dir)).migrations()
+
+    assert migration.statements() == [
+        "-- Überblick;\nSELECT 'naïve; café';",
+        "SELECT '日本';",
+    ]
+    assert (tmp_path / "migrations.bundle").is_file()
+
+
+def test_statements_of_long_non_ascii_scripts(tmp_path):
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    script = "".join(f"SELECT 'é{n}', '日本';\n-- ü{n}\n" for n in range(1000))
+    (migrations_dir / "001_seed.sql").write_text(script, encoding="utf8")
+
+    (migration,) = MigrationBundle(write_bundle(migrations_dir)).migrations()
+
+    assert migration.statements() == Migrator.script_to_statements(script, True)
+
+
+def test_bundle_selects_explicit_migrations(tmp_path):
+    path = write_bundle(TESTS_DIR / "complex_migrations", tmp_path / "m.bundle")
+
+    migrations = MigrationBundle(path).migrations(["001_init", "003", "10"])
+
+    assert [m.version for m in migrations] == [1, 3, 10]
+
+
+def test_bundle_keeps_the_baseline(cluster, tmp_path):
+    migrations_dir = Path(
+        shutil.copytree(TESTS_DIR / "squash_migrations", tmp_path / "migrations")
+    )
+    cluster.squash(migrations_dir, up_to=3)
+
+    bundle = MigrationBundle(write_bundle(migrations_dir, tmp_path / "m.bundle"))
+
+    assert bundle.baseline() == MigrationStorage(migrations_dir).baseline()
+
+
+def test_failed_write_keeps_the_previous_bundle(monkeypatch, tmp_path):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+    previous = path.read_bytes()
+
+    def interrupted(_src, _dst):
+        raise OSError("interrupted")
+
+    monkeypatch.setattr(os, "replace", interrupted)
+    with pytest.raises(OSError, match="interrupted"):
+        write_bundle(TESTS_DIR / "complex_migrations", path)
+
+    assert path.read_bytes() == previous
+    assert [p.name for p in tmp_path.iterdir()] == ["m.bundle"]
+
+
+def test_not_a_bundle(tmp_path):
+    empty = tmp_path / "empty.bundle"
+    empty.write_bytes(b"")
+    other = tmp_path / "other.bundle"
+    other.write_text("SELECT 1;", encoding="utf8")
+
+    with pytest.raises(MigrationException, match="Cannot open migration bundle"):
+        MigrationBundle(empty)
+    with pytest.raises(MigrationException, match="Not a migration bundle"):
+        MigrationBundle(other)
+
+
+def _rewrite_header(path, edit):
+    data = path.read_bytes()
+    start = len(BUNDLE_MAGIC) + 8
+    length = int.from_bytes(data[len(BUNDLE_MAGIC) : start], "little")
+    header = json.loads(data[start : start + length])
+    edit(header)
+    header_data = json.dumps(header).encode("utf8")
+    path.write_bytes(
+        BUNDLE_MAGIC
+        + len(header_data).to_bytes(8, "little")
+        + header_data
+        + data[start + length :]
+    )
+
+
+def _set_length(header):
+    header["migrations"][-1]["length"] += 10**6
+
+
+def _set_statements(header):
+    header["migrations"][0]["statements"] = [[0, 10**6]]
+
+
+def _drop_md5(header):
+    del header["migrations"][0]["md5"]
+
+
+def _drop_down(header):
+    del header["down"]
+
+
+@pytest.mark.parametrize("edit", [_set_length, _set_statements, _drop_md5, _drop_down])
+def test_corrupt_header(tmp_path, edit):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+    _rewrite_header(path, edit)
+
+    with pytest.raises(MigrationException, match="Not a valid migration bundle"):
+        MigrationBundle(path)
+
+
+@pytest.mark.parametrize("size", [20, 100, -1])
+def test_truncated_bundle(tmp_path, size):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+    path.write_bytes(path.read_bytes()[:size])
+
+    with pytest.raises(MigrationException, match="Not a valid migration bundle"):
+        MigrationBundle(path)
+
+
+def test_open_migrations(tmp_path):
+    path = write_bundle(TESTS_DIR / "complex_migrations", tmp_path / "m.bundle")
+
+    assert isinstance(open_migrations(path), MigrationBundle)
+    assert isinstance(
+        open_migrations(TESTS_DIR / "complex_migrations"), MigrationStorage
+    )
+
+
+def test_status_never_reads_scripts(cluster, db_name, tmp_path):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+    data = path.read_bytes()
+    for migration in MigrationStorage(TESTS_DIR / "down_migrations").migrations():
+        script = migration.script.encode("utf8")
+        data = data.replace(script, b"\xff" * len(script))
+    path.write_bytes(data)
+
+    rows = cluster.status(db_name, path)
+
+    assert [row.state for row in rows] == [STATUS_PENDING, STATUS_PENDING]
+
+
+def test_migrate_status_and_rollback_from_a_bundle(cluster, db_name, tmp_path):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+
+    assert [m.version for m in cluster.migrate(db_name, path)] == [1, 2]
+    rows = cluster.status(db_name, path)
+    assert {row.state for row in rows} == {STATUS_APPLIED}
+
+    assert cluster.rollback(db_name, path, steps=2) == [2, 1]
+    assert [row.state for row in cluster.status(db_name, path)] == [
+        STATUS_PENDING,
+        STATUS_PENDING,
+    ]
+
+
+def test_closed_bundle(tmp_path):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+
+    with MigrationBundle(path) as bundle:
+        migrations = bundle.migrations()
+        assert migrations[0].script
+
+    with pytest.raises(ValueError):
+        assert migrations[0].script
+
+
+def test_cluster_closes_bundles(monkeypatch, cluster, db_name, tmp_path):
+    path = write_bundle(TESTS_DIR / "down_migrations", tmp_path / "m.bundle")
+    closed = []
+    close = MigrationBundle.close
+
+    def counted(bundle):
+        closed.append(bundle.path)
+        close(bundle)
+
+    monkeypatch.setattr(MigrationBundle, "close", counted)
+
+    cluster.migrate(db_name, path)
+    cluster.status(db_name, path)
+    cluster.rollback(db_name, path)
+
+    assert closed == [path, path, path]
+
+
+def test_bundle_cli(monkeypatch, tmp_path, capsys):
+    output = tmp_path / "m.bundle"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "clickhouse-migrations",
+            "bundle",
+            "--migrations-dir",
+            str(TESTS_DIR / "complex_migrations"),
+            "--output",
+            str(output),
+        ],
+    )
+
+    assert main() == 0
+    assert capsys.readouterr().out == f"Bundle written to {output}\n"
+    assert len(MigrationBundle(output).migrations()) == 4
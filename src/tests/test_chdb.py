@@ -0,0 +1,181 @@
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.command_line import (
+    create_cluster,
+    get_context,
+    migrate,
+)
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.migration import Migration, MigrationStorage
+from clickhouse_migrations.migrator import STATUS_APPLIED, STATUS_PENDING, Migrator
+
+pytest.importorskip("chdb")
+
+TESTS_DIR = Path(__file__).parent
+
+
+def test_migrate_and_status(cluster, db_name):
+    migrations_dir = TESTS_DIR / "complex_migrations"
+
+    pending = cluster.status(db_name, migrations_dir)
+    assert {row.state for row in pending} == {STATUS_PENDING}
+
+    applied = cluster.migrate(db_name, migrations_dir)
+    assert [m.version for m in applied] == [1, 2, 3, 10]
+    assert "sample101" in cluster.show_tables(db_name)
+
+    rows = cluster.status(db_name, migrations_dir)
+    assert [(row.version, row.state) for row in rows] == [
+        (1, STATUS_APPLIED),
+        (2, STATUS_APPLIED),
+        (3, STATUS_APPLIED),
+        (10, STATUS_APPLIED),
+    ]
+    assert cluster.migrate(db_name, migrations_dir) == []
+
+
+def test_rollback(cluster, db_name):
+    migrations_dir = TESTS_DIR / "down_migrations"
+    cluster.migrate(db_name, migrations_dir)
+
+    assert cluster.rollback(db_name, migrations_dir) == [2]
+    assert "sample_b" not in cluster.show_tables(db_name)
+    assert [row.version for row in cluster.migrate(db_name, migrations_dir)] == [2]
+
+
+def test_ensure_migrated(cluster, db_name, tmp_path, monkeypatch):
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    for migration in ("001_init.sql", "002_test2.sql"):
+        (migrations_dir / migration).write_bytes(
+            (TESTS_DIR / "complex_migrations" / migration).read_bytes()
+        )
+
+    assert [m.version for m in cluster.ensure_migrated(db_name, migrations_dir)] == [
+        1,
+        2,
+    ]
+
+    monkeypatch.setattr(
+        ClickhouseCluster, "apply_migrations", pytest.fail, raising=True
+    )
+    assert cluster.ensure_migrated(db_name, migrations_dir) == []
+    monkeypatch.undo()
+
+    (migrations_dir / "003_more.sql").write_text("SELECT 3;", encoding="utf8")
+    assert [m.version for m in cluster.ensure_migrated(db_name, migrations_dir)] == [3]
+
+    (migrations_dir / "003_more.sql").write_text("SELECT 4;", encoding="utf8")
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        cluster.ensure_migrated(db_name, migrations_dir)
+
+
+def _plan(migrator, incoming, applied=None):
+    try:
+        return [m.version for m in migrator.migrations_to_apply(incoming, applied)]
+    except MigrationException as exc:
+        return str(exc)
+
+
+def test_applied_diff_plans_like_the_full_history(cluster, db_name):
+    local = MigrationStorage(TESTS_DIR / "complex_migrations").migrations()
+    cluster.migrate(db_name, TESTS_DIR / "complex_migrations")
+    extra = Migration(11, "md5-of-11", "SELECT 11;")
+    edited = local[1]._replace(md5="edited")
+
+    cases = [
+        local,
+        local + [extra],
+        [local[0], edited, local[2], local[3], extra],
+        local[:2] + [extra, Migration(12, "md5-of-12", "SELECT 12;")],
+        [local[0], edited, extra, Migration(12, "md5-of-12", "SELECT 12;")],
+        local[:3],
+        [],
+    ]
+    with cluster.connection(db_name) as conn:
+        migrator = Migrator(conn)
+        for incoming in cases:
+            assert _plan(
+                migrator, incoming, migrator.query_applied_diff(incoming)
+            ) == _plan(migrator, incoming)
+
+
+def test_applied_diff_of_a_long_history(cluster, db_name):
+    # About 300 KiB of local migrations: beyond the default max_query_size.
+    incoming = [Migration(v, f"{v:032x}", None) for v in range(1, 8002)]
+    cluster.create_db(db_name)
+    cluster.init_schema(db_name)
+
+    with cluster.connection(db_name) as conn:
+        conn.insert(
+            "schema_versions",
+            [{"version": m.version, "md5": m.md5, "script": ""} for m in incoming[:-1]],
+        )
+        migrator = Migrator(conn)
+        applied = migrator.query_applied_diff(incoming)
+
+    assert [m.version for m in migrator.migrations_to_apply(incoming, applied)] == [
+        8001
+    ]
+
+
+def test_connection_types_match_network_drivers(cluster, db_name):
+    cluster.migrate(db_name, TESTS_DIR / "complex_migrations")
+
+    with cluster.connection(db_name) as conn:
+        conn.insert("sample11", [{"id": 7, "name": "seven"}])
+        rows = conn.query("SELECT id, name, toUInt64(id) AS big FROM sample11")
+
+    assert rows == [{"id": 7, "name": "seven", "big": 7}]
+
+
+def test_connections_keep_their_own_database(cluster, db_name):
+    cluster.create_db(db_name)
+
+    with cluster.connection(db_name) as conn, cluster.connection("") as other:
+        conn.command("CREATE TABLE own (id UInt8) ENGINE = Memory")
+        other.command("SELECT 1")
+        conn.command("INSERT INTO own VALUES (1)")
+
+        assert conn.query("SELECT currentDatabase() AS db") == [{"db": db_name}]
+        assert other.query("SELECT currentDatabase() AS db") == [{"db": "default"}]
+
+
+def test_use_in_a_script_stays_in_its_statement(cluster, db_name):
+    cluster.create_db(db_name)
+
+    with cluster.connection(db_name) as conn:
+        conn.command("USE system")
+        conn.command("CREATE TABLE own (id UInt8) ENGINE = Memory")
+
+        assert conn.query("SELECT currentDatabase() AS db") == [{"db": db_name}]
+        assert "own" in cluster.show_tables(db_name)
+
+
+def test_cli_migrate(db_name):
+    args = [
+        "--driver",
+        "chdb",
+        "--db-name",
+        db_name,
+        "--migrations-dir",
+        str(TESTS_DIR / "down_migrations"),
+    ]
+
+    assert [m.version for m in migrate(get_context(args))] == [1, 2]
+
+
+def test_cli_chdb_path():
+    ctx = get_context(["--driver", "chdb", "--chdb-path", "/var/lib/chdb"])
+    assert create_cluster(ctx).chdb_path == "/var/lib/chdb"
+
+
+def test_second_data_path_in_one_process_is_rejected(cluster, tmp_path):
+    cluster.show_tables("default")
+
+    other = ClickhouseCluster(driver="chdb", chdb_path=tmp_path)
+    with pytest.raises(MigrationException, match="chdb"):
+        other.show_tables("default")
@@ -6,11 +6,12 @@ import pytest
 from clickhouse_migrations import __version__, command_line
 from clickhouse_migrations.command_line import (
     cast_to_bool,
+    format_stats,
     format_status,
     get_context,
     main,
 )
-from clickhouse_migrations.migrator import StatusRow
+from clickhouse_migrations.migrator import StatsRow, StatusRow
 
 TESTS_DIR = Path(__file__).parent
 
@@ -150,7 +151,8 @@ def test_version_subcommand(monkeypatch, capsys):
 
 def test_main_returns_zero_on_success(monkeypatch):
     monkeypatch.setattr(sys, "argv", ["clickhouse-migrations"])
-    monkeypatch.setattr(command_line, "migrate", lambda ctx: [])
+    # pylint: disable=protected-access
+    monkeypatch.setitem(command_line._COMMANDS, "migrate", lambda ctx: [])
 
     assert main() == 0
 
@@ -204,7 +206,8 @@ def test_down_subcommand_dry_run_and_no_multi_statement():
 def test_main_down_dispatches_to_rollback(monkeypatch):
     calls = []
     monkeypatch.setattr(sys, "argv", ["clickhouse-migrations", "down"])
-    monkeypatch.setattr(command_line, "rollback", calls.append)
+    # pylint: disable=protected-access
+    monkeypatch.setitem(command_line._COMMANDS, "down", calls.append)
 
     assert main() == 0
     assert len(calls) == 1
@@ -233,3 +236,41 @@ def test_format_status_table():
     assert "VERSION" in out and "STATUS" in out
     assert "applied" in out and "pending" in out
     assert "2024-01-01 00:00:00" in out
+
+
+def test_collect_stats_arg():
+    assert get_context([]).collect_stats is False
+    assert get_context(["--collect-stats"]).collect_stats is True
+
+
+def test_stats_subcommand():
+    context = get_context(["stats", "--db-name", "x", "--limit", "3"])
+    assert context.command == "stats"
+    assert context.limit == 3
+
+
+def test_main_stats_dispatches_to_show_stats(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sys, "argv", ["clickhouse-migrations", "stats"])
+    # pylint: disable=protected-access
+    monkeypatch.setitem(command_line._COMMANDS, "stats", calls.append)
+
+    assert main() == 0
+    assert len(calls) == 1
+
+
+def test_format_stats_empty():
+    assert "No statistics found" in format_stats([])
+
+
+def test_format_stats_ranks_by_duration_and_memory():
+    rows = [
+        StatsRow(1, 1, 500, 0, 0, 0, 0, 10),
+        StatsRow(2, 3, 20, 0, 0, 0, 0, 9000),
+    ]
+
+    out = format_stats(rows, limit=1)
+
+    slowest, hungriest = out.split("\n\n")
+    assert "Slowest" in slowest and "500" in slowest and "9000" not in slowest
+    assert "memory-hungry" in hungriest and "9000" in hungriest
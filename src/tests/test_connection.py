@@ -2,7 +2,7 @@ import sys
 
 import pytest
 
-from clickhouse_migrations.connection import import_clickhouse_connect
+from clickhouse_migrations.connection import import_chdb, import_clickhouse_connect
 from clickhouse_migrations.exceptions import MigrationException
 
 
@@ -12,3 +12,10 @@ def test_import_clickhouse_connect_missing_raises_clear_error(monkeypatch):
 
     with pytest.raises(MigrationException, match="clickhouse-connect"):
         import_clickhouse_connect()
+
+
+def test_import_chdb_missing_raises_clear_error(monkeypatch):
+    monkeypatch.setitem(sys.modules, "chdb.session", None)
+
+    with pytest.raises(MigrationException, match="chdb"):
+        import_chdb()
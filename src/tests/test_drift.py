@@ -0,0 +1,149 @@
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.command_line import format_drift, get_context, show_drift
+from clickhouse_migrations.drift import (
+    DefinitionChange,
+    DriftRow,
+    database_pattern,
+    definition_changes,
+)
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+def _migrate_tenants(cluster, prefix, count=3):
+    names = [f"{prefix}{n}" for n in range(count)]
+    for name in names:
+        cluster.migrate(name, SQUASH_MIGRATIONS, record_fingerprint=True)
+    return names
+
+
+def test_untouched_databases_have_no_drift(cluster, prefix):
+    names = _migrate_tenants(cluster, prefix)
+
+    assert not cluster.drift(db_pattern=f"^{prefix}")
+    assert not cluster.drift(names[0])
+
+
+def test_hand_made_changes_are_reported(cluster, prefix):
+    names = _migrate_tenants(cluster, prefix)
+    with cluster.connection(names[1]) as conn:
+        conn.command("ALTER TABLE events ADD COLUMN note String")
+        conn.command("ALTER TABLE events MODIFY COLUMN kind LowCardinality(String)")
+    with cluster.connection(names[2]) as conn:
+        conn.command("DROP TABLE recent_kinds")
+
+    rows = cluster.drift(db_pattern=f"^{prefix}", diff=True)
+
+    assert [row.database for row in rows] == names[1:]
+    assert rows[0].version == 4
+    assert rows[0].recorded != rows[0].current
+    assert rows[0].changes == [
+        DefinitionChange("events.kind", "String", "LowCardinality(String)"),
+        DefinitionChange("events.note", None, "String"),
+    ]
+    assert {change.name for change in rows[1].changes} == {
+        "recent_kinds",
+        "recent_kinds.kind",
+    }
+    assert all(change.current is None for change in rows[1].changes)
+    assert cluster.drift(names[1])[0].changes is None
+
+
+def test_run_without_migrations_keeps_the_recorded_fingerprint(cluster, prefix):
+    (name,) = _migrate_tenants(cluster, prefix, count=1)
+    with cluster.connection(name) as conn:
+        conn.command("ALTER TABLE events ADD COLUMN note String")
+
+    assert cluster.migrate(name, SQUASH_MIGRATIONS, record_fingerprint=True) == []
+
+    assert [row.database for row in cluster.drift(name)] == [name]
+
+
+def test_first_record_of_a_migrated_database(cluster, prefix):
+    name = f"{prefix}0"
+    cluster.migrate(name, SQUASH_MIGRATIONS)
+    assert not cluster.drift(name)
+
+    cluster.migrate(name, SQUASH_MIGRATIONS, record_fingerprint=True)
+    with cluster.connection(name) as conn:
+        conn.command("ALTER TABLE kinds DROP COLUMN title")
+
+    assert [row.database for row in cluster.drift(name)] == [name]
+
+
+def test_identical_schemas_share_a_fingerprint(cluster, prefix):
+    names = _migrate_tenants(cluster, prefix, count=2)
+    with cluster.connection(names[0]) as conn:
+        conn.command("ALTER TABLE events ADD COLUMN note String")
+
+    (row,) = cluster.drift(db_pattern=f"^{prefix}")
+    with cluster.connection(names[1]) as conn:
+        (recorded,) = conn.query("SELECT fingerprint FROM schema_versions_fingerprints")
+
+    assert row.recorded == recorded["fingerprint"]
+
+
+def test_definition_changes():
+    assert definition_changes(
+        {"t": "Log", "t.a": "UInt8", "t.b": "String"},
+        {"t": "Log", "t.a": "UInt16", "t.c": "String"},
+    ) == [
+        DefinitionChange("t.a", "UInt8", "UInt16"),
+        DefinitionChange("t.b", "String", None),
+        DefinitionChange("t.c", None, "String"),
+    ]
+
+
+def test_database_pattern_is_exact():
+    assert database_pattern("db.1") == r"^db\.1$"
+
+
+def test_format_drift():
+    assert format_drift([]) == "No drift found."
+
+    text = format_drift(
+        [
+            DriftRow(
+                "tenant_1",
+                4,
+                "2024-01-01 00:00:00",
+                0xFF,
+                0x1,
+                [
+                    DefinitionChange("t.a", "UInt8", "UInt16"),
+                    DefinitionChange("t.b", "String", None),
+                    DefinitionChange("t.c", None, "String"),
+                ],
+            )
+        ]
+    )
+
+    assert "tenant_1  4        2024-01-01 00:00:00  00000000000000ff" in text
+    assert "  ~ t.a: UInt8 -> UInt16" in text
+    assert "  - t.b: String" in text
+    assert "  + t.c: String" in text
+
+
+def test_drift_cli(cluster, prefix, capsys):
+    names = _migrate_tenants(cluster, prefix, count=2)
+    with cluster.connection(names[0]) as conn:
+        conn.command("ALTER TABLE events ADD COLUMN note String")
+
+    rows = show_drift(
+        get_context(
+            ["drift", "--driver", "chdb", "--db-pattern", f"^{prefix}", "--diff"]
+        )
+    )
+
+    assert [row.database for row in rows] == names[:1]
+    assert "  + events.note: String" in capsys.readouterr().out
+
+
+def test_record_fingerprint_option():
+    assert get_context(["--record-fingerprint"]).record_fingerprint
+    assert not get_context([]).record_fingerprint
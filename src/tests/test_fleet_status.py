@@ -0,0 +1,118 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.command_line import (
+    format_fleet_status,
+    get_context,
+    show_fleet_status,
+)
+from clickhouse_migrations.migration import Migration, MigrationDigests
+from clickhouse_migrations.migrator import FleetRow, Migrator
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+@pytest.fixture(name="fleet")
+def fixture_fleet(cluster, prefix, tmp_path):
+    edited = Path(shutil.copytree(SQUASH_MIGRATIONS, tmp_path / "edited"))
+    with open(edited / "003_cleanup.sql", "a", encoding="utf8") as script:
+        script.write("\n-- edited after being applied\n")
+    extra = Path(shutil.copytree(SQUASH_MIGRATIONS, tmp_path / "extra"))
+    (extra / "005_extra.sql").write_text(
+        "CREATE TABLE extra (id UInt8) ENGINE = Memory;", encoding="utf8"
+    )
+
+    cluster.migrate(f"{prefix}head", SQUASH_MIGRATIONS)
+    cluster.migrate(
+        f"{prefix}behind", SQUASH_MIGRATIONS, explicit_migrations=["1", "2"]
+    )
+    cluster.migrate(f"{prefix}edited", edited)
+    cluster.migrate(f"{prefix}extra", extra)
+    return prefix
+
+
+def test_fleet_status(cluster, fleet):
+    rows = cluster.fleet_status(SQUASH_MIGRATIONS, db_pattern=f"^{fleet}")
+
+    assert rows == [
+        FleetRow(f"{fleet}behind", 2, 2, (), ()),
+        FleetRow(f"{fleet}edited", 4, 0, (3,), ()),
+        FleetRow(f"{fleet}extra", 5, 0, (), (5,)),
+        FleetRow(f"{fleet}head", 4, 0, (), ()),
+    ]
+
+
+def test_fleet_status_without_migrated_databases(cluster, prefix):
+    assert not cluster.fleet_status(SQUASH_MIGRATIONS, db_pattern=f"^{prefix}")
+
+
+def test_fleet_status_of_every_database(cluster, fleet):
+    databases = {row.database for row in cluster.fleet_status(SQUASH_MIGRATIONS)}
+
+    assert {f"{fleet}head", f"{fleet}behind"} <= databases
+
+
+def test_fleet_status_counts_databases_without_applied_migrations():
+    incoming = [Migration(1, "a", "SELECT 1"), Migration(2, "b", "SELECT 2")]
+
+    assert Migrator.fleet_status(incoming, {"empty": {}}) == [
+        FleetRow("empty", None, 2, (), ())
+    ]
+
+
+def test_fleet_status_of_migration_digests():
+    incoming = [Migration(1, "a", "SELECT 1"), Migration(2, "b", "SELECT 2")]
+    applied = {
+        "edited": MigrationDigests([Migration(1, "c", None)]),
+        "extra": {1: ("a", None), 2: ("b", None), 3: ("d", None)},
+    }
+
+    assert Migrator.fleet_status(incoming, applied) == [
+        FleetRow("edited", 1, 1, (1,), ()),
+        FleetRow("extra", 3, 0, (), (3,)),
+    ]
+
+
+def test_format_fleet_status():
+    assert format_fleet_status([]) == "No migrated databases found."
+
+    text = format_fleet_status(
+        [
+            FleetRow("a", 4, 0, (), ()),
+            FleetRow("b", 2, 2, (), ()),
+            FleetRow("c", 3, 1, (), ()),
+            FleetRow("d", 1, 3, (1,), ()),
+            FleetRow("e", 5, 0, (3,), (5,)),
+        ]
+    )
+
+    assert text.splitlines()[0] == (
+        "5 databases: 1 at head, 3 behind (1 by 1, 1 by 2, 1 by 3), "
+        "2 with md5 mismatches"
+    )
+    assert "b         2             2" in text
+    assert "e         3             5" in text
+
+
+def test_fleet_status_cli(fleet, capsys):
+    ctx = get_context(
+        [
+            "status",
+            "--fleet",
+            "--driver",
+            "chdb",
+            "--db-pattern",
+            f"^{fleet}",
+            "--migrations-dir",
+            str(SQUASH_MIGRATIONS),
+        ]
+    )
+
+    assert len(show_fleet_status(ctx)) == 4
+    assert capsys.readouterr().out.startswith(
+        "4 databases: 1 at head, 1 behind (1 by 2), 2 with md5 mismatches"
+    )
@@ -0,0 +1,296 @@
+import hashlib
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.command_line import get_context
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hashing import (
+    BLAKE2B,
+    GIT,
+    MD5,
+    XXH3,
+    digest_algorithm,
+    git_blob_ids,
+    hasher,
+    script_digest,
+)
+from clickhouse_migrations.migration import (
+    FileMigration,
+    Migration,
+    MigrationIndex,
+    MigrationStorage,
+    baseline_sources_md5,
+)
+from clickhouse_migrations.migrator import STATUS_APPLIED, STATUS_MD5_MISMATCH, Migrator
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+@pytest.fixture(name="migrations_dir")
+def fixture_migrations_dir(tmp_path):
+    return Path(shutil.copytree(SQUASH_MIGRATIONS, tmp_path / "migrations"))
+
+
+@pytest.fixture(name="checkout")
+def fixture_checkout(migrations_dir):
+    if shutil.which("git") is None:
+        pytest.skip("git is not installed")
+    _git(migrations_dir, "init", "-q")
+    _git(migrations_dir, "add", ".")
+    _git(migrations_dir, "commit", "-q", "-m", "migrations")
+    return migrations_dir
+
+
+@pytest.fixture(name="reads")
+def fixture_reads(monkeypatch):
+    reads = []
+    read_bytes = Path.read_bytes
+
+    def counted(path):
+        reads.append(path.name)
+        return read_bytes(path)
+
+    monkeypatch.setattr(Path, "read_bytes", counted)
+    return reads
+
+
+def _git(directory, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        + ["-c", "core.autocrlf=false", *args],
+        cwd=directory,
+        check=True,
+    )
+
+
+def _recorded(cluster, db_name):
+    with cluster.connection(db_name) as conn:
+        return {
+            row["version"]: row["md5"]
+            for row in conn.query("SELECT version, md5 FROM schema_versions")
+        }
+
+
+def test_digests():
+    content = b"SELECT 1;"
+
+    assert hasher(MD5)(content) == hashlib.md5(content).hexdigest()
+    assert hasher(BLAKE2B)(content) == (
+        "blake2b:" + hashlib.blake2b(content, digest_size=16).hexdigest()
+    )
+    assert [digest_algorithm(hasher(a)(content)) for a in (MD5, BLAKE2B)] == [
+        MD5,
+        BLAKE2B,
+    ]
+    with pytest.raises(MigrationException, match="Unknown hash algorithm: sha1"):
+        hasher("sha1")
+
+
+def test_xxh3_digest():
+    xxhash = pytest.importorskip("xxhash")
+
+    assert hasher(XXH3)(b"SELECT 1;") == (
+        "xxh3:" + xxhash.xxh3_128(b"SELECT 1;").hexdigest()
+    )
+
+
+def test_scripts_digest_like_their_files(tmp_path):
+    content = "SELECT 1;\r\n-- Überblick\r\n".encode("utf8")
+    (tmp_path / "001_crlf.sql").write_bytes(content)
+
+    migrations = MigrationStorage(tmp_path, BLAKE2B).migrations()
+    index = MigrationIndex(MigrationStorage(tmp_path, BLAKE2B))
+    index.refresh()
+
+    assert [m.md5 for m in migrations] == [hasher(BLAKE2B)(content)]
+    assert script_digest(migrations[0].script, MD5) == hashlib.md5(content).hexdigest()
+    assert index.migrations() == migrations
+
+
+def test_baseline_sources_do_not_depend_on_the_algorithm():
+    digested = {
+        algorithm: [Migration(1, script_digest("SELECT 1;", algorithm), "SELECT 1;")]
+        for algorithm in (MD5, BLAKE2B)
+    }
+
+    assert baseline_sources_md5(digested[MD5]) == baseline_sources_md5(
+        digested[BLAKE2B]
+    )
+
+
+def test_md5_rows_keep_verifying(cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.hash_algorithm = BLAKE2B
+
+    assert not cluster.migrate(db_name, migrations_dir)
+    assert {row.state for row in cluster.status(db_name, migrations_dir)} == {
+        STATUS_APPLIED
+    }
+
+    with open(migrations_dir / "003_cleanup.sql", "a", encoding="utf8") as script:
+        script.write("\n-- edited after being applied\n")
+    rows = cluster.status(db_name, migrations_dir)
+    assert [row.state for row in rows if row.version == 3] == [STATUS_MD5_MISMATCH]
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        cluster.migrate(db_name, migrations_dir)
+
+
+def test_rehash(cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir)
+    cluster.hash_algorithm = BLAKE2B
+    original = (migrations_dir / "004_kinds.sql").read_text(encoding="utf8")
+    (migrations_dir / "004_kinds.sql").write_text(original + "\n", encoding="utf8")
+
+    assert cluster.rehash(db_name, migrations_dir, dryrun=True) == [1, 2, 3]
+    assert cluster.rehash(db_name, migrations_dir, wait=True) == [1, 2, 3]
+
+    recorded = _recorded(cluster, db_name)
+    assert [digest_algorithm(recorded[v]) for v in (1, 2, 3, 4)] == [
+        BLAKE2B,
+        BLAKE2B,
+        BLAKE2B,
+        MD5,
+    ]
+    assert not cluster.rehash(db_name, migrations_dir)
+    (migrations_dir / "004_kinds.sql").write_text(original, encoding="utf8")
+    assert cluster.rehash(db_name, migrations_dir, wait=True) == [4]
+    assert cluster.ensure_migrated(db_name, migrations_dir) == []
+
+    # Nothing differs on the server either, prefixed digests included.
+    incoming = MigrationStorage(migrations_dir, BLAKE2B).migrations()
+    with cluster.connection(db_name) as conn:
+        assert Migrator(conn).query_applied_diff(incoming) == incoming
+
+
+def test_ensure_migrated_before_rehash(monkeypatch, cluster, db_name, migrations_dir):
+    cluster.migrate(db_name, migrations_dir, explicit_migrations=["1", "2"])
+    cluster.hash_algorithm = BLAKE2B
+    cluster.migrate(db_name, migrations_dir)
+    applied = []
+    apply_migrations = ClickhouseCluster.apply_migrations
+
+    def recorded(self, *args, **kwargs):
+        applied.append(args)
+        return apply_migrations(self, *args, **kwargs)
+
+    monkeypatch.setattr(ClickhouseCluster, "apply_migrations", recorded)
+
+    # Versions 1 and 2 are still recorded with md5: digested again as such.
+    assert cluster.ensure_migrated(db_name, migrations_dir) == []
+    assert not applied
+
+    script = migrations_dir / "002_rollups.sql"
+    script.write_text(script.read_text(encoding="utf8") + "\n", encoding="utf8")
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        cluster.ensure_migrated(db_name, migrations_dir)
+    assert applied
+
+
+def test_fleet_status_of_mixed_digests():
+    incoming = [
+        Migration(v, script_digest(f"SELECT {v};", BLAKE2B), f"SELECT {v};")
+        for v in (1, 2)
+    ]
+    applied = {1: (script_digest("SELECT 1;", MD5), None), 2: ("edited", None)}
+
+    rows = Migrator.fleet_status(incoming, {"tenant": applied})
+
+    assert [row.md5_mismatch for row in rows] == [(2,)]
+
+
+def test_unavailable_hash_algorithm():
+    with pytest.raises(MigrationException, match="Unknown hash algorithm"):
+        ClickhouseCluster(driver="chdb", hash_algorithm="sha1")
+
+
+def test_hash_algorithm_options():
+    assert get_context([]).hash_algorithm == MD5
+    context = get_context(["rehash", "--hash-algorithm", "blake2b", "--wait"])
+
+    assert (context.command, context.hash_algorithm, context.wait) == (
+        "rehash",
+        BLAKE2B,
+        True,
+    )
+
+
+def test_git_blob_ids_of_a_checkout(checkout):
+    (checkout / "003_cleanup.sql").write_text("SELECT 3;", encoding="utf8")
+    (checkout / "005_untracked.sql").write_text("SELECT 5;", encoding="utf8")
+    (checkout / "nested").mkdir()
+    (checkout / "nested" / "006_nested.sql").write_text("SELECT 6;", encoding="utf8")
+    _git(checkout, "add", "nested")
+
+    ids = git_blob_ids(checkout)
+
+    assert sorted(ids) == ["001_events.sql", "002_rollups.sql", "004_kinds.sql"]
+    for name, digest in ids.items():
+        assert digest == hasher(GIT)((checkout / name).read_bytes())
+
+
+def test_files_converted_by_git_are_hashed_from_disk(checkout):
+    (checkout / ".gitattributes").write_text(
+        "002_rollups.sql eol=crlf\n", encoding="utf8"
+    )
+    (checkout / "002_rollups.sql").unlink()
+    _git(checkout, "checkout", "--", "002_rollups.sql")
+    content = (checkout / "002_rollups.sql").read_bytes()
+    assert b"\r\n" in content
+
+    assert sorted(git_blob_ids(checkout)) == [
+        "001_events.sql",
+        "003_cleanup.sql",
+        "004_kinds.sql",
+    ]
+    migrations = MigrationStorage(checkout, GIT).migrations()
+    assert migrations[1].md5 == hasher(GIT)(content)
+
+
+def test_no_blob_ids_with_autocrlf(checkout):
+    _git(checkout, "config", "core.autocrlf", "true")
+
+    assert not git_blob_ids(checkout)
+
+
+def test_clean_files_are_not_read(checkout, reads):
+    (checkout / "004_kinds.sql").write_text("SELECT 4;", encoding="utf8")
+
+    migrations = MigrationStorage(checkout, GIT).migrations()
+
+    assert reads == ["004_kinds.sql"]
+    assert [isinstance(m, FileMigration) for m in migrations] == [
+        True,
+        True,
+        True,
+        False,
+    ]
+    assert [(m.md5, m.script) for m in migrations] == [
+        (hasher(GIT)(path.read_bytes()), path.read_text(encoding="utf8"))
+        for path in sorted(checkout.glob("*.sql"))
+    ]
+
+
+def test_git_digests_outside_a_checkout(migrations_dir):
+    migrations = MigrationStorage(migrations_dir, GIT).migrations()
+
+    assert not git_blob_ids(migrations_dir)
+    assert [m.md5 for m in migrations] == [
+        hasher(GIT)(path.read_bytes()) for path in sorted(migrations_dir.glob("*.sql"))
+    ]
+
+
+def test_status_of_a_checkout_reads_no_script(cluster, db_name, checkout, reads):
+    cluster.hash_algorithm = GIT
+    assert [m.version for m in cluster.migrate(db_name, checkout)] == [1, 2, 3, 4]
+    reads.clear()
+
+    rows = cluster.status(db_name, checkout)
+
+    assert {row.state for row in rows} == {STATUS_APPLIED}
+    assert not reads
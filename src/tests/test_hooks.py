@@ -0,0 +1,134 @@
+import pytest
+
+from clickhouse_migrations import migration as migration_module
+from clickhouse_migrations import migrator as migrator_module
+from clickhouse_migrations.command_line import create_cluster, get_context
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hooks import (
+    PHASE_FETCH_APPLIED,
+    PHASE_HASH,
+    PHASE_LOAD,
+    PHASE_TOKENIZE,
+    MigrationHook,
+    load_hook,
+)
+from clickhouse_migrations.migration import Migration, MigrationStorage
+from clickhouse_migrations.migrator import Migrator
+from tests.conftest import RecordingConnection
+
+
+class RecordingHook(MigrationHook):
+    def __init__(self):
+        self.events = []
+
+    def on_load(self, migrations, duration):
+        self.events.append(("on_load", len(migrations)))
+
+    def on_phase(self, phase, started, duration):
+        self.events.append(("on_phase", phase))
+
+    def before_migration(self, migration):
+        self.events.append(("before_migration", migration.version))
+
+    def before_statement(self, migration, index, statement):
+        self.events.append(("before_statement", migration.version, index))
+
+    def after_statement(self, migration, index, statement, started, duration, error):
+        self.events.append(("after_statement", migration.version, index, error))
+
+    def after_bookkeeping(self, migration, started, duration):
+        self.events.append(("after_bookkeeping", migration.version))
+
+
+def test_hook_events_are_emitted_in_order(recording_conn):
+    hook = RecordingHook()
+    migrations = [Migration(version=1, md5="a", script="SELECT 1; SELECT 2;")]
+
+    Migrator(recording_conn, hooks=[hook]).apply_migration(migrations, True)
+
+    assert hook.events == [
+        ("on_phase", PHASE_FETCH_APPLIED),
+        ("before_migration", 1),
+        ("on_phase", PHASE_TOKENIZE),
+        ("before_statement", 1, 1),
+        ("after_statement", 1, 1, None),
+        ("before_statement", 1, 2),
+        ("after_statement", 1, 2, None),
+        ("after_bookkeeping", 1),
+    ]
+
+
+def test_after_statement_receives_error():
+    hook = RecordingHook()
+    migrations = [Migration(version=1, md5="a", script="SELECT 1;")]
+
+    with pytest.raises(RuntimeError, match="boom"):
+        Migrator(
+            RecordingConnection(fail_on="SELECT 1;"), hooks=[hook]
+        ).apply_migration(migrations, True)
+
+    _, _, _, error = hook.events[-1]
+    assert isinstance(error, RuntimeError)
+    assert ("after_bookkeeping", 1) not in hook.events
+
+
+def test_storage_emits_load_events(tmp_path):
+    (tmp_path / "001_init.sql").write_text("SELECT 1;", encoding="utf8")
+    hook = RecordingHook()
+
+    MigrationStorage(tmp_path).migrations(hooks=[hook])
+
+    assert hook.events == [
+        ("on_phase", PHASE_LOAD),
+        ("on_phase", PHASE_HASH),
+        ("on_load", 1),
+    ]
+
+
+def test_no_timing_calls_without_hooks(monkeypatch, tmp_path, recording_conn):
+    def _forbidden():
+        raise AssertionError("perf_counter called without hooks")
+
+    monkeypatch.setattr(migrator_module.time, "perf_counter", _forbidden)
+    monkeypatch.setattr(migration_module.time, "perf_counter", _forbidden)
+    (tmp_path / "001_init.sql").write_text("SELECT 1; SELECT 2;", encoding="utf8")
+
+    migrations = MigrationStorage(tmp_path).migrations()
+    applied = Migrator(recording_conn).apply_migration(migrations, True)
+
+    assert applied == migrations
+
+
+def test_load_hook_from_spec():
+    hook = load_hook("tests.test_hooks:RecordingHook")
+
+    assert isinstance(hook, RecordingHook)
+
+
+@pytest.mark.parametrize(
+    "spec", ["tests.test_hooks", "tests.test_hooks:Missing", "no_such_module:Hook"]
+)
+def test_load_hook_invalid_spec_raises(spec):
+    with pytest.raises(MigrationException, match="hook"):
+        load_hook(spec)
+
+
+def test_hook_cli_option_registers_hooks_on_cluster():
+    ctx = get_context(
+        [
+            "--hook",
+            "tests.test_hooks:RecordingHook",
+            "--hook",
+            "clickhouse_migrations.hooks:MigrationHook",
+        ]
+    )
+
+    cluster = create_cluster(ctx)
+
+    assert [type(h) for h in cluster.hooks] == [RecordingHook, MigrationHook]
+
+
+def test_hook_default_from_env(monkeypatch):
+    monkeypatch.setenv("HOOKS", "a:B,c:D")
+
+    assert get_context([]).hooks == ["a:B", "c:D"]
@@ -0,0 +1,199 @@
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations import lock as lock_module
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.command_line import get_context
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hooks import MigrationHook
+from clickhouse_migrations.lock import LOCK_TABLE, MigrationLock
+from clickhouse_migrations.migration import Migration
+from clickhouse_migrations.migrator import Migrator, at_head_query, head_checksum
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+class MigrationRecorder(MigrationHook):
+    def __init__(self):
+        self.versions = []
+
+    def before_migration(self, migration):
+        self.versions.append(migration.version)
+
+
+@pytest.fixture(autouse=True)
+def short_grace_period(monkeypatch):
+    monkeypatch.setattr(lock_module, "GRACE_PERIOD", 0.05)
+
+
+@pytest.fixture(name="db_name")
+def fixture_db_name(cluster, db_name):
+    cluster.create_db(db_name)
+    with cluster.connection(db_name) as conn:
+        Migrator(conn).init_schema()
+        Migrator(conn).init_lock_table()
+    return db_name
+
+
+def test_one_holder_at_a_time(cluster, db_name):
+    with cluster.connection(db_name) as first, cluster.connection(db_name) as second:
+        holder = MigrationLock(first)
+        waiter = MigrationLock(second)
+
+        assert holder.acquire()
+        assert not waiter.acquire()
+        assert not waiter.acquire()
+
+        holder.release()
+        assert waiter.acquire()
+        assert not holder.acquire()
+
+
+def test_older_claim_committed_late_wins(cluster, db_name):
+    with cluster.connection(db_name) as first, cluster.connection(db_name) as second:
+
+        def claim_in_flight():
+            # Stamped before the claim below, but committed during its grace
+            # period.
+            time.sleep(0.1)
+            second.command(
+                f"INSERT INTO {LOCK_TABLE} (owner, renewed_at, expires_at) "
+                "SELECT 'early', now64(6) - 10, now64(6) + 60"
+            )
+
+        claimer = threading.Thread(target=claim_in_flight)
+        claimer.start()
+        assert not MigrationLock(first, grace=0.5).acquire()
+        claimer.join()
+
+
+def test_grace_period_shorter_than_the_lease(cluster, db_name):
+    with cluster.connection(db_name) as conn:
+        with pytest.raises(MigrationException, match="shorter than half"):
+            MigrationLock(conn, ttl=1.0, grace=0.5)
+
+
+def test_expired_rows_are_dropped(cluster, db_name):
+    with cluster.connection(db_name) as conn:
+        ddl = conn.query(f"SHOW CREATE TABLE {LOCK_TABLE}")[0]["statement"]
+
+    assert "TTL toDateTime(expires_at) + toIntervalDay(1)" in ddl
+
+
+def test_expired_lease_is_taken_over(cluster, db_name):
+    with cluster.connection(db_name) as first, cluster.connection(db_name) as second:
+        assert MigrationLock(first, ttl=0.2).acquire()
+        assert not MigrationLock(second).acquire()
+
+        time.sleep(0.3)
+        assert MigrationLock(second).acquire()
+
+
+def test_held_lease_is_renewed(cluster, db_name):
+    with cluster.connection(db_name) as first, cluster.connection(db_name) as second:
+        holder = MigrationLock(first, ttl=0.3)
+        assert holder.acquire()
+
+        with holder.held(lambda: cluster.connection(db_name)):
+            time.sleep(0.6)
+            assert not MigrationLock(second).acquire()
+
+        assert MigrationLock(second).acquire()
+
+
+def test_wait_returns_once_head_is_applied(cluster, db_name):
+    with cluster.connection(db_name) as first, cluster.connection(db_name) as second:
+        assert MigrationLock(first).acquire()
+        waiter = MigrationLock(second, poll_interval=0.05)
+
+        def apply_head():
+            time.sleep(0.2)
+            first.command(
+                "INSERT INTO schema_versions (version, md5, script) "
+                "VALUES (1, 'a', ''), (2, 'b', '')"
+            )
+
+        head = head_checksum([Migration(1, "a", ""), Migration(2, "b", "")])
+        applier = threading.Thread(target=apply_head)
+        applier.start()
+        assert waiter.wait(at_head_query(db_name, head)) is False
+        applier.join()
+
+
+def test_wait_takes_the_free_lock(cluster, db_name):
+    with cluster.connection(db_name) as conn:
+        head = head_checksum([Migration(1, "a", "")])
+        assert MigrationLock(conn).wait(at_head_query(db_name, head)) is True
+
+
+def test_concurrent_runners_apply_migrations_once():
+    db_name = f"lock_{uuid.uuid4().hex}"
+    recorder = MigrationRecorder()
+    # One cluster for all runners: an in-memory chDB session only keeps its
+    # data while it is alive.
+    cluster = ClickhouseCluster(driver="chdb", hooks=[recorder])
+    results = []
+
+    def run():
+        results.append(cluster.migrate(db_name, SQUASH_MIGRATIONS, lock_ttl=5))
+
+    runners = [threading.Thread(target=run) for _ in range(4)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+
+    assert sorted(recorder.versions) == [1, 2, 3, 4]
+    assert sorted(len(applied) for applied in results) == [0, 0, 0, 4]
+    with cluster.connection(db_name) as conn:
+        assert conn.query("SELECT count() AS n FROM schema_versions") == [{"n": 4}]
+
+
+def test_locked_run_applies_backfilled_migrations(cluster, tmp_path):
+    db_name = f"lock_{uuid.uuid4().hex}"
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    for name in ("001_events.sql", "003_cleanup.sql"):
+        shutil.copy(SQUASH_MIGRATIONS / name, migrations_dir)
+    cluster.migrate(db_name, migrations_dir, lock_ttl=5)
+
+    shutil.copy(SQUASH_MIGRATIONS / "002_rollups.sql", migrations_dir)
+    applied = cluster.migrate(db_name, migrations_dir, lock_ttl=5)
+
+    assert [m.version for m in applied] == [2]
+
+
+def test_locked_run_verifies_applied_migrations(cluster, tmp_path):
+    db_name = f"lock_{uuid.uuid4().hex}"
+    migrations_dir = Path(shutil.copytree(SQUASH_MIGRATIONS, tmp_path / "migrations"))
+    cluster.migrate(db_name, migrations_dir, lock_ttl=5)
+
+    with open(migrations_dir / "003_cleanup.sql", "a", encoding="utf8") as script:
+        script.write("\n-- edited after being applied\n")
+
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        cluster.migrate(db_name, migrations_dir, lock_ttl=5)
+
+
+def test_dry_run_takes_no_lock(cluster):
+    db_name = f"lock_{uuid.uuid4().hex}"
+
+    cluster.migrate(db_name, SQUASH_MIGRATIONS, dryrun=True, lock_ttl=5)
+
+    assert "schema_versions_lock" not in cluster.show_tables(db_name)
+
+
+def test_lock_options():
+    assert get_context([]).lock is False
+    assert get_context([]).lock_grace == 1.0
+    context = get_context(["--lock", "--lock-ttl", "15", "--lock-grace", "3"])
+    assert context.lock is True
+    assert context.lock_ttl == 15.0
+    assert context.lock_grace == 3.0
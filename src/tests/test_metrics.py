@@ -0,0 +1,146 @@
+import os
+import stat
+import sys
+
+from clickhouse_migrations.command_line import get_context, main
+from clickhouse_migrations.hooks import (
+    PHASE_BOOKKEEPING,
+    PHASE_EXECUTE,
+    PHASE_FETCH_APPLIED,
+    PHASE_HASH,
+    PHASE_LOAD,
+)
+from clickhouse_migrations.metrics import (
+    MeteredConnection,
+    RunMetrics,
+    format_openmetrics,
+    write_openmetrics,
+)
+from clickhouse_migrations.migration import Migration, MigrationStorage
+from clickhouse_migrations.migrator import Migrator
+from tests.conftest import RecordingConnection
+
+
+def test_format_openmetrics_renders_every_family_per_database():
+    first = RunMetrics("db1")
+    first.migrations_applied = 2
+    first.add_phase(PHASE_EXECUTE, 1.5)
+    first.finish(success=True)
+    second = RunMetrics('we"ird')
+
+    text = format_openmetrics([first, second])
+
+    assert text.endswith("# EOF\n")
+    assert "# TYPE clickhouse_migrations_migrations_applied gauge" in text
+    assert 'clickhouse_migrations_migrations_applied{database="db1"} 2' in text
+    assert (
+        'clickhouse_migrations_phase_duration_seconds{database="db1",phase="execute"}'
+        " 1.5" in text
+    )
+    assert 'clickhouse_migrations_last_run_success{database="db1"} 1' in text
+    assert 'clickhouse_migrations_last_run_success{database="we\\"ird"} 0' in text
+
+
+def test_write_openmetrics_is_atomic_and_readable(tmp_path):
+    target = tmp_path / "migrations.prom"
+    target.write_text("old", encoding="utf8")
+
+    write_openmetrics(target, [RunMetrics("db")])
+
+    assert "clickhouse_migrations_queries_sent" in target.read_text(encoding="utf8")
+    assert stat.S_IMODE(os.stat(target).st_mode) == 0o644
+    assert os.listdir(tmp_path) == ["migrations.prom"]
+
+
+def test_metered_connection_counts_queries_and_bytes():
+    metrics = RunMetrics("db")
+    conn = MeteredConnection(RecordingConnection(), metrics)
+
+    with conn:
+        conn.command("SELECT 1")
+        conn.query("SELECT 22")
+        conn.insert("t", [{"a": "xyz", "b": 7}, {"a": "é", "b": None}])
+
+    assert metrics.queries_sent == 3
+    assert metrics.bytes_sent == len("SELECT 1") + len("SELECT 22") + len(
+        "txyz7éNone".encode("utf8")
+    )
+
+
+def test_metered_connection_counts_received_bytes():
+    class _RowsConn(RecordingConnection):
+        def query(self, statement, settings=None):
+            super().query(statement, settings)
+            return [{"version": 1, "md5": "ab"}, {"version": 10, "md5": "日本"}]
+
+    metrics = RunMetrics("db")
+    MeteredConnection(_RowsConn(), metrics).query("SELECT version, md5")
+
+    assert metrics.bytes_received == len("1ab10") + len("日本".encode("utf8"))
+    assert 'clickhouse_migrations_received_bytes{database="db"} 11' in (
+        format_openmetrics([metrics])
+    )
+
+
+def test_migrator_records_phases_and_counters():
+    metrics = RunMetrics("db")
+    migrations = [
+        Migration(version=1, md5="a", script="SELECT 1; SELECT 2;"),
+        Migration(version=2, md5="b", script="SELECT 3;"),
+    ]
+
+    Migrator(RecordingConnection(), hooks=[metrics]).apply_migration(migrations, True)
+
+    assert metrics.migrations_applied == 2
+    assert metrics.statements_executed == 3
+    for phase in (PHASE_FETCH_APPLIED, PHASE_EXECUTE, PHASE_BOOKKEEPING):
+        assert metrics.phase_seconds[phase] > 0
+
+
+def test_migrator_dry_run_applies_nothing():
+    metrics = RunMetrics("db")
+    migrations = [Migration(version=1, md5="a", script="SELECT 1;")]
+
+    Migrator(RecordingConnection(), dryrun=True, hooks=[metrics]).apply_migration(
+        migrations, True
+    )
+
+    assert metrics.migrations_applied == 0
+    assert metrics.statements_executed == 0
+
+
+def test_storage_records_load_and_hash_phases(tmp_path):
+    (tmp_path / "001_init.sql").write_text("SELECT 1;", encoding="utf8")
+    metrics = RunMetrics("db")
+
+    MigrationStorage(tmp_path).migrations(hooks=[metrics])
+
+    assert metrics.phase_seconds[PHASE_LOAD] > 0
+    assert metrics.phase_seconds[PHASE_HASH] > 0
+
+
+def test_metrics_file_arg():
+    assert get_context([]).metrics_file is None
+    assert str(get_context(["--metrics-file", "m.prom"]).metrics_file) == "m.prom"
+
+
+def test_metrics_file_written_on_failed_run(monkeypatch, tmp_path):
+    metrics_file = tmp_path / "migrations.prom"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "clickhouse-migrations",
+            "--db-name",
+            "db",
+            "--migrations-dir",
+            str(tmp_path / "missing"),
+            "--metrics-file",
+            str(metrics_file),
+        ],
+    )
+
+    assert main() == 1
+    assert 'clickhouse_migrations_last_run_success{database="db"} 0' in (
+        metrics_file.read_text(encoding="utf8")
+    )
@@ -1,7 +1,18 @@
+import os
+from pathlib import Path
+
 import pytest
 
+from clickhouse_migrations import migration as migration_module
 from clickhouse_migrations.exceptions import MigrationException
-from clickhouse_migrations.migration import MigrationStorage
+from clickhouse_migrations.migration import (
+    CompactMigration,
+    Migration,
+    MigrationDigests,
+    MigrationStorage,
+)
+
+MD5 = "0123456789abcdef0123456789abcdef"
 
 
 def test_valid_migrations_are_sorted_by_version(tmp_path):
@@ -92,3 +103,95 @@ def test_down_scripts_duplicate_version_raises_clear_error(tmp_path):
 
     with pytest.raises(MigrationException, match="Duplicate down migration version 1"):
         MigrationStorage(tmp_path).down_scripts()
+
+
+def test_down_scripts_are_read_when_looked_up(tmp_path, monkeypatch):
+    for version in (1, 2, 3):
+        (tmp_path / f"00{version}_t.down.sql").write_text(
+            f"DROP TABLE t{version};", encoding="utf8"
+        )
+    read = []
+    monkeypatch.setattr(
+        Path,
+        "read_text",
+        lambda path, encoding: read.append(path.name)
+        or path.read_bytes().decode(encoding),
+    )
+
+    scripts = MigrationStorage(tmp_path).down_scripts()
+
+    assert 3 in scripts and 4 not in scripts and len(scripts) == 3
+    assert not read
+    assert scripts[3] == scripts[3] == "DROP TABLE t3;"
+    assert read == ["003_t.down.sql"]
+
+
+def test_directory_is_scanned_once(tmp_path, monkeypatch):
+    (tmp_path / "001_init.sql").write_text("SELECT 1;", encoding="utf8")
+    (tmp_path / "001_init.down.sql").write_text("SELECT 2;", encoding="utf8")
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(
+        migration_module.os, "scandir", lambda path: scans.append(path) or scandir(path)
+    )
+    storage = MigrationStorage(tmp_path)
+
+    assert [m.version for m in storage.migrations()] == [1]
+    assert list(storage.down_scripts()) == [1]
+    assert storage.baseline() is None
+    assert storage.filenames() == [tmp_path / "001_init.sql"]
+    assert len(scans) == 1
+
+
+def test_compact_migration_converts_both_ways():
+    migration = Migration(3, MD5, "SELECT 3;")
+
+    compact = CompactMigration.from_migration(migration)
+
+    assert compact.digest == bytes.fromhex(MD5)
+    assert (compact.version, compact.md5, compact.script) == (3, MD5, None)
+    assert compact.to_migration() == Migration(3, MD5, None)
+    assert not hasattr(compact, "__dict__")
+
+
+@pytest.mark.parametrize("md5", ["a", MD5.upper(), "z" * 32, ""])
+def test_compact_migration_keeps_other_md5s_as_is(md5):
+    assert CompactMigration(1, md5).digest == md5
+    assert CompactMigration(1, md5).md5 == md5
+
+
+def test_migration_digests_look_versions_up():
+    digests = MigrationDigests(
+        [Migration(1, MD5, None), Migration(5, "b", None), Migration(9, MD5, None)]
+    )
+
+    assert len(digests) == 3
+    assert list(digests) == [
+        CompactMigration(1, MD5),
+        CompactMigration(5, "b"),
+        CompactMigration(9, MD5),
+    ]
+    assert digests[-1] == CompactMigration(9, MD5)
+    assert [digests.md5(version) for version in (0, 1, 5, 6, 9, 10)] == [
+        None,
+        MD5,
+        "b",
+        None,
+        MD5,
+        None,
+    ]
+    assert 5 in digests and 6 not in digests
+    assert digests.last_version == 9
+    assert MigrationDigests().last_version is None
+
+
+def test_migration_digests_keep_repeated_versions():
+    digests = MigrationDigests()
+    digests.append(1, "a")
+    digests.append(1, MD5)
+
+    assert len(digests) == 2
+    assert digests.md5(1) == MD5
+    assert digests.to_migrations() == [Migration(1, "a", None), Migration(1, MD5, None)]
+    with pytest.raises(MigrationException, match="not sorted by version: 0 after 1"):
+        digests.append(0, MD5)
@@ -10,7 +10,10 @@ from clickhouse_migrations.migrator import (
     STATUS_PENDING,
     STATUS_UNKNOWN,
     Migrator,
+    head_checksum,
+    statement_query_id,
 )
+from tests.conftest import RecordingConnection
 
 FIXTURES_DIR = Path(__file__).parent
 
@@ -294,3 +297,160 @@ def test_rollback_dry_run_executes_nothing():
     assert rolled == [2]
     assert not any("DROP TABLE" in c for c in conn.commands)
     assert not any("DELETE WHERE version" in c for c in conn.commands)
+
+
+def test_statement_query_id_is_deterministic_per_database():
+    migration = Migration(version=1, md5="abc", script="SELECT 1;")
+
+    assert statement_query_id("a", migration, 1) == statement_query_id(
+        "a", migration, 1
+    )
+    assert statement_query_id("a", migration, 1) != statement_query_id(
+        "b", migration, 1
+    )
+    assert statement_query_id("a", migration, 1) != statement_query_id(
+        "a", migration, 2
+    )
+
+
+def test_collect_stats_tags_statements_and_copies_query_log():
+    conn = RecordingConnection()
+    migration = Migration(version=7, md5="abc", script="SELECT 1; SELECT 2;")
+
+    Migrator(conn, collect_stats=True).apply_migration([migration], True)
+
+    tagged = [c for c in conn.commands if c[1] is not None]
+    assert [c[0] for c in tagged] == ["SELECT 1;", "SELECT 2;"]
+    assert tagged[0][1] == statement_query_id("mydb", migration, 1)
+    assert tagged[1][2] == {"log_comment": "migration=7;stmt=2"}
+
+    stats_insert = conn.commands[-1][0]
+    assert conn.commands[-2][0] == "SYSTEM FLUSH LOGS"
+    assert stats_insert.startswith("INSERT INTO schema_versions_stats")
+    assert all(query_id in stats_insert for _, query_id, _ in tagged)
+
+
+def test_collect_stats_failure_does_not_fail_migration():
+    no_query_log = RecordingConnection(fail_on="SYSTEM FLUSH LOGS")
+    migration = Migration(version=1, md5="abc", script="SELECT 1;")
+
+    applied = Migrator(no_query_log, collect_stats=True).apply_migration(
+        [migration], True
+    )
+
+    assert applied == [migration]
+
+
+def test_collect_stats_skipped_in_dry_run():
+    conn = RecordingConnection()
+    migration = Migration(version=1, md5="abc", script="SELECT 1;")
+
+    Migrator(conn, dryrun=True, collect_stats=True).apply_migration([migration], True)
+
+    assert not any(query_id for _, query_id, _ in conn.commands)
+    assert not any("schema_versions_stats" in c[0] for c in conn.commands)
+
+
+def test_stats_table_created_only_when_collecting():
+    conn = RecordingConnection()
+    Migrator(conn).init_schema()
+    assert not any("schema_versions_stats" in c[0] for c in conn.commands)
+
+    conn = RecordingConnection()
+    Migrator(conn, collect_stats=True).init_schema()
+    assert "schema_versions_stats" in conn.commands[-1][0]
+
+
+def test_head_checksum_ignores_order_but_not_pairing():
+    migrations = [Migration(1, "md5a", ""), Migration(2, "md5b", "")]
+    swapped = [Migration(1, "md5b", ""), Migration(2, "md5a", "")]
+
+    checksum = head_checksum(migrations)
+
+    assert checksum == head_checksum(migrations[::-1])
+    assert checksum != head_checksum(swapped)
+    assert (checksum.count, checksum.last_version) == (2, 2)
+    assert head_checksum([]) == (0, 0, 0)
+
+
+def _migrations(*versions, md5="m"):
+    return [Migration(version=v, md5=f"{md5}{v}", script="") for v in versions]
+
+
+@pytest.mark.parametrize(
+    "incoming, applied, expected",
+    [
+        (_migrations(1, 2, 3), [], [1, 2, 3]),
+        (_migrations(1, 2, 3), _migrations(1, 2), [3]),
+        (_migrations(1, 3, 5), _migrations(1, 5), [3]),
+        (_migrations(1, 2), _migrations(1, 2), []),
+        # Missing files win over md5 mismatches, which win over unknown rows.
+        ([], _migrations(1), "gone missing"),
+        (_migrations(2), _migrations(1, 3), "gone missing"),
+        (_migrations(1, 2, 4), _migrations(1, 3, md5="x"), "version is 1"),
+        (_migrations(1, 2, 4), _migrations(1, 3, 5), "not known.*version is 3"),
+    ],
+)
+def test_migrations_to_apply_streams_both_sides(incoming, applied, expected):
+    migrator = Migrator(None)
+
+    for make in (list, iter):
+        if isinstance(expected, str):
+            with pytest.raises(MigrationException, match=expected):
+                migrator.migrations_to_apply(make(incoming), make(applied))
+        else:
+            pending = migrator.migrations_to_apply(make(incoming), make(applied))
+            assert [m.version for m in pending] == expected
+
+
+def test_migrations_to_apply_counts_duplicate_rows():
+    migrator = Migrator(None)
+    applied = _migrations(1) + [Migration(version=1, md5="x", script="")]
+
+    # The last of the rows of a version is compared; every row counts.
+    pending = migrator.migrations_to_apply(_migrations(1, 2), applied[::-1])
+    assert [m.version for m in pending] == [2]
+    with pytest.raises(MigrationException, match="md5 is not equal"):
+        migrator.migrations_to_apply(_migrations(1, 2), applied)
+    with pytest.raises(MigrationException, match="gone missing"):
+        migrator.migrations_to_apply(_migrations(1), applied)
+
+
+def test_migrations_to_apply_sorts_its_input():
+    migrator = Migrator(None)
+
+    pending = migrator.migrations_to_apply(_migrations(3, 1, 2), [])
+    assert [m.version for m in pending] == [1, 2, 3]
+    pending = migrator.migrations_to_apply(_migrations(3, 1, 2), _migrations(2, 1))
+    assert [m.version for m in pending] == [3]
+    with pytest.raises(MigrationException, match="version is 1"):
+        migrator.migrations_to_apply(_migrations(2, 1), _migrations(2, 1, md5="x"))
+    # A streamed result is read once, so it cannot be sorted.
+    with pytest.raises(MigrationException, match="not sorted by version: 1 after 2"):
+        migrator.migrations_to_apply(_migrations(1, 2), iter(_migrations(2, 1)))
+
+
+def test_status_sorts_its_input():
+    applied = {3: ("m3", "2024-01-03"), 1: ("m1", "2024-01-01")}
+
+    rows = Migrator(None).migration_status(_migrations(2, 1), applied)
+
+    assert [(r.version, r.state) for r in rows] == [
+        (1, STATUS_APPLIED),
+        (2, STATUS_PENDING),
+        (3, STATUS_UNKNOWN),
+    ]
+
+
+def test_build_status_streams_applied():
+    applied = iter([(1, ("m1", "2024-01-01")), (3, ("m3", "2024-01-03"))])
+
+    rows = Migrator._build_status(  # pylint: disable=protected-access
+        iter(_migrations(1, 2)), applied
+    )
+
+    assert [(r.version, r.state) for r in rows] == [
+        (1, STATUS_APPLIED),
+        (2, STATUS_PENDING),
+        (3, STATUS_UNKNOWN),
+    ]
@@ -0,0 +1,112 @@
+import json
+import sys
+import threading
+
+from clickhouse_migrations.command_line import get_context, main
+from clickhouse_migrations.migration import Migration
+from clickhouse_migrations.migrator import Migrator
+from clickhouse_migrations.profiler import Profiler
+from tests.conftest import RecordingConnection
+
+MIGRATIONS = [
+    Migration(version=1, md5="a", script="SELECT 1; SELECT 2;"),
+    Migration(version=2, md5="b", script="SELECT 3;"),
+]
+
+
+def _profiled_run(profiler):
+    Migrator(RecordingConnection(), hooks=[profiler]).apply_migration(MIGRATIONS, True)
+
+
+def test_profiler_totals_cover_every_phase():
+    profiler = Profiler()
+    _profiled_run(profiler)
+
+    totals = profiler.phase_totals()
+
+    assert totals["execute"][0] == 3
+    assert totals["tokenize"][0] == 2
+    assert totals["bookkeeping"][0] == 2
+    assert totals["fetch_applied"][0] == 1
+
+
+def test_profiler_summary_table():
+    profiler = Profiler(trace_memory=True)
+    _profiled_run(profiler)
+
+    summary = profiler.summary()
+
+    assert summary.startswith("PHASE")
+    assert "tokenize" in summary
+    assert "Total wall time" in summary
+    assert "Peak traced memory" in summary
+
+
+def test_trace_has_one_track_per_thread(tmp_path):
+    profiler = Profiler()
+    _profiled_run(profiler)
+    worker = threading.Thread(target=_profiled_run, args=(profiler,), name="worker")
+    worker.start()
+    worker.join()
+
+    trace_file = tmp_path / "trace.json"
+    profiler.write_trace(trace_file)
+    events = json.loads(trace_file.read_text(encoding="utf8"))["traceEvents"]
+
+    names = {e["tid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert sorted(names.values()) == ["MainThread", "worker"]
+    spans = [e for e in events if e["ph"] == "X"]
+    assert {e["tid"] for e in spans} == set(names)
+    migration_spans = [e for e in spans if e["cat"] == "migration"]
+    assert len(migration_spans) == 4
+    assert all(e["dur"] >= 0 and e["ts"] >= 0 for e in spans)
+
+
+def test_profile_args():
+    context = get_context([])
+    assert context.profile is False
+    assert context.profile_memory is False
+    assert context.trace_out is None
+
+    context = get_context(["--profile", "--profile-memory", "--trace-out", "t.json"])
+    assert context.profile is True
+    assert context.profile_memory is True
+    assert str(context.trace_out) == "t.json"
+
+
+def test_profile_report_written_on_failed_run(monkeypatch, tmp_path, capsys):
+    trace_file = tmp_path / "trace.json"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "clickhouse-migrations",
+            "--migrations-dir",
+            str(tmp_path / "missing"),
+            "--profile",
+            "--trace-out",
+            str(trace_file),
+        ],
+    )
+
+    assert main() == 1
+    assert "Total wall time" in capsys.readouterr().out
+    assert "traceEvents" in json.loads(trace_file.read_text(encoding="utf8"))
+
+
+def test_profile_memory_implies_profile(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        [
+            "clickhouse-migrations",
+            "--migrations-dir",
+            str(tmp_path / "missing"),
+            "--profile-memory",
+        ],
+    )
+
+    assert main() == 1
+    out = capsys.readouterr().out
+    assert "Total wall time" in out
+    assert "Peak traced memory" in out
@@ -0,0 +1,106 @@
+import uuid
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.command_line import get_context, provision
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.migrator import STATUS_APPLIED
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+@pytest.fixture(name="template")
+def fixture_template(cluster):
+    template = f"template_{uuid.uuid4().hex}"
+    cluster.migrate(template, SQUASH_MIGRATIONS)
+    return template
+
+
+def _db_name():
+    return f"tenant_{uuid.uuid4().hex}"
+
+
+def test_provision_copies_schema_and_history(cluster, template):
+    db_name = _db_name()
+
+    created = cluster.provision(db_name, template, parallelism=2)
+
+    assert set(created) == set(cluster.show_tables(template)) - {"schema_versions"}
+    assert set(cluster.show_tables(db_name)) == set(cluster.show_tables(template))
+    rows = cluster.status(db_name, SQUASH_MIGRATIONS)
+    assert [row.md5 for row in rows] == [
+        row.md5 for row in cluster.status(template, SQUASH_MIGRATIONS)
+    ]
+    assert {row.state for row in rows} == {STATUS_APPLIED}
+    assert cluster.migrate(db_name, SQUASH_MIGRATIONS) == []
+
+
+def test_provisioned_views_read_the_new_database(cluster, template):
+    db_name = _db_name()
+    cluster.provision(db_name, template)
+
+    with cluster.connection(db_name) as conn:
+        conn.command("INSERT INTO events (id, kind) VALUES (1, 'click')")
+        rows = conn.query("SELECT kind, n FROM events_by_kind")
+    with cluster.connection(template) as conn:
+        template_rows = conn.query("SELECT count() AS n FROM events_by_kind")
+
+    assert rows == [{"kind": "click", "n": 1}]
+    assert template_rows == [{"n": 0}]
+
+
+def test_provision_into_non_empty_database(cluster, template):
+    with pytest.raises(MigrationException, match="not empty"):
+        cluster.provision(template, template)
+
+
+def test_provision_from_unmigrated_template(cluster):
+    with pytest.raises(MigrationException, match="no schema_versions"):
+        cluster.provision(_db_name(), f"missing_{uuid.uuid4().hex}")
+
+
+def test_provision_cli(template, capsys):
+    db_name = _db_name()
+    ctx = get_context(
+        [
+            "provision",
+            "--driver",
+            "chdb",
+            "--db-name",
+            db_name,
+            "--from-template",
+            template,
+            "--parallelism",
+            "1",
+        ]
+    )
+
+    created = provision(ctx)
+
+    assert "events" in created
+    assert (
+        f"Provisioned {db_name} from {template} with {len(created)} objects"
+        in capsys.readouterr().out
+    )
+
+
+def test_provision_cli_rejects_cluster_name(template):
+    ctx = get_context(
+        [
+            "provision",
+            "--driver",
+            "chdb",
+            "--db-name",
+            _db_name(),
+            "--from-template",
+            template,
+            "--cluster-name",
+            "company_cluster",
+        ]
+    )
+
+    with pytest.raises(MigrationException, match="does not support --cluster-name"):
+        provision(ctx)
@@ -0,0 +1,195 @@
+import sys
+
+import pytest
+
+from clickhouse_migrations import command_line
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.command_line import format_replicas, get_context, main
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.replicas import (
+    REPLICA_DIVERGED,
+    REPLICA_LAGGING,
+    REPLICA_OK,
+    ReplicaRow,
+    query_replicas,
+    replica_states,
+    replicas_query,
+    tables_query,
+)
+from tests.conftest import RecordingConnection
+
+
+def _replica(host, applied, versions_digest, fingerprint, shard=1):
+    return ReplicaRow(host, shard, applied, applied, versions_digest, fingerprint, None)
+
+
+def test_replicas_in_sync():
+    rows = replica_states([_replica(f"ch{n}", 4, 11, 22) for n in range(4)])
+
+    assert {row.state for row in rows} == {REPLICA_OK}
+
+
+def test_lagging_and_diverged_replicas():
+    rows = replica_states(
+        [
+            _replica("ch1", 4, 11, 22),
+            _replica("ch2", 4, 11, 22),
+            _replica("ch3", 3, 10, 21),
+            _replica("ch4", 4, 11, 99, shard=2),
+            _replica("ch5", 4, 12, 22, shard=2),
+        ]
+    )
+
+    assert [row.state for row in rows] == [
+        REPLICA_OK,
+        REPLICA_OK,
+        REPLICA_LAGGING,
+        REPLICA_DIVERGED,
+        REPLICA_DIVERGED,
+    ]
+
+
+def test_replica_without_schema_versions_rows_lags():
+    rows = replica_states([_replica("ch1", 2, 11, 22), _replica("ch2", 0, 0, 22)])
+
+    assert [row.state for row in rows] == [REPLICA_OK, REPLICA_LAGGING]
+
+
+def test_no_replicas():
+    assert not replica_states([])
+
+
+def test_replicas_query_reads_every_replica():
+    query = replicas_query("db", "company_cluster")
+
+    assert "clusterAllReplicas('company_cluster', 'db', 'schema_versions')" in query
+    assert "clusterAllReplicas('company_cluster', system.columns)" in query
+    assert "clusterAllReplicas('company_cluster', system.tables)" in query
+
+
+def test_replicas_query_without_versions_skips_schema_versions():
+    query = replicas_query("db", "company_cluster", versions=False)
+
+    assert "'db', 'schema_versions'" not in query
+    assert "clusterAllReplicas('company_cluster', system.tables)" in query
+    assert "schema_versions" in tables_query("db", "company_cluster")
+
+
+class _ClusterConn(RecordingConnection):
+    """Answers the tables query with the replicas lacking schema_versions
+    among ch1..ch3, and the replicas query with their fingerprints."""
+
+    def __init__(self, uninitialized):
+        super().__init__()
+        self.uninitialized = uninitialized
+        self.queries = []
+
+    def query(self, statement, settings=None):
+        self.queries.append(statement)
+        hosts = ["ch1", "ch2", "ch3"]
+        if "AS initialized" in statement:
+            return [
+                {"host": h, "shard": 1, "initialized": int(h not in self.uninitialized)}
+                for h in hosts
+            ]
+        return [
+            {
+                "initiator": "ch1",
+                "host": h,
+                "shard": 1,
+                "last_applied": 2,
+                "applied": 2,
+                "versions_digest": 11,
+                "fingerprint": 22,
+            }
+            for h in hosts
+        ]
+
+
+def test_replicas_without_schema_versions_diverged():
+    conn = _ClusterConn({"ch2"})
+
+    rows = query_replicas(conn, "db", "company_cluster")
+
+    assert [(row.host, row.state) for row in rows] == [
+        ("ch1", REPLICA_OK),
+        ("ch2", REPLICA_DIVERGED),
+        ("ch3", REPLICA_OK),
+    ]
+    assert "'db', 'schema_versions'" not in conn.queries[-1]
+
+
+def test_replicas_with_schema_versions_compare_histories():
+    conn = _ClusterConn(set())
+
+    rows = query_replicas(conn, "db", "company_cluster")
+
+    assert {row.state for row in rows} == {REPLICA_OK}
+    assert "'db', 'schema_versions'" in conn.queries[-1]
+
+
+def test_verify_replicas_requires_a_cluster_name():
+    with pytest.raises(MigrationException, match="cluster name"):
+        ClickhouseCluster().verify_replicas("db", None)
+
+
+def test_format_replicas():
+    assert format_replicas([]) == "No replicas found."
+
+    text = format_replicas(
+        replica_states([_replica("ch1", 4, 11, 255), _replica("ch2", 3, 10, 255)])
+    )
+
+    assert text.splitlines()[0] == "2 replicas: 1 ok, 1 lagging, 0 diverged"
+    assert "1      ch2   3             3        00000000000000ff  lagging" in text
+
+
+@pytest.mark.parametrize(
+    "states, code", [((REPLICA_OK, REPLICA_OK), 0), ((REPLICA_OK, REPLICA_LAGGING), 1)]
+)
+def test_verify_replicas_exit_code(monkeypatch, states, code):
+    rows = [_replica("ch", 1, 1, 1)._replace(state=state) for state in states]
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["clickhouse-migrations", "verify-replicas", "--cluster-name", "c"],
+    )
+    monkeypatch.setattr(command_line, "show_replicas", lambda ctx: rows)
+
+    assert main() == code
+
+
+def test_drift_exit_code(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["clickhouse-migrations", "drift"])
+    monkeypatch.setattr(command_line, "show_drift", lambda ctx: [])
+    assert main() == 0
+
+    monkeypatch.setattr(command_line, "show_drift", lambda ctx: ["drifted"])
+    assert main() == 1
+
+
+def test_verify_replicas_subcommand():
+    context = get_context(["verify-replicas", "--cluster-name", "c", "--db-name", "x"])
+
+    assert context.command == "verify-replicas"
+    assert context.cluster_name == "c"
+
+
+def test_connected_replica_is_the_reference():
+    # A migration without ON CLUSTER only created its table on the server it
+    # ran against; the replicas missing it diverged, even though they are
+    # the majority.
+    rows = replica_states(
+        [
+            _replica("ch1", 1, 11, 22),
+            _replica("ch2", 1, 11, 0),
+            _replica("ch3", 1, 11, 0),
+        ],
+        reference_host="ch1",
+    )
+
+    assert [row.state for row in rows] == [
+        REPLICA_OK,
+        REPLICA_DIVERGED,
+        REPLICA_DIVERGED,
+    ]
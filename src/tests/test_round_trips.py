@@ -0,0 +1,269 @@
+import shutil
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from pathlib import Path
+
+import pytest
+from clickhouse_connect.driver.exceptions import DatabaseError
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.migrator import STATUS_APPLIED, STATUS_PENDING
+from clickhouse_migrations.watch import Watcher
+from tests.stub_server import ClickhouseStub
+
+pytest.importorskip("chdb")
+
+TESTS_DIR = Path(__file__).parent
+
+# Round trips of every new clickhouse-connect client: server version,
+# settings discovery and a connectivity check.
+CONNECT = 3
+# Schema table setup of every migrate: CREATE TABLE and the comparison of the
+# local migrations with schema_versions.
+INIT_SCHEMA = 2
+
+
+@pytest.fixture(name="stub", scope="module")
+def fixture_stub():
+    with ClickhouseStub() as stub:
+        yield stub
+
+
+@pytest.fixture(name="cluster")
+def fixture_cluster(stub):
+    stub.reset()
+    return ClickhouseCluster(
+        db_host=stub.host,
+        db_port=stub.port,
+        db_name=f"stub_{uuid.uuid4().hex}",
+        driver="clickhouse-connect",
+        compress=False,
+    )
+
+
+def migrate_budget(migrations, statements):
+    # Two clients (server level, then database level), CREATE DATABASE, the
+    # schema setup, then per migration its statements, and a DESCRIBE plus
+    # an INSERT for the schema_versions row.
+    return 2 * CONNECT + 1 + INIT_SCHEMA + statements + 2 * migrations
+
+
+def test_fresh_database(cluster, stub):
+    applied = cluster.migrate(None, TESTS_DIR / "complex_migrations")
+
+    assert len(applied) == 4
+    assert stub.round_trips == migrate_budget(migrations=4, statements=7)
+    assert not any(request.failed for request in stub.requests)
+
+
+def test_pending_on_top_of_applied(cluster, stub, tmp_path):
+    migrations_dir = tmp_path / "migrations"
+    migrations_dir.mkdir()
+    shutil.copy(TESTS_DIR / "complex_migrations" / "001_init.sql", migrations_dir)
+    cluster.migrate(None, migrations_dir)
+
+    shutil.copytree(
+        TESTS_DIR / "complex_migrations", migrations_dir, dirs_exist_ok=True
+    )
+    stub.reset()
+    applied = cluster.migrate(None, migrations_dir)
+
+    assert [m.version for m in applied] == [2, 3, 10]
+    assert stub.round_trips == migrate_budget(migrations=3, statements=6)
+
+
+def test_nothing_pending(cluster, stub):
+    cluster.migrate(None, TESTS_DIR / "complex_migrations")
+    stub.reset()
+
+    assert cluster.migrate(None, TESTS_DIR / "complex_migrations") == []
+    assert stub.round_trips == migrate_budget(migrations=0, statements=0)
+
+
+def test_status_only(cluster, stub):
+    cluster.migrate(None, TESTS_DIR / "complex_migrations")
+    stub.reset()
+
+    cluster.status(None, TESTS_DIR / "complex_migrations")
+
+    # Two clients, the schema table check and one SELECT of applied rows.
+    assert stub.round_trips == 2 * CONNECT + 2
+    assert not any(q.lstrip().upper().startswith("CREATE") for q in stub.queries())
+
+
+def test_status_of_uninitialized_database(cluster, stub):
+    cluster.status(None, TESTS_DIR / "complex_migrations")
+
+    assert stub.round_trips == CONNECT + 1
+
+
+def test_injected_failure_stops_the_run(cluster, stub):
+    stub.fail(r"CREATE TABLE sample21", message="Too many parts", times=1)
+
+    with pytest.raises(DatabaseError, match="Too many parts"):
+        cluster.migrate(None, TESTS_DIR / "complex_migrations")
+
+    assert [request.failed for request in stub.requests].count(True) == 1
+    rows = cluster.status(None, TESTS_DIR / "complex_migrations")
+    assert [(row.version, row.state) for row in rows][:2] == [
+        (1, STATUS_APPLIED),
+        (2, STATUS_PENDING),
+    ]
+
+    # The rule fired once; a retry applies the remaining migrations.
+    applied = cluster.migrate(None, TESTS_DIR / "complex_migrations")
+    assert [m.version for m in applied] == [2, 3, 10]
+
+
+def test_latency_is_applied_per_request(cluster, stub):
+    stub.latency = 0.05
+    try:
+        started = time.perf_counter()
+        cluster.status(None, TESTS_DIR / "complex_migrations")
+        elapsed = time.perf_counter() - started
+    finally:
+        stub.latency = 0.0
+
+    assert elapsed >= stub.round_trips * 0.05
+
+
+def _post(stub, sql, path="/"):
+    request = urllib.request.Request(
+        f"http://{stub.host}:{stub.port}{path}", data=sql.encode()
+    )
+    with urllib.request.urlopen(request) as response:
+        return response.read()
+
+
+def test_stub_ping_and_query_in_url(stub):
+    with urllib.request.urlopen(f"http://{stub.host}:{stub.port}/ping") as response:
+        assert response.read() == b"Ok.\n"
+
+    query = urllib.parse.urlencode({"query": "SELECT 1 + 1"})
+    assert _post(stub, "", f"/?{query}") == b"2\n"
+
+
+def test_stub_failure_times_and_server_errors(stub):
+    stub.fail(r"SELECT 42", code=241, times=2)
+
+    for _ in range(2):
+        with pytest.raises(urllib.error.HTTPError) as exc_info:
+            _post(stub, "SELECT 42")
+        assert exc_info.value.headers["X-ClickHouse-Exception-Code"] == "241"
+    assert _post(stub, "SELECT 42") == b"42\n"
+
+    with pytest.raises(urllib.error.HTTPError) as exc_info:
+        _post(stub, "SELEC 42")
+    assert exc_info.value.headers["X-ClickHouse-Exception-Code"] == "62"
+
+
+def test_drift_checks_many_databases_at_once(stub):
+    prefix = f"stub_{uuid.uuid4().hex[:12]}_"
+    for n in range(3):
+        ClickhouseCluster(
+            db_host=stub.host,
+            db_port=stub.port,
+            driver="clickhouse-connect",
+            compress=False,
+        ).migrate(
+            f"{prefix}{n}", TESTS_DIR / "complex_migrations", record_fingerprint=True
+        )
+    cluster = ClickhouseCluster(
+        db_host=stub.host,
+        db_port=stub.port,
+        driver="clickhouse-connect",
+        compress=False,
+    )
+    stub.reset()
+
+    assert not cluster.drift(db_pattern=f"^{prefix}", diff=True)
+    # One client, the check for recorded fingerprints and the drift query.
+    assert stub.round_trips == CONNECT + 2
+
+
+def test_fleet_status_checks_many_databases_at_once(stub):
+    prefix = f"stub_{uuid.uuid4().hex[:12]}_"
+    cluster = ClickhouseCluster(
+        db_host=stub.host,
+        db_port=stub.port,
+        driver="clickhouse-connect",
+        compress=False,
+    )
+    for n in range(3):
+        cluster.migrate(f"{prefix}{n}", TESTS_DIR / "complex_migrations")
+    stub.reset()
+
+    rows = cluster.fleet_status(
+        TESTS_DIR / "complex_migrations", db_pattern=f"^{prefix}"
+    )
+
+    assert [row.pending for row in rows] == [0, 0, 0]
+    # One client, the discovery of migrated databases and one merge() query.
+    assert stub.round_trips == CONNECT + 2
+
+
+def test_locked_runner_after_head_is_reached(cluster, stub):
+    cluster.migrate(None, TESTS_DIR / "complex_migrations", lock_ttl=30)
+    stub.reset()
+
+    assert cluster.migrate(None, TESTS_DIR / "complex_migrations", lock_ttl=30) == []
+
+    # Two clients, CREATE DATABASE, the schema and lock tables, then a single
+    # poll finds the head applied: no OPTIMIZE and no scan of schema_versions.
+    assert stub.round_trips == 2 * CONNECT + 4
+    assert not any("OPTIMIZE" in query for query in stub.queries())
+
+
+def test_watcher_applies_a_new_file_with_warm_state(cluster, stub, tmp_path):
+    migrations_dir = Path(
+        shutil.copytree(TESTS_DIR / "complex_migrations", tmp_path / "migrations")
+    )
+    with Watcher(cluster, None, migrations_dir) as watcher:
+        watcher.apply_changes()
+        stub.reset()
+        assert not watcher.apply_changes()
+        assert stub.round_trips == 0
+
+        (migrations_dir / "011_more.sql").write_text(
+            "CREATE TABLE more (id UInt8) ENGINE = Memory;", encoding="utf8"
+        )
+        assert [m.version for m in watcher.apply_changes()] == [11]
+
+    # The statement, then a DESCRIBE plus an INSERT for the schema_versions
+    # row: no new client, no OPTIMIZE and no scan of schema_versions.
+    assert stub.round_trips == 3
+
+
+def test_nothing_pending_with_a_warm_applied_cache(stub, tmp_path):
+    stub.reset()
+    cluster = ClickhouseCluster(
+        db_host=stub.host,
+        db_port=stub.port,
+        db_name=f"stub_{uuid.uuid4().hex}",
+        driver="clickhouse-connect",
+        compress=False,
+        applied_cache=tmp_path / "cache",
+    )
+    cluster.migrate(None, TESTS_DIR / "complex_migrations")
+    cluster.migrate(None, TESTS_DIR / "complex_migrations")
+    stub.reset()
+
+    assert not cluster.migrate(None, TESTS_DIR / "complex_migrations")
+
+    # The probe of schema_versions replaces the comparison with it.
+    assert stub.round_trips == migrate_budget(migrations=0, statements=0)
+    assert not any("OPTIMIZE" in query for query in stub.queries())
+
+
+def test_ensure_migrated_at_head(cluster, stub):
+    cluster.migrate(None, TESTS_DIR / "complex_migrations")
+    stub.reset()
+
+    assert cluster.ensure_migrated(None, TESTS_DIR / "complex_migrations") == []
+
+    # One client, the schema table check and the checksum of schema_versions.
+    assert stub.round_trips == CONNECT + 2
+    assert not any("OPTIMIZE" in query for query in stub.queries())
@@ -0,0 +1,74 @@
+import pytest
+
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.schema import SchemaObject, dependency_layers, schema_objects
+
+
+def _obj(name, *depends_on):
+    return SchemaObject(
+        name, "MergeTree", f"CREATE TABLE db.{name}", frozenset(depends_on)
+    )
+
+
+def test_dependency_layers():
+    layers = dependency_layers(
+        [_obj("mv", "src", "dst"), _obj("src"), _obj("dst"), _obj("view", "mv")]
+    )
+
+    assert [sorted(obj.name for obj in layer) for layer in layers] == [
+        ["dst", "src"],
+        ["mv"],
+        ["view"],
+    ]
+
+
+def test_dependency_layers_cycle():
+    with pytest.raises(MigrationException, match="Circular dependency between: a, b"):
+        dependency_layers([_obj("a", "b"), _obj("b", "a"), _obj("c")])
+
+
+class _TablesConn:  # pylint: disable=too-few-public-methods
+    def __init__(self, rows):
+        self.rows = rows
+
+    def query(self, _statement):
+        return self.rows
+
+
+def test_schema_objects_dependencies():
+    def row(name, query, dependencies=(), loading=()):
+        return {
+            "name": name,
+            "engine": "X",
+            "create_table_query": query,
+            "dependencies_table": list(dependencies),
+            "loading_dependencies_table": list(loading),
+        }
+
+    conn = _TablesConn(
+        [
+            row("schema_versions", "CREATE TABLE db.schema_versions"),
+            row(".inner_id.1234", "CREATE TABLE db.`.inner_id.1234`"),
+            row("src", "CREATE TABLE db.src", dependencies=["mv"]),
+            row("dst", "CREATE TABLE db.dst"),
+            row("mv", "CREATE MATERIALIZED VIEW db.mv TO db.dst AS SELECT 1"),
+            row("odd name", "CREATE TABLE `db`.`odd name`"),
+            row("v", "CREATE VIEW db.v AS SELECT * FROM `db`.`odd name`, other.src"),
+            row(
+                "dict",
+                "CREATE DICTIONARY db.dict SOURCE(CLICKHOUSE(TABLE 'src'))",
+                loading=["src"],
+            ),
+        ]
+    )
+
+    objects = {obj.name: obj.depends_on for obj in schema_objects(conn, "db")}
+
+    assert objects == {
+        "src": frozenset(),
+        "dst": frozenset(),
+        "mv": frozenset({"src", "dst"}),
+        "odd name": frozenset(),
+        "v": frozenset({"odd name"}),
+        "dict": frozenset({"src"}),
+    }
@@ -0,0 +1,183 @@
+import shutil
+import uuid
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations.clickhouse_cluster import ClickhouseCluster
+from clickhouse_migrations.command_line import get_context, squash
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.hooks import MigrationHook
+from clickhouse_migrations.metrics import RunMetrics
+from clickhouse_migrations.migration import MigrationStorage
+from clickhouse_migrations.migrator import STATUS_APPLIED
+from clickhouse_migrations.profiler import CATEGORY_MIGRATION, Profiler
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+class MigrationRecorder(MigrationHook):
+    def __init__(self):
+        self.versions = []
+        self.baselines = []
+
+    def before_migration(self, migration):
+        self.versions.append(migration.version)
+
+    def before_baseline(self, baseline, versions):
+        self.baselines.append((baseline.version, versions))
+
+
+@pytest.fixture(name="migrations_dir")
+def fixture_migrations_dir(tmp_path):
+    return Path(shutil.copytree(SQUASH_MIGRATIONS, tmp_path / "migrations"))
+
+
+@pytest.fixture(name="recorder")
+def fixture_recorder():
+    return MigrationRecorder()
+
+
+@pytest.fixture(name="cluster")
+def fixture_cluster(recorder):
+    return ClickhouseCluster(driver="chdb", hooks=[recorder])
+
+
+def _db_name():
+    return f"squash_test_{uuid.uuid4().hex}"
+
+
+def test_squash_writes_schema_in_dependency_order(cluster, migrations_dir):
+    path = cluster.squash(migrations_dir, 3)
+
+    assert path == migrations_dir / "003_baseline.baseline.sql"
+    script = path.read_text(encoding="utf8")
+    # The dropped table and column are gone; views follow what they read.
+    assert "scratch" not in script
+    assert "payload" not in script
+    assert (
+        script.index('"{database}".events ')
+        < script.index("CREATE MATERIALIZED VIEW")
+        < script.index('CREATE VIEW "{database}".recent_events')
+        < script.index('CREATE VIEW "{database}".recent_kinds')
+    )
+    assert '"{database}".kinds ' not in script
+    # The baseline is not picked up as a migration.
+    assert [m.version for m in MigrationStorage(migrations_dir).migrations()] == [
+        1,
+        2,
+        3,
+        4,
+    ]
+
+
+def test_fresh_database_applies_baseline(cluster, migrations_dir, recorder):
+    cluster.squash(migrations_dir, 3)
+    db_name = _db_name()
+
+    applied = cluster.migrate(db_name, migrations_dir)
+
+    assert [m.version for m in applied] == [1, 2, 3, 4]
+    assert recorder.baselines == [(3, 3)]
+    assert recorder.versions == [4]
+    rows = cluster.status(db_name, migrations_dir)
+    assert {row.state for row in rows} == {STATUS_APPLIED}
+    assert {"events_by_kind_mv", "recent_kinds", "kinds"} <= set(
+        cluster.show_tables(db_name)
+    )
+    assert "scratch" not in cluster.show_tables(db_name)
+
+
+def test_baseline_counts_every_version_it_records(migrations_dir):
+    metrics = RunMetrics()
+    profiler = Profiler()
+    cluster = ClickhouseCluster(driver="chdb", hooks=[metrics, profiler])
+    cluster.squash(migrations_dir, 3)
+
+    cluster.migrate(_db_name(), migrations_dir)
+
+    assert metrics.migrations_applied == 4
+    spans = [s for s in profiler.spans if s.category == CATEGORY_MIGRATION]
+    assert [span.args for span in spans] == [
+        {"version": 3, "versions": 3},
+        {"version": 4},
+    ]
+
+
+def test_database_with_history_ignores_baseline(
+    cluster, migrations_dir, recorder, monkeypatch
+):
+    db_name = _db_name()
+    cluster.migrate(db_name, migrations_dir, explicit_migrations=["1"])
+    cluster.squash(migrations_dir, 3)
+    recorder.versions.clear()
+    loads = []
+    baseline = MigrationStorage.baseline
+
+    def counted(storage):
+        loads.append(storage)
+        return baseline(storage)
+
+    monkeypatch.setattr(MigrationStorage, "baseline", counted)
+
+    applied = cluster.migrate(db_name, migrations_dir)
+
+    assert [m.version for m in applied] == [2, 3, 4]
+    assert recorder.versions == [2, 3, 4]
+    assert not recorder.baselines
+    assert not loads
+
+
+def test_baseline_of_changed_migrations_is_rejected(cluster, migrations_dir):
+    cluster.squash(migrations_dir, 3)
+    with open(migrations_dir / "002_rollups.sql", "a", encoding="utf8") as script:
+        script.write("-- edited after squashing\n")
+
+    with pytest.raises(MigrationException, match="re-run squash"):
+        cluster.migrate(_db_name(), migrations_dir)
+
+
+def test_dry_run_with_baseline_records_nothing(cluster, migrations_dir):
+    cluster.squash(migrations_dir, 3)
+    db_name = _db_name()
+
+    cluster.migrate(db_name, migrations_dir, dryrun=True)
+
+    assert cluster.show_tables(db_name) == ["schema_versions"]
+
+
+def test_squash_unknown_version(cluster, migrations_dir):
+    with pytest.raises(MigrationException, match="No migration with version 5"):
+        cluster.squash(migrations_dir, 5)
+
+
+def test_baseline_without_sources_header(migrations_dir):
+    (migrations_dir / "003_baseline.baseline.sql").write_text(
+        "CREATE TABLE t (id UInt8) ENGINE = Memory;", encoding="utf8"
+    )
+
+    with pytest.raises(MigrationException, match="sources"):
+        MigrationStorage(migrations_dir).baseline()
+
+
+def test_squash_cli(migrations_dir, tmp_path, capsys):
+    output = tmp_path / "baseline.baseline.sql"
+    ctx = get_context(
+        [
+            "squash",
+            "--driver",
+            "chdb",
+            "--migrations-dir",
+            str(migrations_dir),
+            "--up-to",
+            "2",
+            "--output",
+            str(output),
+        ]
+    )
+
+    assert squash(ctx) == output
+    assert f"Baseline written to {output}" in capsys.readouterr().out
+    assert "events_by_kind_mv" in output.read_text(encoding="utf8")
@@ -0,0 +1,68 @@
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Set
+
+import clickhouse_migrations
+
+SRC_DIR = Path(clickhouse_migrations.__file__).parent.parent
+
+DRIVER_MODULES = ("clickhouse_driver", "clickhouse_connect", "chdb")
+
+# Modules only the commands running migrations need, and what they import.
+COMMAND_MODULES = (
+    "clickhouse_migrations.clickhouse_cluster",
+    "clickhouse_migrations.bundle",
+    "clickhouse_migrations.metrics",
+    "clickhouse_migrations.profiler",
+    "clickhouse_migrations.tokenizing",
+    "clickhouse_migrations.watch",
+    "ctypes",
+    "mmap",
+    "multiprocessing",
+    "tracemalloc",
+)
+
+
+def _modules_imported_by(argv: List[str]) -> Set[str]:
+    """Run the CLI with argv in a fresh interpreter and return the names of
+    every module imported by then."""
+    code = (
+        "import sys\n"
+        f"sys.argv = ['clickhouse-migrations', *{argv!r}]\n"
+        "from clickhouse_migrations.command_line import main\n"
+        "try:\n"
+        "    main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "sys.stderr.write('\\n'.join(sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stderr.splitlines())
+
+
+def _drivers(modules: Set[str]) -> List[str]:
+    return [name for name in modules if name.split(".")[0] in DRIVER_MODULES]
+
+
+def test_help_imports_no_driver_and_no_version_lookup():
+    modules = _modules_imported_by(["--help"])
+
+    assert "clickhouse_migrations.command_line" in modules
+    assert not _drivers(modules)
+    assert "importlib.metadata" not in modules
+    assert not modules.intersection(COMMAND_MODULES)
+
+
+def test_version_subcommand_does_not_import_drivers():
+    modules = _modules_imported_by(["version"])
+
+    assert not _drivers(modules)
+    assert not modules.intersection(COMMAND_MODULES)
+    assert "importlib.metadata" in modules
@@ -0,0 +1,83 @@
+import multiprocessing
+
+import pytest
+
+from clickhouse_migrations.bundle import MigrationBundle, write_bundle
+from clickhouse_migrations.command_line import get_context
+from clickhouse_migrations.migration import Migration
+from clickhouse_migrations.migrator import Migrator
+from clickhouse_migrations.tokenizing import POOL_MIN_SCRIPT_SIZE, statements_ahead
+from tests.conftest import RecordingConnection
+
+
+def _large_script(version):
+    # Semicolons in a string literal, so that splitting takes the tokenizer.
+    padding = "x;" * (POOL_MIN_SCRIPT_SIZE // 2)
+    return f"SELECT '{padding}';\nCREATE TABLE t{version} (a String) ENGINE = Log;\n"
+
+
+def _migrations(tmp_path):
+    migrations = [
+        Migration(
+            version=v,
+            md5=f"md5{v}",
+            script="SELECT 1;" if v == 3 else _large_script(v),
+        )
+        for v in range(1, 7)
+    ]
+    (tmp_path / "020_bundled.sql").write_text("SELECT 2; SELECT 3;", encoding="utf8")
+    migrations += MigrationBundle(write_bundle(tmp_path)).migrations()
+    return migrations
+
+
+def _failing_spans(script):
+    raise ValueError(f"cannot split {len(script)} characters")
+
+
+def _split(migration):
+    return Migrator.script_to_statements(migration.script, True)
+
+
+def test_statements_ahead_keeps_the_order(tmp_path):
+    migrations = _migrations(tmp_path)
+
+    statements = list(
+        statements_ahead(migrations, Migrator.statement_spans, _split, workers=2)
+    )
+
+    assert statements == [_split(m) for m in migrations]
+    assert not multiprocessing.active_children()
+
+
+def test_worker_errors_stop_the_pool(tmp_path):
+    with pytest.raises(ValueError, match="cannot split"):
+        list(statements_ahead(_migrations(tmp_path), _failing_spans, _split, 2))
+
+    assert not multiprocessing.active_children()
+
+
+def test_closing_early_stops_the_pool(tmp_path):
+    split = statements_ahead(
+        _migrations(tmp_path), Migrator.statement_spans, _split, workers=2
+    )
+
+    assert next(split)
+    split.close()
+
+    assert not multiprocessing.active_children()
+
+
+def test_apply_migration_with_tokenize_workers(tmp_path):
+    migrations = _migrations(tmp_path)
+    inline, pooled = RecordingConnection(), RecordingConnection()
+
+    Migrator(inline).apply_migration(migrations, True)
+    applied = Migrator(pooled, tokenize_workers=2).apply_migration(migrations, True)
+
+    assert applied == migrations
+    assert pooled.commands == inline.commands
+
+
+def test_tokenize_workers_option():
+    assert get_context([]).tokenize_workers == 0
+    assert get_context(["migrate", "--tokenize-workers", "4"]).tokenize_workers == 4
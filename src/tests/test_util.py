@@ -0,0 +1,25 @@
+from clickhouse_migrations.util import rewrite_database
+
+
+def test_rewrite_database():
+    statement = (
+        "CREATE MATERIALIZED VIEW db.mv TO `db`.dst AS "
+        "SELECT dictGet('db.dict', 'v', id) FROM \"db\".src, dbx.t, x.db.y "
+        "WHERE name = 'db'"
+    )
+
+    assert rewrite_database(statement, "db", "new") == (
+        'CREATE MATERIALIZED VIEW "new".mv TO "new".dst AS '
+        "SELECT dictGet('new.dict', 'v', id) FROM \"new\".src, dbx.t, x.db.y "
+        "WHERE name = 'new'"
+    )
+
+
+def test_rewrite_database_round_trip():
+    statement = "CREATE VIEW db.v AS SELECT * FROM db.t"
+    placeholder = rewrite_database(statement, "db", "{database}")
+
+    assert placeholder == 'CREATE VIEW "{database}".v AS SELECT * FROM "{database}".t'
+    assert rewrite_database(placeholder, "{database}", "db") == (
+        'CREATE VIEW "db".v AS SELECT * FROM "db".t'
+    )
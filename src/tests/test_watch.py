@@ -0,0 +1,165 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from clickhouse_migrations import watch as watch_module
+from clickhouse_migrations.command_line import get_context
+from clickhouse_migrations.exceptions import MigrationException
+from clickhouse_migrations.migration import MigrationIndex, MigrationStorage
+from clickhouse_migrations.watch import Watcher
+
+pytest.importorskip("chdb")
+
+SQUASH_MIGRATIONS = Path(__file__).parent / "squash_migrations"
+
+
+@pytest.fixture(name="migrations_dir")
+def fixture_migrations_dir(tmp_path):
+    return Path(shutil.copytree(SQUASH_MIGRATIONS, tmp_path / "migrations"))
+
+
+def _add_migration(migrations_dir, name, script):
+    (migrations_dir / name).write_text(script, encoding="utf8")
+
+
+def test_index_only_rereads_changed_files(migrations_dir, monkeypatch):
+    index = MigrationIndex(MigrationStorage(migrations_dir))
+    assert index.refresh()
+    assert index.migrations() == MigrationStorage(migrations_dir).migrations()
+
+    read = []
+    read_bytes = Path.read_bytes
+    monkeypatch.setattr(
+        Path, "read_bytes", lambda path: read.append(path.name) or read_bytes(path)
+    )
+    assert not index.refresh()
+    assert not read
+
+    _add_migration(migrations_dir, "005_extra.sql", "SELECT 1;")
+    (migrations_dir / "001_events.down.sql").write_text("SELECT 2;", encoding="utf8")
+    assert index.refresh()
+    assert read == ["005_extra.sql"]
+    assert [m.version for m in index.migrations()] == [1, 2, 3, 4, 5]
+
+    os.remove(migrations_dir / "005_extra.sql")
+    assert index.refresh()
+    assert [m.version for m in index.migrations()] == [1, 2, 3, 4]
+
+
+def test_index_rejects_duplicate_versions(migrations_dir):
+    _add_migration(migrations_dir, "004_again.sql", "SELECT 1;")
+
+    with pytest.raises(MigrationException, match="Duplicate migration version 4"):
+        MigrationIndex(MigrationStorage(migrations_dir)).refresh()
+
+
+def test_watcher_applies_new_migrations(cluster, db_name, migrations_dir):
+    with Watcher(cluster, db_name, migrations_dir) as watcher:
+        assert [m.version for m in watcher.apply_changes()] == [1, 2, 3, 4]
+        assert not watcher.apply_changes()
+
+        _add_migration(
+            migrations_dir,
+            "005_extra.sql",
+            "CREATE TABLE extra (id UInt8) ENGINE = Memory;",
+        )
+        assert [m.version for m in watcher.apply_changes()] == [5]
+
+    assert "extra" in cluster.show_tables(db_name)
+
+
+def test_watcher_reports_edited_migrations(cluster, db_name, migrations_dir):
+    with Watcher(cluster, db_name, migrations_dir) as watcher:
+        watcher.apply_changes()
+
+        with open(migrations_dir / "003_cleanup.sql", "a", encoding="utf8") as script:
+            script.write("\n-- edited after being applied\n")
+        with pytest.raises(MigrationException, match="md5 is not equal"):
+            watcher.apply_changes()
+
+
+def test_watcher_retries_failed_migrations_once_changed(
+    cluster, db_name, migrations_dir
+):
+    with Watcher(cluster, db_name, migrations_dir) as watcher:
+        watcher.apply_changes()
+
+        _add_migration(migrations_dir, "005_broken.sql", "CREATE TABLE broken;")
+        with pytest.raises(Exception):
+            watcher.apply_changes()
+        assert not watcher.apply_changes()
+
+        _add_migration(
+            migrations_dir,
+            "005_broken.sql",
+            "CREATE TABLE fixed (id UInt8) ENGINE = Memory;",
+        )
+        assert [m.version for m in watcher.apply_changes()] == [5]
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_watch_until_stopped(
+    cluster, db_name, migrations_dir, monkeypatch, caplog, inotify
+):
+    if not inotify:
+        monkeypatch.setattr(watch_module, "_directory_events", lambda path: None)
+    stop = threading.Event()
+
+    with Watcher(cluster, db_name, migrations_dir, poll_interval=0.05) as watcher:
+        watcher.apply_changes()
+        watching = threading.Thread(target=watcher.watch, args=(stop,))
+        with caplog.at_level(logging.INFO):
+            watching.start()
+            try:
+                _add_migration(
+                    migrations_dir,
+                    "005_extra.sql",
+                    "CREATE TABLE extra (id UInt8) ENGINE = Memory;",
+                )
+                deadline = time.monotonic() + 10
+                while "Applied migrations 5" not in caplog.text:
+                    assert time.monotonic() < deadline
+                    time.sleep(0.05)
+            finally:
+                stop.set()
+                watching.join()
+
+    assert "extra" in cluster.show_tables(db_name)
+
+
+def test_polling_waits_for_files_being_written(
+    cluster, db_name, migrations_dir, monkeypatch
+):
+    monkeypatch.setattr(watch_module, "_directory_events", lambda path: None)
+    stop = threading.Event()
+
+    def write_slowly():
+        # An empty file is a valid, empty migration: applied as such, its
+        # content would then be refused as an edit of an applied migration.
+        with open(migrations_dir / "005_extra.sql", "w", encoding="utf8") as script:
+            time.sleep(0.03)
+            script.write("CREATE TABLE extra (id UInt8) ENGINE = Memory;")
+        stop.set()
+
+    with Watcher(cluster, db_name, migrations_dir, poll_interval=0.01) as watcher:
+        watcher.apply_changes()
+        writer = threading.Timer(0.05, write_slowly)
+        writer.start()
+        watcher.watch(stop)
+        writer.join()
+        assert [m.version for m in watcher.apply_changes()] in ([5], [])
+
+    assert "extra" in cluster.show_tables(db_name)
+
+
+def test_watch_options():
+    context = get_context(["watch", "--poll-interval", "0.5", "--no-multi-statement"])
+
+    assert context.command == "watch"
+    assert context.poll_interval == 0.5
+    assert context.multi_statement is False